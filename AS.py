@@ -1,10 +1,23 @@
+import time
+started_at = time.perf_counter()
+
+import config
+from modules import logging_utils
 from modules.CognitiveFeedbackRouter import CognitiveFeedbackRouter
+from modules.Configuration import Configuration
 
 import asyncio
 
+startup_phases = {'imports': time.perf_counter() - started_at}
+
 def main():
-    cfr = CognitiveFeedbackRouter()
+    logging_start = time.perf_counter()
+    logging_utils.setup_logging(file_log_level=config.file_log_level, console_log_level=config.console_log_level)
+    startup_phases['logging'] = time.perf_counter() - logging_start
+    Configuration.report()
+
+    cfr = CognitiveFeedbackRouter(started_at=started_at, startup_phases=startup_phases)
     asyncio.run(cfr.attention_switch())
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -6,21 +6,163 @@ model_path = r"llama-2-13b-chat.Q8_0.gguf"
 # Model temperature
 model_temp = 1
 
+# Where the LLM runs: 'inprocess' loads it into the AS process, 'server' uses a local llama.cpp server process
+inference_backend = 'inprocess'
+
+# Address of the llama.cpp server: 'http://host:port' or 'unix:///path/to/socket'
+inference_server_url = "http://127.0.0.1:8080"
+
+# Number of pooled connections to the llama.cpp server, i.e. maximum number of concurrent requests
+inference_pool_size = 4
+
+# Timeout for llama.cpp server requests and start (in seconds)
+inference_server_timeout = 600
+
+# Command starting the llama.cpp server when it is not running, as a list of arguments (None to require a running server)
+inference_server_command = None
+
+# Location of a small LLM file sharing the vocabulary with model_path, used as a draft model
+# for speculative decoding (None to disable)
+draft_model_path = None
+
+# Number of tokens proposed by the draft model in a single speculative decoding step
+draft_tokens_num = 8
+
+# Tasks (prompt template keys) answered by the draft model directly instead of the main model
+draft_model_tasks = ['keyword_generation', 'keyword_selection']
+
+# Memory budget (in bytes) for evaluated model states of prompt prefixes reused across prompts (0 to disable).
+# It comes on top of the model's memory, so it has to fit into the resource governor's budgets
+prefix_cache_bytes = 0
+
+# Location of the on-disk cache of responses to deterministic LLM calls
+response_cache_path = r"cache/responses.sqlite"
+
+# Maximum size (in bytes) of the response cache, least recently used responses are evicted first (0 to disable)
+response_cache_bytes = 256 << 20
+
+# Cache responses also for calls with temperature above 0
+response_cache_sampled = False
+
+# Minimum number of tokens a prompt has to leave free in the context window for generation, longer prompts
+# are trimmed in the middle; generation limits of prompt templates are capped by the space left in the context window
+generation_min_tokens = 32
+
+# Number of most recent generations per task kept for generated length statistics
+generation_stats_window = 1000
+
+# Location of generated length statistics per task, exported with generation statistics (None to disable)
+generation_stats_path = r"logs/generation_stats.json"
+
+# Constrain keyword generation and selection with a grammar to a bounded JSON list of keywords,
+# instead of free text with keywords flanked with double asterisks
+structured_keywords = False
+
+# Maximum number of keywords generated in a single structured output
+keywords_max_num = 10
+
+# Target time between process start and first user prompt (in seconds), exceeding it is reported as a warning
+startup_target_seconds = 30
+
 # Time between last interaction and activating Default Mode Network (in seconds)
 dmn_countdown = 120
 
+# If True, Default Mode Network drains the whole keyword backlog in one idle period, analyzing keyword clusters
+# (keywords sharing conversations) back to back, instead of a single LLM-selected subset of keywords
+dmn_batch_mode = False
+
+# Maximum number of keywords analyzed together as one cluster
+dmn_cluster_max_keywords = 10
+
 # Time between last input and ending interaction session
 interaction_timeout = 360
 
 # End conversation keyword to be used to avoid waiting till interaction timeout
 interaction_break = 'end_chat'
 
+# Number of worker processes running background cognition (DMN, conversation summarization, dreams),
+# each holding its own model context on memory-mapped weights (0 to run it in the main process)
+background_workers = 0
+
+# Niceness increment of background worker processes, so that interactive generation gets CPU first
+background_worker_nice = 10
+
+# Seconds a background worker is given to finish its current job when stopped, before it is terminated
+background_worker_stop_seconds = 30
+
 # Number of threads to be used in self-finetuning session
 available_threads = cpu_count()
 
+# Maximum number of threads of finetuning tools, 0 for all threads not used by the resident model
+finetune_max_threads = 0
+
+# Estimated memory used by a finetuning session, as a multiple of the base model file size
+finetune_memory_factor = 1.5
+
+# Memory budget of the entity, including worker processes and finetuning tools (in bytes), 0 for the memory available at start
+memory_budget_bytes = 0
+
+# Interval of resource usage sampling (in seconds)
+governor_sample_seconds = 5
+
+# Performance profiles per workload: 'interactive' (conversations), 'batch' (DMN, summarization, dream generation)
+# and 'finetune' (self-finetuning tools). Threads and batch size override calibrated runtime parameters, temperature
+# overrides model_temp, concurrency caps the number of generations in flight (None to keep calibrated/global values).
+# Context size (n_ctx) is applied at model load, the other settings also on live reload.
+profiles = {
+    'interactive': {'n_threads': None, 'n_threads_batch': None, 'n_batch': None, 'n_ctx': 4096,
+                    'temperature': None, 'max_tokens': 4000, 'concurrency': None},
+    'batch': {'n_threads': None, 'n_threads_batch': None, 'n_batch': None, 'n_ctx': None,
+              'temperature': None, 'max_tokens': 4000, 'concurrency': None},
+    'finetune': {'n_threads': None, 'n_threads_batch': None, 'n_batch': None, 'n_ctx': None,
+                 'temperature': None, 'max_tokens': None, 'concurrency': None},
+}
+
+# Location of a JSON file overriding settings of this file, e.g. {"model_temp": 0.7} (ignored if missing)
+config_override_path = r"config.local.json"
+
+# Prefix of environment variables overriding settings of this file and of the override file, e.g. AS_MODEL_TEMP=0.7
+config_env_prefix = "AS_"
+
+# Interval of checking the override file for changes, applied to live settings without a restart (in seconds, 0 to disable)
+config_reload_seconds = 10
+
+# Benchmark model runtime parameters (threads, batch size, mlock/mmap, NUMA) on the first start on a given host
+runtime_autotune = True
+
+# Location of the JSON file caching calibrated runtime parameters per model and host
+runtime_calibration_path = r"runtime-calibration.json"
+
 # Number of self-finetuning session training materials to be generated 
+# (the maximum number if dreams_adaptive is set)
 dreams_to_generate_num = 150
 
+# If True, dreaming stops once new dreams stop bringing new content, i.e. the mean novelty
+# of the last dream_novelty_window dreams falls below dream_novelty_threshold
+dreams_adaptive = False
+
+# Minimum number of dreams generated in the adaptive mode
+dreams_min_num = 20
+
+# Novelty of a dream is the share of its word n-grams of this length not seen in previous dreams of the session
+dream_novelty_ngram = 3
+
+# Number of most recent dreams whose mean novelty is compared with the threshold
+dream_novelty_window = 10
+
+# Mean novelty below which dreaming stops in the adaptive mode
+dream_novelty_threshold = 0.2
+
+# Minimum and maximum number of tokens of a dream kept for self-finetuning
+dream_min_tokens = 16
+dream_max_tokens = 1024
+
+# Estimated word shingles (Jaccard) similarity above which dreams are considered near-duplicates
+dream_shingle_threshold = 0.7
+
+# Embedding (cosine) similarity of dream responses above which they are considered paraphrases
+dream_embedding_threshold = 0.9
+
 # Location of folder with finetune-realted binaries
 finetune_dir = r"finetune_bins"
 
@@ -36,9 +178,50 @@ epochs = 5
 # File with lora parameters to integrate into base model
 lora_to_integrate = r"ggml-lora-LATEST-f32.gguf"
 
-# Weight of lora parameters at integration into base model 
+# Weight of lora parameters at integration into base model. In 'adapter' mode, changing it live
+# reweights all stacked adapters
 lora_weight = 1
 
+# Directory keeping previous versions of the base model, replaced by self-finetuning, for rollback
+model_store_dir = r"model_store"
+
+# Number of previous base model versions kept in the model store
+model_store_keep = 1
+
+# If True, a transplanted model is evaluated against the previous version and rolled back if it regresses
+eval_gate = False
+
+# Location of the cached probe set used to evaluate transplanted models
+eval_probes_path = r"model_store/probes.json"
+
+# Maximum number of probes, and of tokens of each probe's prompt and continuation
+eval_probes_num = 24
+eval_probe_tokens = 256
+
+# Tolerated relative increase of probe set perplexity and of per-token latency of a transplanted model
+eval_max_perplexity_increase = 0.1
+eval_max_latency_increase = 0.25
+
+# Estimated memory used by the evaluation of a transplanted model (weights and logits of all probe tokens),
+# as a multiple of the model file size
+eval_memory_factor = 1.2
+
+# LoRA integration mode: 'merge' rewrites the base model after every self-finetuning session,
+# 'adapter' keeps base weights and applies stacked LoRA adapters to the resident model at runtime.
+# In 'adapter' mode each new adapter is trained against the bare base model, not against the stack
+# of previous adapters, so stacked adapters are independent deltas until they are compacted.
+# Reweighting attached adapters without a reload requires llama-cpp-python 0.2.86 or later.
+lora_mode = 'merge'
+
+# Directory with LoRA adapters stacked on top of the base model (used in 'adapter' mode)
+lora_dir = r"lora_adapters"
+
+# Number of stacked LoRA adapters triggering their merge into the base model (used in 'adapter' mode)
+lora_compaction_threshold = 5
+
+# Higher precision model used as a base when applying LoRA adapters to a quantized model (None to skip)
+lora_base = None
+
 # Granularity level of logs saved to a file 
 file_log_level = 10
 
@@ -54,11 +237,84 @@ conclusions_dir = r"conclusions"
 # Directory containing generated training materials
 context_dir = r"dreams"
 
+# Interval of scanning conclusions and dreams directories where inotify is not available (in seconds)
+thalamus_poll_seconds = 5
+
+# Number of threads running file operations of coroutines
+io_threads = 4
+
+# Directory of lock files used to serialize concurrent access to memory files
+io_lock_dir = r"cache/locks"
+
+# Number of lock files memory files are mapped onto
+io_lock_stripes = 64
+
+# File operations called synchronously from a coroutine and lasting longer (in seconds) are reported as event loop stalls
+io_slow_seconds = 0.05
+
 #Log directory
 log_dir = r"logs"
 
+# Maximum size (in bytes) of a log segment, a full segment is compressed and a new one started
+log_max_bytes = 64 << 20
+
+# Maximum age of a log segment (in seconds) before it is compressed and a new one started
+log_segment_seconds = 6 * 3600
+
+# Location of the index of log segments and mode marks (by session, mode and timestamp)
+log_index_path = r"logs/index.sqlite"
+
+# Seconds without writes after which an unclosed log segment of a session no longer running is compressed
+log_stale_seconds = 3600
+
+# Log segments and finetuning archives older than this are removed (in days, 0 to keep them regardless of age)
+log_retention_days = 30
+
+# Maximum total size (in bytes) of log segments and finetuning archives, oldest are removed first (0 for no limit)
+log_retention_bytes = 4 << 30
+
+# Maximum number of finetuning archives (finetuning_<timestamp> directories with final LoRA files) kept
+log_finetuning_keep = 5
+
+# Location of the full-text index of saved conversations
+hippocampus_path = r"conversations/hippocampus.sqlite"
+
+# Maximum number of conversations found by full-text search added to the ones associated with keywords
+hippocampus_results = 3
+
 # Location of the JSON file serving as short term memory
 stm_path = r"conversations/short-term-memory.json"
 
+# Location of the JSON file with short term memory keyword statistics (first and last mention, number of mentions)
+stm_meta_path = r"conversations/short-term-memory.meta.json"
+
+# Maximum number of keywords kept in short term memory, the lowest scoring ones are evicted first
+stm_capacity = 500
+
+# Time after the last mention after which a keyword is forgotten (in days)
+stm_ttl_days = 90
+
+# Time after which a keyword's score (number of mentions decayed with time since the last one) halves (in days)
+stm_half_life_days = 14
+
+# Maximum number of expired keywords evicted at a time, so that eviction cost stays bounded
+stm_eviction_batch = 100
+
+# Number of highest scoring keywords offered to the LLM for interesting keywords selection
+stm_prompt_keywords = 50
+
+# Location of the checkpoint of DMN pondering interrupted by an interaction
+dmn_checkpoint_path = r"conclusions/.dmn-checkpoint.json"
+
+# Number of generated dreams buffered before they are written to the dataset file
+dream_write_batch = 16
+
+# Location of the checkpoint of dreaming interrupted by an interaction
+rem_checkpoint_path = r"dreams/.rem-checkpoint.json"
+
 # Markers dividing different parts of generated dreams - needs to be aligned with a relevant prompt
 dream_markers = {'stimulus': '**QUESTION**', 'reaction': '**RESPONSE**', 'end': '**END**'}
+
+# Settings above are validated and overridden from the environment and the override file
+from modules.Configuration import Configuration
+Configuration.apply_overrides(__name__)
@@ -0,0 +1,182 @@
+import config
+from modules import logging_utils
+
+from modules.Stem import Stem
+from modules.ModelStore import ModelStore
+
+import logging
+import os
+import json
+import math
+import time
+from glob import glob
+from typing import Optional
+
+class AnteriorCingulate:
+    """
+    A class evaluating a transplanted model before it is woken up.
+
+    The model's perplexity on a fixed probe set, built from the conversation fixtures and prior conclusions,
+    and its processing latency are compared with the previous version's. A model that regresses beyond
+    the configured tolerances is rolled back through the ModelStore. The probe set and the scores of evaluated
+    versions are cached, so that a gate costs a single pass of the new model over a few thousand tokens.
+    """
+
+    def __init__(self, store: Optional[ModelStore] = None):
+        """
+        Args:
+            store (ModelStore): Store of previous model versions
+        """
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.info(f"Instantiating {self.__class__.__name__}")
+
+        self.store = store or ModelStore()
+        self._probes_path = config.eval_probes_path
+
+    def _probe_sources(self) -> list:
+        conversations = sorted(glob(os.path.join(config.conversations_dir, "_conversation_*.txt")))
+        conclusions = sorted(glob(os.path.join('_'.join([config.conclusions_dir, 'archive']), "_conclusion_*.txt")))
+        # Interleaved, so that a capped probe set covers both kinds of text
+        sources = [path for pair in zip(conversations, conclusions) for path in pair]
+        return sources + conversations[len(conclusions):] + conclusions[len(conversations):]
+
+    def probes(self) -> list:
+        """
+        Returns the probe set, rebuilding it only if its source files changed.
+
+        Returns:
+            list: Probes as dicts with a prompt and a continuation whose perplexity is measured
+        """
+
+        sources = self._probe_sources()
+        signature = [[path, os.path.getmtime(path)] for path in sources]
+        cached = Stem.memory_read(self._probes_path, 'json') if os.path.exists(self._probes_path) else None
+        if cached and cached.get('signature') == signature:
+            return cached['probes']
+
+        self.logger.debug(f"Building probe set from {len(sources)} files.")
+        conversation_template = Stem.get_prompt("human_interaction")
+        probes = []
+        for path in sources:
+            content = Stem.memory_read(path) or ''
+            if os.path.basename(path).startswith("_conversation_"):
+                stimulus, _, rest = content.partition("User:")[2].partition("You:")
+                reaction = rest.split("User:")[0]
+                if stimulus.strip() and reaction.strip():
+                    probes.append({'source': path,
+                                   'prompt': f"{conversation_template}{stimulus.strip()} [/INST] ",
+                                   'continuation': reaction.strip()})
+            elif content.strip():
+                probes.append({'source': path, 'prompt': '', 'continuation': content.strip()})
+        probes = probes[:config.eval_probes_num]
+        Stem.memory_write(self._probes_path, json.dumps({'signature': signature, 'probes': probes}, indent=4))
+        return probes
+
+    @staticmethod
+    def _trim_middle(tokens: list, limit: int) -> list:
+        """
+        Trims tokens to a limit in the middle, keeping BOS and the instructions at the start and the latest content at the end.
+        """
+
+        if len(tokens) <= limit:
+            return tokens
+        head = limit // 4
+        return tokens[:head] + tokens[len(tokens) - (limit - head):]
+
+    def score(self, model_path: str) -> dict:
+        """
+        Measures perplexity of a model on the probe set and its processing latency.
+
+        Args:
+            model_path (str): Path to the model file
+
+        Returns:
+            dict: Perplexity and milliseconds per processed token
+        """
+
+        import numpy as np
+        import llama_cpp
+
+        self.logger.debug(f"Scoring {model_path}.")
+        llm = llama_cpp.Llama(model_path=model_path,
+                              n_ctx=config.eval_probe_tokens * 2,
+                              n_threads=config.available_threads,
+                              logits_all=True,
+                              verbose=False)
+        log_likelihood = 0.0
+        scored_tokens = 0
+        processed_tokens = 0
+        started_at = time.perf_counter()
+        for probe in self.probes():
+            prompt_tokens = self._trim_middle(llm.tokenize(probe['prompt'].encode(), add_bos=True, special=True), config.eval_probe_tokens)
+            continuation_tokens = llm.tokenize(probe['continuation'].encode(), add_bos=False)[:config.eval_probe_tokens]
+            tokens = prompt_tokens + continuation_tokens
+            llm.reset()
+            llm.eval(tokens)
+            # Logits at position i predict token i + 1
+            logits = np.asarray(llm.scores[len(prompt_tokens) - 1:len(tokens) - 1], dtype=np.float64)
+            peak = logits.max(axis=1, keepdims=True)
+            log_probs = logits - peak - np.log(np.exp(logits - peak).sum(axis=1, keepdims=True))
+            log_likelihood += float(log_probs[np.arange(len(continuation_tokens)), continuation_tokens].sum())
+            scored_tokens += len(continuation_tokens)
+            processed_tokens += len(tokens)
+        elapsed = time.perf_counter() - started_at
+        del llm
+
+        perplexity = math.exp(-log_likelihood / scored_tokens) if scored_tokens else float('inf')
+        return {'perplexity': perplexity if math.isfinite(perplexity) else None,
+                'ms_per_token': elapsed * 1000 / processed_tokens if processed_tokens else None,
+                'tokens': processed_tokens}
+
+    def _cached_score(self, model_path: str) -> dict:
+        fingerprint = Stem.model_fingerprint(model_path)
+        scores = self.store.scores(fingerprint)
+        if scores is None:
+            scores = self.score(model_path)
+            self.store.record_scores(fingerprint, scores)
+        return scores
+
+    def gate(self, model_path: str) -> bool:
+        """
+        Evaluates the model against the latest stored version, rolling it back if it regresses.
+
+        Args:
+            model_path (str): Path to the freshly transplanted model file
+
+        Returns:
+            bool: True if the model has been accepted, False if it has been rolled back
+        """
+
+        if not self.probes():
+            self.logger.warning(f"No probes available, accepting {model_path} without evaluation.")
+            return True
+
+        started_at = time.perf_counter()
+        new_scores = self._cached_score(model_path)
+        previous = self.store.latest()
+        previous_scores = None
+        if previous:
+            previous_scores = self.store.scores(previous['fingerprint'])
+            if previous_scores is None and os.path.exists(previous['path']):
+                previous_scores = self._cached_score(previous['path'])
+
+        reason = None
+        if new_scores['perplexity'] is None:
+            reason = "perplexity is not finite"
+        elif previous_scores and previous_scores['perplexity']:
+            if new_scores['perplexity'] > previous_scores['perplexity'] * (1 + config.eval_max_perplexity_increase):
+                reason = f"perplexity {new_scores['perplexity']:.2f} vs {previous_scores['perplexity']:.2f}"
+            elif (previous_scores['ms_per_token']
+                  and new_scores['ms_per_token'] > previous_scores['ms_per_token'] * (1 + config.eval_max_latency_increase)):
+                reason = f"latency {new_scores['ms_per_token']:.1f} vs {previous_scores['ms_per_token']:.1f} ms/token"
+
+        self.logger.info(f"Model evaluated in {time.perf_counter() - started_at:.1f}s: {new_scores}, previous: {previous_scores}.")
+        if reason is None:
+            return True
+        self.logger.error(f"Transplanted model regressed ({reason}), rolling back.")
+        if previous is None:
+            self.logger.error(f"No previous model version stored, keeping the regressed model.")
+            return True
+        self.store.rollback(model_path)
+        return False
@@ -0,0 +1,274 @@
+import config
+from modules import logging_utils
+
+from modules.Stem import Stem
+
+import logging
+import os
+import platform
+import struct
+import time
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+
+# Tokens processed by a typical request of a given workload: (prompt tokens, generated tokens)
+WORKLOAD_SHAPES = {
+    'interactive': (64, 256),
+    'batch': (512, 128)
+}
+
+def _benchmark_worker(model_path: str, params: dict, prompt: str, generated_tokens: int) -> dict:
+    """
+    Loads the model with given runtime parameters and measures its speed.
+    Runs in a separate process, as some of the parameters (NUMA) can be set only once per process.
+
+    Returns:
+        dict: Load time in seconds, prompt evaluation and generation speed in tokens per second
+    """
+
+    import llama_cpp
+
+    start = time.perf_counter()
+    llm = llama_cpp.Llama(model_path=model_path, n_ctx=2048, verbose=False, **params)
+    load_seconds = time.perf_counter() - start
+
+    tokens = llm.tokenize(prompt.encode())[:1024]
+    start = time.perf_counter()
+    llm.eval(tokens)
+    prompt_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    generated = 0
+    for _ in llm.generate(tokens, top_k=1, temp=0, reset=True):
+        generated += 1
+        if generated >= generated_tokens:
+            break
+    generation_seconds = time.perf_counter() - start
+
+    return {'load_seconds': load_seconds,
+            'prompt_tps': len(tokens) / prompt_seconds,
+            'generation_tps': generated / generation_seconds}
+
+class Cerebellum:
+    """
+    A class calibrating the model runtime parameters to the host it is running on.
+
+    On the first start on a given host, it benchmarks thread counts, batch sizes, memory locking and
+    mapping, and NUMA settings, and stores the best configuration for the interactive and the batch
+    (dreaming) workloads in a cache keyed by the model signature and the CPU signature. The model signature
+    covers what runtime performance depends on (architecture, quantization and size), not the weights, so that
+    models rewritten by self-finetuning reuse the calibration of their predecessor.
+    """
+
+    def __init__(self, model_path: str = config.model_path):
+        """
+        Args:
+            model_path (str): Path to the LLM model file to be calibrated
+        """
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.info(f"Instantiating {self.__class__.__name__}")
+
+        self._model_path = model_path
+        self._cache_path = config.runtime_calibration_path
+
+    @staticmethod
+    def cpu_signature() -> str:
+        """
+        Describes the host CPU: model, logical CPUs, CPUs available to the process and NUMA nodes.
+
+        Returns:
+            str: CPU signature
+        """
+
+        cpu_model = platform.processor() or platform.machine()
+        try:
+            with open('/proc/cpuinfo') as file:
+                for line in file:
+                    if line.startswith('model name'):
+                        cpu_model = line.split(':', 1)[1].strip()
+                        break
+        except OSError:
+            pass
+
+        return f"{cpu_model}|{os.cpu_count()}|{Cerebellum._available_cpus()}|{Cerebellum._numa_nodes()}"
+
+    @staticmethod
+    def model_signature(model_path: str) -> str:
+        """
+        Describes the model file: architecture and quantization (file type) from the GGUF header, and file size.
+
+        Args:
+            model_path (str): Path to the GGUF model file
+
+        Returns:
+            str: Model signature
+        """
+
+        metadata = Cerebellum._gguf_metadata(model_path, ('general.architecture', 'general.file_type'))
+        return (f"{metadata.get('general.architecture', '?')}|{metadata.get('general.file_type', '?')}|"
+                f"{os.path.getsize(model_path)}")
+
+    @staticmethod
+    def _gguf_metadata(model_path: str, keys: tuple) -> dict:
+        """
+        Reads the given metadata keys from the header of a GGUF file, stopping as soon as all of them are found.
+
+        Returns:
+            dict: Found values by key, empty if the file is not a readable GGUF file
+        """
+
+        # Struct formats of scalar GGUF value types by type id; 8 is a string and 9 an array
+        scalar_formats = {0: '<B', 1: '<b', 2: '<H', 3: '<h', 4: '<I', 5: '<i', 6: '<f', 7: '<?',
+                          10: '<Q', 11: '<q', 12: '<d'}
+        found = {}
+        try:
+            with open(model_path, 'rb') as file:
+                def read(fmt):
+                    return struct.unpack(fmt, file.read(struct.calcsize(fmt)))[0]
+
+                def read_string():
+                    return file.read(read('<Q')).decode('utf-8', errors='replace')
+
+                def read_value(value_type):
+                    if value_type == 8:
+                        return read_string()
+                    if value_type == 9:
+                        item_type, count = read('<I'), read('<Q')
+                        return [read_value(item_type) for _ in range(count)]
+                    return read(scalar_formats[value_type])
+
+                if file.read(4) != b'GGUF' or read('<I') < 2:
+                    return found
+                read('<Q')
+                for _ in range(read('<Q')):
+                    key = read_string()
+                    value = read_value(read('<I'))
+                    if key in keys:
+                        found[key] = value
+                        if len(found) == len(keys):
+                            break
+        except (OSError, struct.error, KeyError, MemoryError) as e:
+            logging.getLogger(Cerebellum.__name__).warning(f"Failed to read GGUF metadata of {model_path}: {e}")
+        return found
+
+    @staticmethod
+    def _available_cpus() -> int:
+        try:
+            return len(os.sched_getaffinity(0))
+        except AttributeError:
+            return os.cpu_count()
+
+    @staticmethod
+    def _numa_nodes() -> int:
+        return max(len(glob('/sys/devices/system/node/node[0-9]*')), 1)
+
+    def _default_params(self) -> dict:
+        """
+        Runtime parameters used without calibration: generation on physical cores, prompt evaluation on all CPUs.
+        """
+
+        cpus = self._available_cpus()
+        return {'n_threads': max(cpus // 2, 1),
+                'n_threads_batch': cpus,
+                'n_batch': 512,
+                'use_mmap': True,
+                'use_mlock': False,
+                'numa': self._numa_nodes() > 1}
+
+    def _candidates(self) -> list:
+        """
+        Builds the list of parameter sets to be benchmarked, varying one parameter group at a time around defaults.
+        """
+
+        defaults = self._default_params()
+        cpus = self._available_cpus()
+        candidates = [defaults]
+
+        for threads in sorted({max(cpus // 4, 1), max(cpus // 2, 1), max(cpus * 3 // 4, 1), cpus}):
+            candidates.append({**defaults, 'n_threads': threads, 'n_threads_batch': threads})
+        for batch in (128, 256, 1024):
+            candidates.append({**defaults, 'n_batch': batch})
+        candidates.append({**defaults, 'use_mlock': True})
+        candidates.append({**defaults, 'use_mmap': False})
+        if self._numa_nodes() > 1:
+            candidates.append({**defaults, 'numa': False})
+
+        unique = []
+        for candidate in candidates:
+            if candidate not in unique:
+                unique.append(candidate)
+        return unique
+
+    @staticmethod
+    def _workload_cost(metrics: dict, workload: str) -> float:
+        prompt_tokens, generated_tokens = WORKLOAD_SHAPES[workload]
+        return prompt_tokens / metrics['prompt_tps'] + generated_tokens / metrics['generation_tps']
+
+    def _calibrate(self) -> dict:
+        """
+        Benchmarks candidate parameter sets and selects the best one for each workload.
+        Thread counts for prompt evaluation and generation are selected independently.
+
+        Returns:
+            dict: Runtime parameters keyed by workload
+        """
+
+        self.logger.murmur(f"Getting to know my new body, this may take a while...")
+        prompt = Stem.get_prompt("human_interaction")
+        results = []
+        context = multiprocessing.get_context('spawn')
+        for params in self._candidates():
+            self.logger.debug(f"Benchmarking runtime parameters: {params}")
+            try:
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    metrics = executor.submit(_benchmark_worker, self._model_path, params, prompt, 32).result()
+            except Exception as e:
+                self.logger.warning(f"Benchmark of {params} failed: {e}")
+                continue
+            self.logger.debug(f"Benchmark results: {metrics}")
+            results.append((params, metrics))
+
+        if not results:
+            self.logger.error(f"All runtime benchmarks failed, using default parameters.")
+            defaults = self._default_params()
+            return {workload: defaults for workload in WORKLOAD_SHAPES}
+
+        best_prompt_threads = max(results, key=lambda result: result[1]['prompt_tps'])[0]['n_threads_batch']
+        best_generation_threads = max(results, key=lambda result: result[1]['generation_tps'])[0]['n_threads']
+
+        calibration = {}
+        for workload in WORKLOAD_SHAPES:
+            params, metrics = min(results, key=lambda result: self._workload_cost(result[1], workload))
+            calibration[workload] = {**params,
+                                     'n_threads': best_generation_threads,
+                                     'n_threads_batch': best_prompt_threads}
+            self.logger.info(f"Calibrated {workload} runtime parameters: {calibration[workload]} ({metrics})")
+        return calibration
+
+    def runtime_params(self) -> dict:
+        """
+        Returns runtime parameters for the model and host, calibrating them if they are not cached yet.
+
+        Returns:
+            dict: Runtime parameters (n_threads, n_threads_batch, n_batch, use_mmap, use_mlock, numa) keyed by workload
+        """
+
+        if not config.runtime_autotune:
+            defaults = self._default_params()
+            return {workload: defaults for workload in WORKLOAD_SHAPES}
+
+        cache_key = f"{self.model_signature(self._model_path)}|{self.cpu_signature()}"
+        cache = Stem.memory_read(self._cache_path, 'json') if os.path.exists(self._cache_path) else {}
+        cache = cache if cache else {}
+
+        if cache_key in cache:
+            self.logger.debug(f"Using cached runtime parameters for {cache_key}.")
+            return cache[cache_key]
+
+        calibration = self._calibrate()
+        cache[cache_key] = calibration
+        Stem.memory_write(self._cache_path, json.dumps(cache, indent=4))
+        return calibration
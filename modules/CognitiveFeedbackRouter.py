@@ -4,20 +4,29 @@ from modules import logging_utils
 from modules.SensoryProcessing import LanguageProcessingModule
 from modules.Stem import Stem
 from modules.ShortTermMemory import ShortTermMemory
-from modules.ReflectiveEvolutionMonitor import ReflectiveEvolutionMonitor
-from modules.DefaultModeNetwork import DefaultModeNetwork
+from modules.PerceptiveFrameworkCore import PerceptiveFrameworkCore
+from modules.Hypothalamus import Hypothalamus
+from modules.Hippocampus import Hippocampus
+from modules.Thalamus import Thalamus
+from modules.Configuration import Configuration
 
-from langchain_community.llms import LlamaCpp
 import logging
 import asyncio
+import time
+from typing import Optional
 
 class CognitiveFeedbackRouter:
-    def __init__(self):
+    def __init__(self, started_at: Optional[float] = None, startup_phases: Optional[dict] = None):
         """
         A class that manages the routing of cognitive feedback based on user input and system states.
     
         This class orchestrates various components, including a language learning model (LLM), user input handling,
         and managing different operational modes based on system states like 'sleeping' or 'overwhelmed'.
+        DefaultModeNetwork and ReflectiveEvolutionMonitor modules are imported only when first needed.
+
+        Args:
+            started_at (float): time.perf_counter() value at process start, used to report time to first prompt
+            startup_phases (dict): Durations of startup phases completed before instantiation (in seconds)
         """
 
         self.logger = logging.getLogger(self.__class__.__name__)
@@ -27,16 +36,73 @@ class CognitiveFeedbackRouter:
         self.overwhelmed = asyncio.Event()
         
         self.pfc = None
+        self._worker_pool = None
+        self.hypothalamus = Hypothalamus(self.engaged)
+        self.thalamus = Thalamus()
+        self._pending_conclusions = 0
         
-        self._dmn_countdown = config.dmn_countdown
+
+        self._started_at = started_at if started_at is not None else time.perf_counter()
+        self.startup_phases = dict(startup_phases) if startup_phases else {}
+        self._startup_reported = False
         
         self.logger.debug("Cognitive Feedback Router instantiated.")        
 
+    def _background_pfc(self):
+        """
+        Returns the model to be used for background cognition: a pool of worker processes if configured,
+        the main PFC otherwise.
+        """
+
+        if not config.background_workers:
+            return self.pfc
+        if self._worker_pool is None:
+            from modules.WorkerPool import WorkerPool
+            self._worker_pool = WorkerPool(self.pfc, self.engaged)
+        return self._worker_pool
+
+    def _on_memory_change(self, name: str, pending: set) -> None:
+        """
+        Reacts to changes relayed by the Thalamus: new conclusions make the entity overwhelmed, unless it is engaged.
+        """
+
+        if name != 'conclusions':
+            return
+        if len(pending) > self._pending_conclusions and not self.engaged.is_set():
+            self.logger.debug(f"New conclusions detected: {sorted(pending)}.")
+            self.overwhelmed.set()
+            self.logger.flag(f"Overwhelmed status: {self.overwhelmed.is_set()}")
+        self._pending_conclusions = len(pending)
+
+    async def _sync_hippocampus(self) -> None:
+        """
+        Indexes conversations saved while the entity wasn't running (or by other processes), once per start.
+        Conversations saved afterwards are indexed as they are saved.
+        """
+
+        try:
+            synced = await Stem.run_io(Hippocampus().sync)
+            self.logger.debug(f"Hippocampus synchronized, {synced} conversations indexed or removed.")
+        except Exception as e:
+            self.logger.error(f"Synchronizing Hippocampus failed: {e}")
+
     async def _sharpen_senses(self) -> None:
         "Starts sensory functions"
-        _conversation_handler = LanguageProcessingModule(self.pfc, self.engaged)            
+        _conversation_handler = LanguageProcessingModule(self.pfc, self.engaged, background_pfc=self._background_pfc())
         asyncio.create_task(_conversation_handler.get_user_input())
 
+    def _report_startup(self) -> None:
+        """
+        Logs the startup phases breakdown and the time to first prompt, warning if it exceeds the target.
+        """
+
+        time_to_prompt = time.perf_counter() - self._started_at
+        breakdown = ', '.join(f"{phase}: {seconds:.2f}s" for phase, seconds in self.startup_phases.items())
+        self.logger.info(f"Time to first prompt: {time_to_prompt:.2f}s ({breakdown}).")
+        if time_to_prompt > config.startup_target_seconds:
+            self.logger.warning(f"Time to first prompt {time_to_prompt:.2f}s exceeds the {config.startup_target_seconds}s target.")
+        self._startup_reported = True
+
     async def _wakeup(self) -> None:
         """
         Wakes up the system and initializes the LLM.
@@ -46,19 +112,43 @@ class CognitiveFeedbackRouter:
         self.logger.debug(f"Initializing LLM model from {config.model_path}")
         try:
             self.logger.debug(f"Loading LLM.")            
-            self.pfc = LlamaCpp(model_path=config.model_path,
-                                temperature=config.model_temp,
-                                n_ctx=4096,
-                                max_tokens=4000,
-                                n_parts=config.available_threads,
-                                n_batch=4*config.available_threads)
+            # The PFC is reused, so that modules holding it (e.g. an interaction waiting for the model) get the new model
+            if self.pfc is None:
+                self.pfc = PerceptiveFrameworkCore(config.model_path)
+            else:
+                self.pfc.unload()
+            self.pfc.load()
+            if self._worker_pool is not None:
+                self._worker_pool.pfc = self.pfc
+                # Stopping workers waits for their current jobs
+                await asyncio.get_running_loop().run_in_executor(None, self._worker_pool.restart)
         except Exception as e:
             self.logger.error(f"Error initializing LLM model: {e}")
             raise
         self.logger.debug(f"LLM initialized.")                 
         self.overwhelmed.clear()
         self.logger.flag(f"Overwhelmed status: {self.overwhelmed.is_set()}")
+        senses_start = time.perf_counter()
         await self._sharpen_senses()
+        if not self._startup_reported:
+            self.startup_phases.update(self.pfc.load_phases)
+            self.startup_phases['senses'] = time.perf_counter() - senses_start
+            self._report_startup()
+
+    @staticmethod
+    async def _await_any(events: tuple, timeout: float) -> bool:
+        """
+        Waits until any of the events is set, or the timeout passes.
+
+        Returns:
+            bool: True if an event has been set, False on timeout
+        """
+
+        waiters = [asyncio.create_task(event.wait()) for event in events]
+        done, pending = await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        for waiter in pending:
+            waiter.cancel()
+        return bool(done)
 
     async def attention_switch(self) -> None:
         """
@@ -68,26 +158,63 @@ class CognitiveFeedbackRouter:
         and handles the 'engaged' and 'overwhelmed' states of the system.
         """
         await self._wakeup()
+        asyncio.create_task(self.hypothalamus.monitor())
+        self.thalamus.subscribe(self._on_memory_change)
+        self.thalamus.start()
+        asyncio.create_task(self._sync_hippocampus())
+        asyncio.create_task(Configuration.watch())
+        self._pending_conclusions = len(self.thalamus.pending['conclusions'])
         self.logger.info(f"Starting infinite attention loop.") 
         while True:
-            if self.overwhelmed.is_set():
+            if self.overwhelmed.is_set() and not self.engaged.is_set():
                 self.logger.info(f"Overwhelmed state: {self.overwhelmed.is_set()}") 
-                rem = ReflectiveEvolutionMonitor(pfc=self.pfc)
-                await rem.dream()
-                await self._wakeup()
+                from modules.ReflectiveEvolutionMonitor import ReflectiveEvolutionMonitor
+                rem = ReflectiveEvolutionMonitor(pfc=self._background_pfc(),
+                                                 engaged_event=self.engaged,
+                                                 governor=self.hypothalamus,
+                                                 thalamus=self.thalamus)
+                self.pfc.set_workload('batch')
+                with self.hypothalamus.enter('rem'):
+                    await rem.dream()
+                self.hypothalamus.report()
+                Stem.io_report()
+                if rem.model_unloaded:
+                    await self._wakeup()
+                    if rem.interrupted:
+                        # Self-finetuning stopped for the interaction is repeated after it
+                        self.overwhelmed.set()
+                    continue
+                self.pfc.set_workload('interactive')
+                self.pfc.report()
+                if rem.interrupted:
+                    self.logger.debug(f"Dreaming interrupted, will be resumed after the interaction.")
+                elif rem.transplanted:
+                    await self._wakeup()
+                else:
+                    self.logger.debug(f"Base model unchanged, skipping reload.")
+                    self.overwhelmed.clear()
+                    self.logger.flag(f"Overwhelmed status: {self.overwhelmed.is_set()}")
+                    await self._sharpen_senses()
             elif not self.engaged.is_set():
                 self.logger.debug(f"No environment interaction and no new conclusions detected. Preparing to switch to Default Mode.")                     
-                for _ in range(self._dmn_countdown):
-                    await asyncio.sleep(1)
-                    if self.engaged.is_set():
-                        self.logger.debug(f"Cancelling Default Mode countdown due to environment interaction detection.")
-                        break
+                interrupted = await self._await_any((self.engaged, self.overwhelmed), config.dmn_countdown)
+                if interrupted:
+                    self.logger.debug(f"Cancelling Default Mode countdown due to environment interaction or new conclusions.")
                 else:
                     self.logger.debug(f"Entering Default Mode.")                                                                         
-                    dmn = DefaultModeNetwork(self.pfc, self.overwhelmed, self.engaged)
-                    await dmn.ponder()
-                    self.engaged.clear()
-                    await self._sharpen_senses()
-                    self.logger.debug(f"Default Mode quit.")                                                                                                 
+                    from modules.DefaultModeNetwork import DefaultModeNetwork
+                    dmn = DefaultModeNetwork(self._background_pfc(), self.overwhelmed, self.engaged, thalamus=self.thalamus)
+                    self.pfc.set_workload('batch')
+                    with self.hypothalamus.enter('dmn'):
+                        await dmn.ponder()
+                    self.pfc.set_workload('interactive')
+                    self.pfc.report()
+                    self.hypothalamus.report()
+                    Stem.io_report()
+                    if self.engaged.is_set():
+                        self.logger.debug(f"Default Mode interrupted by environment interaction.")
+                    else:
+                        await self._sharpen_senses()
+                        self.logger.debug(f"Default Mode quit.")                                                                                                 
             else:
                 await asyncio.sleep(1)
@@ -0,0 +1,319 @@
+import config
+
+import logging
+import asyncio
+import os
+import json
+import sys
+import weakref
+from typing import Callable
+
+# Schemas of settings needing more than a type check. Settings not listed here are checked against the type
+# of their default value. 'live' settings are applied to the running entity when the override file changes,
+# the others (structural ones: model files, backends, directories, caches) need a restart.
+SCHEMA = {
+    'model_temp': {'type': float, 'min': 0, 'max': 2, 'live': True},
+    'inference_backend': {'type': str, 'choices': ['inprocess', 'server']},
+    'inference_pool_size': {'type': int, 'min': 1},
+    'draft_tokens_num': {'type': int, 'min': 1},
+    'dmn_countdown': {'type': int, 'min': 0, 'live': True},
+    'dmn_batch_mode': {'type': bool, 'live': True},
+    'dmn_cluster_max_keywords': {'type': int, 'min': 1, 'live': True},
+    'interaction_timeout': {'type': int, 'min': 1, 'live': True},
+    'background_workers': {'type': int, 'min': 0},
+    'background_worker_stop_seconds': {'type': float, 'min': 0, 'live': True},
+    'available_threads': {'type': int, 'min': 1, 'live': True},
+    'finetune_max_threads': {'type': int, 'min': 0, 'live': True},
+    'finetune_memory_factor': {'type': float, 'min': 0, 'live': True},
+    'memory_budget_bytes': {'type': int, 'min': 0},
+    'dreams_to_generate_num': {'type': int, 'min': 1, 'live': True},
+    'dreams_adaptive': {'type': bool, 'live': True},
+    'dreams_min_num': {'type': int, 'min': 1, 'live': True},
+    'dream_novelty_ngram': {'type': int, 'min': 1, 'live': True},
+    'dream_novelty_window': {'type': int, 'min': 1, 'live': True},
+    'dream_novelty_threshold': {'type': float, 'min': 0, 'max': 1, 'live': True},
+    'dream_min_tokens': {'type': int, 'min': 0, 'live': True},
+    'dream_max_tokens': {'type': int, 'min': 1, 'live': True},
+    'dream_shingle_threshold': {'type': float, 'min': 0, 'max': 1, 'live': True},
+    'dream_embedding_threshold': {'type': float, 'min': 0, 'max': 1, 'live': True},
+    'dream_write_batch': {'type': int, 'min': 1, 'live': True},
+    'dream_markers': {'type': dict, 'keys': ['stimulus', 'reaction', 'end'], 'live': True},
+    'epochs': {'type': int, 'min': 1, 'live': True},
+    'lora_weight': {'type': float, 'min': 0, 'live': True},
+    'lora_mode': {'type': str, 'choices': ['merge', 'adapter']},
+    'lora_compaction_threshold': {'type': int, 'min': 1, 'live': True},
+    'eval_gate': {'type': bool, 'live': True},
+    'eval_max_perplexity_increase': {'type': float, 'min': 0, 'live': True},
+    'eval_max_latency_increase': {'type': float, 'min': 0, 'live': True},
+    'eval_memory_factor': {'type': float, 'min': 0, 'live': True},
+    'stm_capacity': {'type': int, 'min': 1, 'live': True},
+    'stm_ttl_days': {'type': float, 'min': 0, 'live': True},
+    'stm_half_life_days': {'type': float, 'min': 0, 'live': True},
+    'stm_eviction_batch': {'type': int, 'min': 1, 'live': True},
+    'stm_prompt_keywords': {'type': int, 'min': 1, 'live': True},
+    'hippocampus_results': {'type': int, 'min': 0, 'live': True},
+    'generation_min_tokens': {'type': int, 'min': 1, 'live': True},
+    'generation_stats_window': {'type': int, 'min': 1},
+    'io_threads': {'type': int, 'min': 1},
+    'io_lock_stripes': {'type': int, 'min': 1},
+    'io_slow_seconds': {'type': float, 'min': 0, 'live': True},
+    'log_max_bytes': {'type': int, 'min': 1 << 20},
+    'log_segment_seconds': {'type': int, 'min': 60},
+    'log_retention_days': {'type': float, 'min': 0, 'live': True},
+    'log_retention_bytes': {'type': int, 'min': 0, 'live': True},
+    'log_finetuning_keep': {'type': int, 'min': 0, 'live': True},
+    'log_stale_seconds': {'type': int, 'min': 0, 'live': True},
+    'profiles': {'type': dict, 'live': True},
+    'config_reload_seconds': {'type': float, 'min': 0},
+}
+
+# Settings of a performance profile, None meaning the calibrated (or global) value
+PROFILE_SCHEMA = {
+    'n_threads': {'type': int, 'min': 1},
+    'n_threads_batch': {'type': int, 'min': 1},
+    'n_batch': {'type': int, 'min': 1},
+    'n_ctx': {'type': int, 'min': 128, 'live': False},
+    'temperature': {'type': float, 'min': 0, 'max': 2},
+    'max_tokens': {'type': int, 'min': 1},
+    'concurrency': {'type': int, 'min': 1},
+}
+
+class Configuration:
+    """
+    A class validating the settings of config.py and overriding them from the environment and a JSON file.
+
+    Overrides are applied to the config module itself, so modules keep reading settings as config.<name>.
+    Environment variables (config_env_prefix + upper-case name, e.g. AS_MODEL_TEMP=0.7) take precedence over
+    the override file, whose values take precedence over config.py. Values are parsed as JSON where possible.
+    When the override file changes, live settings are re-applied without restarting, and subscribers are notified.
+    """
+
+    _defaults = {}
+    _sources = {}
+    _file_mtime = None
+    _subscribers = []
+    _messages = []
+
+    @staticmethod
+    def _check(name: str, value, schema: dict):
+        if value is None:
+            return None
+        expected = schema['type']
+        if expected is float and isinstance(value, int) and not isinstance(value, bool):
+            value = float(value)
+        if expected is int and isinstance(value, bool) or not isinstance(value, expected):
+            raise ValueError(f"{name} should be of type {expected.__name__}, got {value!r}")
+        if 'min' in schema and value < schema['min']:
+            raise ValueError(f"{name} should be at least {schema['min']}, got {value!r}")
+        if 'max' in schema and value > schema['max']:
+            raise ValueError(f"{name} should be at most {schema['max']}, got {value!r}")
+        if 'choices' in schema and value not in schema['choices']:
+            raise ValueError(f"{name} should be one of {schema['choices']}, got {value!r}")
+        if 'keys' in schema and sorted(value) != sorted(schema['keys']):
+            raise ValueError(f"{name} should have keys {schema['keys']}, got {sorted(value)}")
+        return value
+
+    @staticmethod
+    def validate(name: str, value):
+        """
+        Validates a setting value, coercing integers where floats are expected.
+
+        Args:
+            name (str): Setting name
+            value: Setting value
+
+        Returns:
+            Validated value
+
+        Raises:
+            ValueError: If the value doesn't match the setting's schema
+        """
+
+        if name == 'profiles':
+            Configuration._check(name, value, SCHEMA[name])
+            validated = {}
+            for workload, profile in value.items():
+                if not isinstance(profile, dict):
+                    raise ValueError(f"profiles.{workload} should be a dict, got {profile!r}")
+                unknown = set(profile) - set(PROFILE_SCHEMA)
+                if unknown:
+                    raise ValueError(f"profiles.{workload} has unknown settings: {sorted(unknown)}")
+                validated[workload] = {key: Configuration._check(f"profiles.{workload}.{key}", profile.get(key), PROFILE_SCHEMA[key])
+                                       for key in PROFILE_SCHEMA}
+            return validated
+        if name in SCHEMA:
+            return Configuration._check(name, value, SCHEMA[name])
+        default = Configuration._defaults.get(name)
+        if default is not None and value is not None:
+            Configuration._check(name, value, {'type': float if isinstance(default, float) else type(default)})
+        return value
+
+    @staticmethod
+    def _parse(raw: str):
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return raw
+
+    @staticmethod
+    def _read_overrides() -> dict:
+        """
+        Reads overrides from the override file and the environment, environment taking precedence.
+        """
+
+        overrides = {}
+        path = Configuration._defaults.get('config_override_path')
+        if path and os.path.exists(path):
+            Configuration._file_mtime = os.path.getmtime(path)
+            with open(path) as file:
+                overrides.update({name: (value, path) for name, value in json.load(file).items()})
+        prefix = Configuration._defaults.get('config_env_prefix', 'AS_')
+        for variable, raw in os.environ.items():
+            name = variable[len(prefix):].lower()
+            if variable.startswith(prefix) and name in Configuration._defaults:
+                overrides[name] = (Configuration._parse(raw), variable)
+        return overrides
+
+    @staticmethod
+    def _resolve(overrides: dict) -> dict:
+        """
+        Validates defaults merged with overrides. Profile overrides are merged into default profiles per workload.
+
+        Raises:
+            ValueError: Listing all invalid settings
+        """
+
+        values = {}
+        errors = []
+        for name, default in Configuration._defaults.items():
+            value, source = overrides.get(name, (default, None))
+            if name == 'profiles' and source and isinstance(value, dict):
+                value = {workload: {**default.get(workload, {}), **(profile or {})} for workload, profile in {**default, **value}.items()}
+            try:
+                values[name] = Configuration.validate(name, value)
+            except ValueError as e:
+                errors.append(f"{e} ({source or 'config.py'})")
+        unknown = [f"{name} ({source})" for name, (_, source) in overrides.items() if name not in Configuration._defaults]
+        if unknown:
+            errors.append(f"Unknown settings: {unknown}")
+        if errors:
+            raise ValueError("Invalid configuration:\n" + '\n'.join(errors))
+        Configuration._sources = {name: source for name, (_, source) in overrides.items()}
+        return values
+
+    @staticmethod
+    def apply_overrides(module_name: str = 'config') -> None:
+        """
+        Validates settings and applies overrides to the config module. Called once, when config is imported.
+        """
+
+        module = sys.modules[module_name]
+        Configuration._defaults = {name: value for name, value in vars(module).items()
+                                   if not name.startswith('_') and not callable(value) and not isinstance(value, type(sys))}
+        values = Configuration._resolve(Configuration._read_overrides())
+        for name, value in values.items():
+            setattr(module, name, value)
+        Configuration._messages = [f"{name} overridden from {source}" for name, source in Configuration._sources.items()]
+
+    @staticmethod
+    def report() -> None:
+        """
+        Logs the applied overrides, once logging is set up.
+        """
+
+        logger = logging.getLogger('Configuration')
+        for message in Configuration._messages:
+            logger.info(message)
+
+    @staticmethod
+    def profile(workload: str) -> dict:
+        """
+        Returns the performance profile of a workload, None values meaning calibrated or global settings.
+        """
+
+        return dict(config.profiles.get(workload, {}))
+
+    @staticmethod
+    def subscribe(callback: Callable[[dict], None]) -> None:
+        """
+        Registers a callback called with {name: new value} of live settings changed by a reload.
+        Bound methods are held by weak references, so that subscribing doesn't keep their objects
+        (e.g. replaced PFCs holding a model) alive; they are unsubscribed once their object is collected.
+        """
+
+        reference = weakref.WeakMethod(callback) if hasattr(callback, '__self__') else (lambda: callback)
+        Configuration._subscribers.append(reference)
+
+    @staticmethod
+    def unsubscribe(callback: Callable[[dict], None]) -> None:
+        """
+        Removes a callback registered with subscribe().
+        """
+
+        Configuration._subscribers = [reference for reference in Configuration._subscribers
+                                      if reference() is not None and reference() != callback]
+
+    @staticmethod
+    def reload() -> dict:
+        """
+        Re-reads overrides and applies changed live settings. Invalid overrides are rejected as a whole,
+        changes of structural settings are reported as requiring a restart.
+
+        Returns:
+            dict: Applied changes
+        """
+
+        logger = logging.getLogger('Configuration')
+        try:
+            values = Configuration._resolve(Configuration._read_overrides())
+        except (ValueError, OSError) as e:
+            logger.error(f"Configuration not reloaded: {e}")
+            return {}
+
+        changes = {}
+        for name, value in values.items():
+            if getattr(config, name) == value:
+                continue
+            live = SCHEMA.get(name, {}).get('live', False)
+            if name == 'profiles':
+                structural = [f"profiles.{workload}.n_ctx" for workload in value
+                              if value[workload].get('n_ctx') != config.profiles.get(workload, {}).get('n_ctx')]
+                if structural:
+                    logger.warning(f"{structural} changed, the change takes effect after a restart.")
+                    value = {workload: {**profile, 'n_ctx': config.profiles.get(workload, {}).get('n_ctx')}
+                             for workload, profile in value.items()}
+            if not live:
+                logger.warning(f"{name} changed, the change takes effect after a restart.")
+                continue
+            setattr(config, name, value)
+            changes[name] = value
+            logger.info(f"{name} set to {value!r}.")
+
+        if changes:
+            Configuration._subscribers = [reference for reference in Configuration._subscribers if reference() is not None]
+            for reference in list(Configuration._subscribers):
+                callback = reference()
+                if callback is None:
+                    continue
+                try:
+                    callback(changes)
+                except Exception as e:
+                    logger.error(f"Applying configuration changes failed: {e}")
+        return changes
+
+    @staticmethod
+    async def watch(interval: float = None) -> None:
+        """
+        Reloads the configuration whenever the override file changes.
+        """
+
+        interval = interval if interval is not None else config.config_reload_seconds
+        if not interval:
+            return
+        path = Configuration._defaults.get('config_override_path')
+        while True:
+            await asyncio.sleep(interval)
+            mtime = os.path.getmtime(path) if path and os.path.exists(path) else None
+            if mtime != Configuration._file_mtime:
+                Configuration._file_mtime = mtime
+                Configuration.reload()
@@ -3,10 +3,15 @@ from modules import logging_utils
 
 from modules.Stem import Stem
 from modules.ShortTermMemory import ShortTermMemory
+from modules.Hippocampus import Hippocampus
+from modules.PerceptiveFrameworkCore import Preempted
 
 import logging
 import asyncio
 import os
+import json
+import time
+from typing import Optional
 
 class DefaultModeNetwork:
     """
@@ -17,10 +22,14 @@ class DefaultModeNetwork:
     def __init__(self,
                  pfc,
                  overwhelmed_event: asyncio.Event,
-                 engaged_event: asyncio.Event
+                 engaged_event: asyncio.Event,
+                 thalamus = None
                 ):
         """
         Initializes the DefaultModeNetwork class by setting up the short-term memory (STM) component.
+
+        Args:
+            thalamus: Thalamus indexing pending conclusions, the conclusions directory is scanned if not given
         """
         
         self.logger = logging.getLogger(self.__class__.__name__)
@@ -28,16 +37,27 @@ class DefaultModeNetwork:
         self.logger.flag(f"Overhelmed state: {overwhelmed_event.is_set()}") 
         
         self.stm = ShortTermMemory()
+        self.hippocampus = Hippocampus()
         self.pfc = pfc
 
         self.overwhelmed = overwhelmed_event
         self.engaged = engaged_event
+        self.thalamus = thalamus
         
         self._conclusions_dir = config.conclusions_dir
         Stem.prepare_directory(self._conclusions_dir)          
 
-        self._keyword_selection_prompt_template = Stem.get_prompt("keyword_selection")
+        self._keyword_selection_prompt_template = Stem.get_keywords_prompt("keyword_selection")
         self._perspective_explanation_prompt_template = Stem.get_prompt("perspective_explanation")
+
+        # State of pondering interrupted by an interaction, to be resumed in the next idle period
+        self._checkpoint_path = config.dmn_checkpoint_path
+        self._checkpoint = {}
+        if os.path.exists(self._checkpoint_path):
+            self._checkpoint = Stem.memory_read(self._checkpoint_path, 'json') or {}
+
+        # Backlog size and drain rate of the last batch pondering
+        self.metrics = {}
     
     
     async def _interesting_keywords_selection(self, keywords) -> list:
@@ -51,11 +71,27 @@ class DefaultModeNetwork:
             list: A subset of selected keywords.
         """
 
-        starred_keywords = [f"**{keyword}**" for keyword in keywords]
-        keywords_selection_prompt = self._keyword_selection_prompt_template.replace("{keywords_list}", ', '.join(starred_keywords))
+        if 'keyword_selection_prompt' in self._checkpoint:
+            self.logger.debug(f"Resuming interrupted keyword selection.")
+            keywords_selection_prompt = self._checkpoint['keyword_selection_prompt']
+        else:
+            if config.structured_keywords:
+                keywords_list = json.dumps(list(keywords))
+            else:
+                keywords_list = ', '.join(f"**{keyword}**" for keyword in keywords)
+            keywords_selection_prompt = self._keyword_selection_prompt_template.replace("{keywords_list}", keywords_list)
         self.logger.prompt(f"Interesting keyword selection prompt:\n{keywords_selection_prompt}")        
         self.logger.debug(f"Asking LLM to select interesting keywords.")   
-        keywords_selected_raw_output = self.pfc.invoke(keywords_selection_prompt)
+        grammar = Stem.keywords_grammar() if config.structured_keywords else None
+        try:
+            keywords_selected_raw_output = await self.pfc.ainvoke(keywords_selection_prompt,
+                                                                  task='keyword_selection',
+                                                                  grammar=grammar,
+                                                                  preempt=self.engaged,
+                                                                  resume_from=self._checkpoint.get('keyword_selection_partial', ''))
+        except Preempted as e:
+            self._checkpoint.update(keyword_selection_prompt=keywords_selection_prompt, keyword_selection_partial=e.partial)
+            raise
         self.logger.monologue(f"LLM selected interesting keywords:\n{keywords_selected_raw_output}.\nMoving to keywords extraction.")   
         keywords_selected_pure = Stem.extract_keywords(keywords_selected_raw_output)
         self.logger.debug(f"Automatically detected keywords: {keywords_selected_pure}")   
@@ -65,6 +101,8 @@ class DefaultModeNetwork:
     def _fetch_memory(self, keywords) -> str:
         """
         Fetches and concatenates interaction history data based on the provided keywords.
+        Conversations associated with the keywords come first, followed by the best full-text matches of the keywords
+        as long as they fit into the context window left by the perspective explanation prompt and its generation.
 
         Args:
             keywords (list): A list of keywords to search the interaction data for.
@@ -74,11 +112,41 @@ class DefaultModeNetwork:
         """
         
         self.logger.debug(f"Reaching to Short Term memory for for all the files related to: {keywords}")  
-        filenames = self.stm.search_memories(keywords)
+        filenames = sorted(self.stm.search_memories(keywords))
         self.logger.debug(f"Ordering concatenation of identified files.")          
         concatenated_memories = self.stm.concatenate_memories(filenames)
+        if config.hippocampus_results:
+            budget = self._memory_budget()
+            used = len(self.pfc.tokenize(concatenated_memories))
+            matches = []
+            for path, _ in self.hippocampus.search(' '.join(keywords), config.hippocampus_results):
+                if path in filenames:
+                    continue
+                match = self.stm.concatenate_memories([path])
+                match_tokens = len(self.pfc.tokenize(match))
+                if budget is not None and used + match_tokens > budget:
+                    self.logger.debug(f"Full-text match {path} of {match_tokens} tokens doesn't fit into the prompt "
+                                      f"({used} of {budget} tokens used).")
+                    break
+                concatenated_memories += match
+                used += match_tokens
+                matches.append(path)
+            self.logger.debug(f"Full-text search added {len(matches)} conversations.")
+            filenames += matches
         return filenames, concatenated_memories 
 
+    def _memory_budget(self) -> Optional[int]:
+        """
+        Returns the number of context window tokens left for conversations by the perspective explanation prompt
+        and its generation, None if the context size is not known.
+        """
+
+        if not self.pfc.n_ctx:
+            return None
+        template_tokens = len(self.pfc.tokenize(self._perspective_explanation_prompt_template.replace("{interaction_history}", '')))
+        generation_tokens = self.pfc.generation_params('perspective_explanation').get('max_tokens') or 0
+        return self.pfc.n_ctx - template_tokens - generation_tokens
+
     async def _analyze_interaction(self, interaction_history) -> str:
         """
         Analyzes the concatenated interaction history.
@@ -91,50 +159,171 @@ class DefaultModeNetwork:
                                                                                              interaction_history)
         self.logger.prompt(f"Prompt for conversation analysis:\n{perspective_explanation_prompt}")
         self.logger.murmur(f"Thinking about recent conversations...")   
-        adaptation_explanation = self.pfc.invoke(perspective_explanation_prompt)
+        try:
+            adaptation_explanation = await self.pfc.ainvoke(perspective_explanation_prompt,
+                                                            task='perspective_explanation',
+                                                            preempt=self.engaged,
+                                                            resume_from=self._checkpoint.get('perspective_explanation_partial', ''))
+        except Preempted as e:
+            self._checkpoint.update(perspective_explanation_partial=e.partial)
+            raise
         self.logger.monologue(f"Full explanation of the required adaptation:\n{adaptation_explanation}")   
         return adaptation_explanation
 
+    def _save_checkpoint(self) -> None:
+        """
+        Saves the state of interrupted pondering.
+        """
+
+        self.logger.debug(f"Saving pondering checkpoint to {self._checkpoint_path}.")
+        Stem.memory_write(self._checkpoint_path, json.dumps(self._checkpoint))
+
+    def _clear_checkpoint(self) -> None:
+        """
+        Removes the state of interrupted pondering once it has been completed.
+        """
+
+        self._checkpoint = {}
+        if os.path.exists(self._checkpoint_path):
+            os.remove(self._checkpoint_path)
+
+    def _pending_conclusions(self) -> list:
+        """
+        Returns conclusion files awaiting self-finetuning.
+        """
+
+        if self.thalamus:
+            return self.thalamus.pending_files('conclusions')
+        return [f for f in os.listdir(self._conclusions_dir) if f.startswith("conclusion_")]
+
     async def ponder(self) -> bool:
         """
         The main asynchronous method of the class that orchestrates the process of 
         selecting keywords, fetching conversations, and analyzing them.
+
+        Generations are stopped as soon as an interaction starts, and their state is checkpointed,
+        so that pondering resumes where it stopped in the next idle period.
+        """
+
+        try:
+            if config.dmn_batch_mode:
+                return await self._ponder_backlog()
+            return await self._ponder()
+        except Preempted:
+            self.logger.debug(f"Pondering interrupted by an interaction.")
+            await Stem.run_io(self._save_checkpoint)
+            return False
+
+    async def _ponder(self) -> bool:
+        """
+        Selects keywords, fetches related conversations and analyzes them, resuming from the checkpoint if there is one.
         """
 
         self.logger.debug(f"Checking if there are any unprocessed conclusions.")           
-        conclusion_files = [f for f in os.listdir(self._conclusions_dir) if f.startswith("conclusion_")]
+        conclusion_files = self._pending_conclusions()
         if conclusion_files:
             self.logger.debug(f"Found conclusion files: {conclusion_files}. Setting overwhelmed status.")
             self.overwhelmed.set()
             return True
         
         self.logger.debug(f"Checking if there are any topics to be analyzed deeper.")           
-        all_keywords = self.stm.recall_all_keywords()
+        all_keywords = await Stem.run_io(self.stm.recall_top_keywords)
         if not all_keywords:
             self.logger.murmur(f"Kingdom for a good book!")
             return False
 
-        self.logger.debug(f"Moving to selecting interesting keywords from: {all_keywords}")           
-        interesting_keywords = await self._interesting_keywords_selection(all_keywords)
+        if 'interesting_keywords' in self._checkpoint:
+            interesting_keywords = self._checkpoint['interesting_keywords']
+        else:
+            self.logger.debug(f"Moving to selecting interesting keywords from: {all_keywords}")           
+            interesting_keywords = await self._interesting_keywords_selection(all_keywords)
+            self._checkpoint = {'interesting_keywords': interesting_keywords}
         self.logger.debug(f"Interesting keywords selected: {interesting_keywords}")           
-        memory_files, concatenated_memories = self._fetch_memory(interesting_keywords)
+        await self._reflect_on(interesting_keywords)
+        self._clear_checkpoint()
+        return True
+
+    async def _reflect_on(self, interesting_keywords: list) -> None:
+        """
+        Analyzes conversations related to given keywords, saves the conclusion and forgets the keywords.
+
+        Args:
+            interesting_keywords (list): Keywords whose conversations are to be analyzed.
+        """
+
+        memory_files, concatenated_memories = await Stem.run_io(self._fetch_memory, interesting_keywords)
         self.logger.debug(f"Concatenated conversations received.")   
 
         if concatenated_memories:
             self.logger.debug(f"Moving to analyze the conversation histories.")           
             adaptation_summary = await self._analyze_interaction(concatenated_memories)
-            conclusion_file = os.path.join(self._conclusions_dir, f"conclusion_{Stem.get_timestamp()}.txt")
-            self.logger.debug(f"Conclusions saved to {conclusion_file} .")
-            Stem.memory_write(conclusion_file, adaptation_summary)
+            conclusion_name = f"conclusion_{Stem.get_timestamp()}.txt"
             if "**uninspiring**" not in adaptation_summary.lower():
+                conclusion_file = os.path.join(self._conclusions_dir, conclusion_name)
+                await Stem.amemory_write(conclusion_file, adaptation_summary)
+                self.logger.debug(f"Conclusions saved to {conclusion_file} .")
                 self.logger.murmur(f"Discussion on {interesting_keywords} indeed brought a new perspective...")
                 self.overwhelmed.set()
                 self.logger.flag(f"Overwhelmed state: {self.overwhelmed.is_set()}")
             else:
+                # Written straight to the archive, so the Thalamus never indexes it as a conclusion pending REM sleep
+                archive_dir = '_'.join([self._conclusions_dir, 'archive'])
+                await Stem.aprepare_directory(archive_dir)
+                conclusion_file = os.path.join(archive_dir, conclusion_name)
+                await Stem.amemory_write(conclusion_file, adaptation_summary)
                 self.logger.monologue(f"As per:\n{adaptation_summary}\nNothing of interest has been found in {memory_files}.")
-                Stem.archive(conclusion_file)
         else:
             self.logger.error(f"Concatenated conversations turned out to be an empty string.")   
         self.logger.debug(f"Interesting or not, forgetting conversations about {interesting_keywords}.")   
-        self.stm.forget_keywords(interesting_keywords)
+        await Stem.run_io(self.stm.forget_keywords, interesting_keywords)
+
+    async def _ponder_backlog(self) -> bool:
+        """
+        Drains the keyword backlog: analyzes clusters of co-occurring keywords back to back while the entity stays idle,
+        starting with the cluster interrupted last time, if any. Backlog size and drain rate are kept in self.metrics.
+        """
+
+        self.logger.debug(f"Checking if there are any unprocessed conclusions.")           
+        conclusion_files = self._pending_conclusions()
+        if conclusion_files:
+            self.logger.debug(f"Found conclusion files: {conclusion_files}. Setting overwhelmed status.")
+            self.overwhelmed.set()
+            return True
+
+        clusters = await Stem.run_io(self.stm.cluster_keywords)
+        if 'interesting_keywords' in self._checkpoint:
+            resumed = self._checkpoint['interesting_keywords']
+            clusters = [resumed] + [cluster for cluster in clusters if not set(cluster) & set(resumed)]
+        if not clusters:
+            self.logger.murmur(f"Kingdom for a good book!")
+            return False
+
+        started_at = time.monotonic()
+        self.metrics = {'backlog_keywords': sum(len(cluster) for cluster in clusters),
+                        'backlog_clusters': len(clusters),
+                        'drained_keywords': 0,
+                        'drained_clusters': 0}
+        self.logger.info(f"Draining keyword backlog: {self.metrics['backlog_keywords']} keywords in {len(clusters)} clusters.")
+
+        try:
+            for cluster in clusters:
+                if self.engaged.is_set():
+                    self.logger.debug(f"Environment interaction detected, leaving the rest of the backlog for later.")
+                    break
+                if self._checkpoint.get('interesting_keywords') != cluster:
+                    # A checkpoint of this cluster keeps its partial analysis, to be resumed
+                    self._checkpoint = {'interesting_keywords': cluster}
+                self.logger.debug(f"Pondering keyword cluster: {cluster}")
+                await self._reflect_on(cluster)
+                self._clear_checkpoint()
+                self.metrics['drained_keywords'] += len(cluster)
+                self.metrics['drained_clusters'] += 1
+        finally:
+            elapsed = time.monotonic() - started_at
+            self.metrics['elapsed_seconds'] = round(elapsed, 2)
+            self.metrics['drain_rate_per_minute'] = round(self.metrics['drained_keywords'] * 60 / elapsed, 2) if elapsed else 0.0
+            self.metrics['remaining_keywords'] = self.metrics['backlog_keywords'] - self.metrics['drained_keywords']
+            self.logger.info(f"Keyword backlog: {self.metrics['drained_keywords']} of {self.metrics['backlog_keywords']} keywords drained "
+                             f"in {elapsed:.1f}s ({self.metrics['drain_rate_per_minute']} keywords/min), "
+                             f"{self.metrics['remaining_keywords']} remaining.")
         return True
\ No newline at end of file
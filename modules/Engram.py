@@ -0,0 +1,275 @@
+import config
+from modules import logging_utils
+
+from modules.Stem import Stem
+
+import logging
+import os
+import json
+import hashlib
+from typing import Callable, Optional
+
+class Engram:
+    """
+    A class storing self-finetuning materials as a pre-tokenized, binary dataset.
+
+    Token ids of all samples are stored in a single memory-mapped file, with an index of sample offsets,
+    so the dataset is tokenized once and can be read without loading it into memory.
+    The finetuning tool reads the text format, so self-finetuning doesn't use this format; it is an export
+    produced by the converter for tools consuming token ids.
+
+    Files of a dataset share a base path: <base>.tokens (token ids), <base>.offsets.npy (sample offsets)
+    and <base>.engram.json (metadata).
+    """
+
+    def __init__(self, base_path: str):
+        """
+        Args:
+            base_path (str): Path of the dataset files without their extensions
+        """
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        import numpy as np
+
+        self.base_path = base_path
+        self.meta = Stem.memory_read(f"{base_path}.engram.json", 'json') or {}
+        if not self.meta:
+            raise FileNotFoundError(f"Dataset metadata not found at {base_path}.engram.json")
+        self.offsets = np.load(f"{base_path}.offsets.npy", mmap_mode='r')
+        self.tokens = np.memmap(f"{base_path}.tokens", dtype=self.meta['dtype'], mode='r') if self.offsets[-1] else np.zeros(0, dtype=self.meta['dtype'])
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int):
+        return self.tokens[self.offsets[index]:self.offsets[index + 1]]
+
+    @staticmethod
+    def write(base_path: str, samples: list) -> dict:
+        """
+        Writes tokenized samples as a dataset.
+
+        Args:
+            base_path (str): Path of the dataset files without their extensions
+            samples (list): Token id lists of the samples
+
+        Returns:
+            dict: Dataset metadata
+        """
+
+        import numpy as np
+
+        lengths = [len(sample) for sample in samples]
+        offsets = np.zeros(len(samples) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        vocabulary_max = max((max(sample) for sample in samples if len(sample)), default=0)
+        dtype = 'uint16' if vocabulary_max < 1 << 16 else 'uint32'
+
+        if offsets[-1]:
+            tokens = np.memmap(f"{base_path}.tokens", dtype=dtype, mode='w+', shape=(int(offsets[-1]),))
+            for sample, start in zip(samples, offsets[:-1]):
+                tokens[start:start + len(sample)] = sample
+            tokens.flush()
+            del tokens
+        else:
+            open(f"{base_path}.tokens", 'wb').close()
+        np.save(f"{base_path}.offsets.npy", offsets)
+
+        meta = {'dtype': dtype, 'samples': len(samples), 'tokens': int(offsets[-1])}
+        Stem.memory_write(f"{base_path}.engram.json", json.dumps(meta, indent=4))
+        return meta
+
+    @staticmethod
+    def from_text(text_path: str,
+                  tokenize: Callable[[str], list],
+                  base_path: Optional[str] = None,
+                  sample_start: str = "<s>") -> 'Engram':
+        """
+        Converts a text file of training samples into a dataset.
+
+        Args:
+            text_path (str): Path to the text file with samples
+            tokenize (Callable): Function converting a text into token ids with the model's tokenizer
+            base_path (str): Path of the dataset files without their extensions, next to the text file if not provided
+            sample_start (str): Marker starting each sample
+
+        Returns:
+            Engram: The written dataset
+        """
+
+        base_path = base_path or os.path.splitext(text_path)[0]
+        text = Stem.memory_read(text_path) or ''
+        samples = [tokenize((sample_start + chunk).strip()) for chunk in text.split(sample_start) if chunk.strip()]
+        Engram.write(base_path, samples)
+        return Engram(base_path)
+
+    def to_text(self, text_path: str, detokenize: Callable[[list], str], sample_start: str = "<s>") -> str:
+        """
+        Renders the dataset as a text file of samples for tools consuming the text format.
+
+        Args:
+            text_path (str): Path of the text file to be written
+            detokenize (Callable): Function converting token ids into a text with the model's tokenizer
+            sample_start (str): Marker starting each sample, restored if the tokenizer renders it as an empty string
+
+        Returns:
+            str: Path of the written text file
+        """
+
+        directory, file_name = os.path.split(text_path)
+        temp_path = os.path.join(directory, f".{file_name}.tmp")
+        with open(temp_path, 'w') as file:
+            for index in range(len(self)):
+                sample = detokenize([int(token) for token in self[index]]).strip()
+                if not sample.startswith(sample_start):
+                    sample = f"{sample_start}{sample}"
+                file.write(sample + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        # The finetuning tool only ever sees a complete file
+        os.replace(temp_path, text_path)
+        return text_path
+
+class DreamWriter:
+    """
+    A class writing generated dreams into a text dataset which only becomes visible once complete.
+
+    Dreams are buffered and appended in batches to a hidden temporary file next to the dataset. On commit,
+    the file is flushed to disk and atomically renamed to the dataset path, and a manifest with the number
+    of dreams, the size and the SHA-256 of the dataset is written next to it. An interrupted session leaves
+    only the temporary file, which is continued when the session is resumed.
+    """
+
+    def __init__(self, dataset_path: str, resumed_dreams: int = 0, batch_size: int = None):
+        """
+        Args:
+            dataset_path (str): Path of the dataset text file
+            resumed_dreams (int): Number of dreams already in the temporary file of an interrupted session
+            batch_size (int): Number of dreams buffered before they are written, config.dream_write_batch if not given
+        """
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        self.path = dataset_path
+        directory, file_name = os.path.split(dataset_path)
+        self.temp_path = os.path.join(directory, f".{file_name}.partial")
+        self._batch_size = batch_size if batch_size is not None else config.dream_write_batch
+        self._buffer = []
+        self._digest = hashlib.sha256()
+        self.dreams = resumed_dreams
+        self.bytes = 0
+
+        if resumed_dreams and os.path.exists(self.temp_path):
+            with open(self.temp_path, 'rb') as file:
+                for chunk in iter(lambda: file.read(1 << 20), b''):
+                    self._digest.update(chunk)
+                    self.bytes += len(chunk)
+            self.logger.debug(f"Continuing {self.temp_path} with {resumed_dreams} dreams.")
+        else:
+            self.dreams = 0
+        self._file = open(self.temp_path, 'ab' if self.dreams else 'wb')
+
+    @staticmethod
+    def manifest_path(dataset_path: str) -> str:
+        return f"{os.path.splitext(dataset_path)[0]}_manifest.json"
+
+    def write(self, dream: str) -> None:
+        """
+        Adds a dream to the dataset, writing the buffer once it holds a full batch.
+        """
+
+        data = (dream + '\n').encode()
+        self._buffer.append(data)
+        self._digest.update(data)
+        self.dreams += 1
+        self.bytes += len(data)
+        if len(self._buffer) >= self._batch_size:
+            self.flush()
+
+    def flush(self, sync: bool = False) -> None:
+        """
+        Writes buffered dreams to the temporary file, flushing it to disk if sync is set.
+        """
+
+        if self._buffer:
+            self._file.write(b''.join(self._buffer))
+            self._buffer.clear()
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        """
+        Writes buffered dreams and closes the temporary file without committing it, e.g. when the session is interrupted.
+        """
+
+        if not self._file.closed:
+            self.flush(sync=True)
+            self._file.close()
+
+    def commit(self, generation: Optional[dict] = None) -> dict:
+        """
+        Completes the dataset: renames the temporary file to the dataset path and writes the manifest.
+
+        Args:
+            generation (dict): Statistics of the generation, recorded in the manifest
+
+        Returns:
+            dict: The manifest
+        """
+
+        self.close()
+        os.replace(self.temp_path, self.path)
+        Stem.fsync_directory(os.path.dirname(self.path))
+        manifest = {'dataset': os.path.basename(self.path),
+                    'dreams': self.dreams,
+                    'bytes': self.bytes,
+                    'sha256': self._digest.hexdigest(),
+                    'created': Stem.get_timestamp()}
+        if generation:
+            manifest['generation'] = generation
+        Stem.atomic_write(DreamWriter.manifest_path(self.path), json.dumps(manifest, indent=4))
+        self.logger.debug(f"Dataset {self.path} completed: {manifest}")
+        return manifest
+
+    @staticmethod
+    def verify(dataset_path: str) -> Optional[dict]:
+        """
+        Checks that a dataset is complete: its manifest exists and its size and hash match it.
+
+        Returns:
+            dict: The manifest, None if the dataset is incomplete or corrupted
+        """
+
+        manifest_path = DreamWriter.manifest_path(dataset_path)
+        if not os.path.exists(dataset_path) or not os.path.exists(manifest_path):
+            return None
+        manifest = Stem.memory_read(manifest_path, 'json')
+        if not manifest or os.path.getsize(dataset_path) != manifest.get('bytes'):
+            return None
+        digest = hashlib.sha256()
+        with open(dataset_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+        return manifest if digest.hexdigest() == manifest.get('sha256') else None
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Converts training materials between the text and the tokenized dataset formats.")
+    parser.add_argument('direction', choices=['to-engram', 'to-text'])
+    parser.add_argument('source', help="Text file (to-engram) or dataset base path (to-text)")
+    parser.add_argument('target', nargs='?', help="Dataset base path (to-engram) or text file (to-text)")
+    parser.add_argument('--model', default=config.model_path, help="Model whose tokenizer is used")
+    args = parser.parse_args()
+
+    import llama_cpp
+
+    vocab = llama_cpp.Llama(model_path=args.model, vocab_only=True, verbose=False)
+    if args.direction == 'to-engram':
+        engram = Engram.from_text(args.source, lambda text: vocab.tokenize(text.encode(), add_bos=False, special=True), args.target)
+        print(json.dumps(engram.meta, indent=4))
+    else:
+        print(Engram(args.source).to_text(args.target or f"{args.source}.txt",
+                                          lambda tokens: vocab.detokenize(tokens, special=True).decode(errors='replace')))
@@ -0,0 +1,132 @@
+import config
+from modules import logging_utils
+
+from modules.Stem import Stem
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+class Hippocampus:
+    """
+    A class indexing saved conversations by their content, so that past conversations can be recalled
+    by what was said in them, not only by the keywords generated for them.
+
+    Conversations are kept in a SQLite FTS5 full-text index, updated incrementally as they are saved,
+    and searched with BM25 ranking. The index is synchronized with the conversations directory,
+    so that conversations saved by other processes or before the index existed are found as well.
+    """
+
+    def __init__(self, index_path: str = config.hippocampus_path, conversations_dir: str = config.conversations_dir):
+        """
+        Args:
+            index_path (str): Location of the SQLite database file storing the index
+            conversations_dir (str): Directory of saved conversations
+        """
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.info(f"Instantiating {self.__class__.__name__}")
+
+        self._conversations_dir = conversations_dir
+        index_dir = os.path.dirname(index_path)
+        if index_dir:
+            Stem.prepare_directory(index_dir)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(index_path, check_same_thread=False)
+        # Several processes (e.g. the entity and replay sessions) may write to the index
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS conversations
+                                    USING fts5(path UNINDEXED, content, tokenize='porter unicode61')""")
+        self._connection.execute("""CREATE TABLE IF NOT EXISTS indexed (
+                                        path TEXT PRIMARY KEY,
+                                        mtime REAL NOT NULL)""")
+        self._connection.commit()
+
+    def remember(self, path: str, content: str = None) -> None:
+        """
+        Adds a conversation to the index, replacing its previous version.
+
+        Args:
+            path (str): Path to the conversation file
+            content (str): Conversation text, read from the file if not given
+        """
+
+        content = content if content is not None else (Stem.memory_read(path) or '')
+        # Speaker labels occur in every conversation, they carry no content and would make queries scan all of them
+        content = re.sub(r'^(User|You):', '', content, flags=re.MULTILINE)
+        mtime = os.path.getmtime(path) if os.path.exists(path) else time.time()
+        with self._lock:
+            self._connection.execute("DELETE FROM conversations WHERE path = ?", (path,))
+            self._connection.execute("INSERT INTO conversations (path, content) VALUES (?, ?)", (path, content))
+            self._connection.execute("INSERT OR REPLACE INTO indexed VALUES (?, ?)", (path, mtime))
+            self._connection.commit()
+
+    def forget(self, path: str) -> None:
+        """
+        Removes a conversation from the index.
+        """
+
+        with self._lock:
+            self._connection.execute("DELETE FROM conversations WHERE path = ?", (path,))
+            self._connection.execute("DELETE FROM indexed WHERE path = ?", (path,))
+            self._connection.commit()
+
+    def sync(self) -> int:
+        """
+        Indexes new and modified conversation files, and removes deleted ones from the index.
+
+        Returns:
+            int: Number of indexed or removed conversations
+        """
+
+        files = {}
+        if os.path.isdir(self._conversations_dir):
+            with os.scandir(self._conversations_dir) as entries:
+                files = {os.path.join(self._conversations_dir, entry.name): entry.stat().st_mtime for entry in entries
+                         if entry.name.startswith("conversation_") and entry.name.endswith(".txt") and entry.is_file()}
+        with self._lock:
+            indexed = dict(self._connection.execute("SELECT path, mtime FROM indexed").fetchall())
+
+        changed = [path for path, mtime in files.items() if indexed.get(path) != mtime]
+        deleted = [path for path in indexed if path not in files]
+        for path in changed:
+            self.remember(path)
+        for path in deleted:
+            self.forget(path)
+        if changed or deleted:
+            self.logger.debug(f"Indexed {len(changed)} and removed {len(deleted)} conversations.")
+        return len(changed) + len(deleted)
+
+    @staticmethod
+    def _match_query(query: str) -> str:
+        # Terms are quoted, so that FTS5 operators and punctuation in the query are taken literally
+        terms = dict.fromkeys(term.lower() for term in re.findall(r'\w+', query))
+        return ' OR '.join(f'"{term}"' for term in terms)
+
+    def search(self, query: str, limit: int = None) -> list:
+        """
+        Finds conversations matching any of the query terms, best matches first.
+
+        Args:
+            query (str): Free text or keywords
+            limit (int): Maximum number of conversations returned, config.hippocampus_results if not given
+
+        Returns:
+            list: (path, score) tuples, the higher the score the better the match (negated BM25 rank)
+        """
+
+        limit = limit if limit is not None else config.hippocampus_results
+        match = self._match_query(query)
+        if not match:
+            return []
+        started_at = time.perf_counter()
+        with self._lock:
+            rows = self._connection.execute("""SELECT path, rank FROM conversations WHERE conversations MATCH ?
+                                               ORDER BY rank LIMIT ?""", (match, limit)).fetchall()
+        self.logger.debug(f"Full-text search for {query!r} found {len(rows)} conversations in "
+                          f"{(time.perf_counter() - started_at) * 1000:.1f} ms.")
+        return [(path, -rank) for path, rank in rows]
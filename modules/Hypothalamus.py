@@ -0,0 +1,223 @@
+import config
+from modules import logging_utils
+from modules.Configuration import Configuration
+
+import logging
+import asyncio
+import os
+import resource
+import time
+from contextlib import contextmanager
+from glob import glob
+from typing import Optional
+
+class Hypothalamus:
+    """
+    A class governing resources used by the entity in each cognitive mode (engaged, DMN, REM, idle).
+
+    It samples CPU time and resident memory of the process and of its children (worker processes,
+    finetuning tools), attributing them to the current mode, and decides whether resource-heavy
+    work fits the configured budgets: whether finetuning can start, how many threads it gets, and
+    whether the resident model has to be unloaded for its duration. All decisions are recorded
+    with their reasons and exposed with usage statistics by metrics().
+    """
+
+    def __init__(self, engaged_event: asyncio.Event, memory_budget_bytes: int = config.memory_budget_bytes):
+        """
+        Args:
+            engaged_event (asyncio.Event): Event set while the entity interacts with the environment
+            memory_budget_bytes (int): Memory budget including child processes, 0 to use the memory available at start
+        """
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.info(f"Instantiating {self.__class__.__name__}")
+
+        self.engaged = engaged_event
+        self.memory_budget = memory_budget_bytes or (self._meminfo('MemAvailable') + self.rss())
+
+        self._mode = None
+        self.usage = {}
+        self.decisions = []
+        self._last_sample = self._cpu_seconds()
+        self.logger.debug(f"Memory budget: {self.memory_budget / (1 << 30):.1f} GiB.")
+
+    @staticmethod
+    def _meminfo(field: str) -> int:
+        """
+        Reads a field of /proc/meminfo in bytes.
+        """
+
+        with open('/proc/meminfo') as file:
+            for line in file:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+        return 0
+
+    @staticmethod
+    def _process_rss(pid) -> int:
+        try:
+            with open(f'/proc/{pid}/status') as file:
+                for line in file:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return 0
+
+    @staticmethod
+    def _children(pid) -> list:
+        children = []
+        for children_file in glob(f'/proc/{pid}/task/*/children'):
+            try:
+                with open(children_file) as file:
+                    children += file.read().split()
+            except OSError:
+                pass
+        return children
+
+    def rss(self, pid=None) -> int:
+        """
+        Resident memory of a process and all its descendants (in bytes), of this process by default.
+        """
+
+        pid = pid or os.getpid()
+        return self._process_rss(pid) + sum(self.rss(child) for child in self._children(pid))
+
+    @staticmethod
+    def _cpu_seconds() -> float:
+        self_usage = resource.getrusage(resource.RUSAGE_SELF)
+        children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return self_usage.ru_utime + self_usage.ru_stime + children_usage.ru_utime + children_usage.ru_stime
+
+    @property
+    def mode(self) -> str:
+        """
+        Current cognitive mode: the one entered with enter(), 'engaged' during interactions, 'idle' otherwise.
+        """
+
+        return self._mode or ('engaged' if self.engaged.is_set() else 'idle')
+
+    @contextmanager
+    def enter(self, mode: str):
+        """
+        Context manager attributing resource usage within it to a given mode.
+        """
+
+        self.sample()
+        self._mode = mode
+        logging_utils.mark_mode(mode)
+        try:
+            yield
+        finally:
+            self.sample()
+            self._mode = None
+            logging_utils.mark_mode('idle')
+
+    def sample(self) -> None:
+        """
+        Attributes CPU time used since the last sample and the current resident memory to the current mode.
+        Children's CPU time is accounted when they finish.
+        """
+
+        cpu_seconds = self._cpu_seconds()
+        rss = self.rss()
+        usage = self.usage.setdefault(self.mode, {'cpu_seconds': 0.0, 'peak_rss': 0, 'last_rss': 0})
+        usage['cpu_seconds'] += cpu_seconds - self._last_sample
+        usage['peak_rss'] = max(usage['peak_rss'], rss)
+        usage['last_rss'] = rss
+        self._last_sample = cpu_seconds
+        if rss > self.memory_budget:
+            self._decide('over_budget', f"{self.mode} uses {rss >> 20} MiB of {self.memory_budget >> 20} MiB budget")
+
+    async def monitor(self, interval: float = None) -> None:
+        """
+        Samples resource usage periodically, every config.governor_sample_seconds if no interval is given.
+        """
+
+        while True:
+            await asyncio.sleep(interval if interval is not None else config.governor_sample_seconds)
+            self.sample()
+
+    def _decide(self, decision: str, reason: str) -> str:
+        self.decisions.append({'time': time.time(), 'mode': self.mode, 'decision': decision, 'reason': reason})
+        self.logger.info(f"Decision: {decision} ({reason}).")
+        return decision
+
+    def finetune_threads(self, interactive_threads: int = 0) -> int:
+        """
+        Number of threads finetuning tools may use: capped by the finetune profile (or config.finetune_max_threads),
+        and leaving the threads of the resident model free for interactions.
+
+        Args:
+            interactive_threads (int): Threads used by the resident model in interactions, 0 if it is unloaded
+        """
+
+        threads = max(config.available_threads - interactive_threads, 1)
+        max_threads = Configuration.profile('finetune').get('n_threads') or config.finetune_max_threads
+        if max_threads:
+            threads = min(threads, max_threads)
+        self._decide('finetune_threads', f"{threads} of {config.available_threads} threads, {interactive_threads} reserved for interactions")
+        return threads
+
+    def plan_finetuning(self, model_path: str, resident_model: bool = True) -> str:
+        """
+        Decides if a finetuning session fits the budgets.
+
+        Args:
+            model_path (str): Path to the base model the finetuning loads
+            resident_model (bool): Informs if the model is loaded in this process, so it can be unloaded
+
+        Returns:
+            str: 'refuse' if it can't start now, 'unload_model' if it fits only after unloading the resident model,
+                 'start' otherwise
+        """
+
+        if self.engaged.is_set():
+            return self._decide('refuse', "interaction in progress")
+
+        model_size = os.path.getsize(model_path) if os.path.exists(model_path) else 0
+        return self._plan_memory(int(model_size * config.finetune_memory_factor), model_size, resident_model)
+
+    def plan_evaluation(self, model_path: str, resident_model: bool = True) -> str:
+        """
+        Decides if loading a model for its evaluation fits the memory budget.
+
+        Args:
+            model_path (str): Path to the evaluated model
+            resident_model (bool): Informs if the model is loaded in this process, so it can be unloaded
+
+        Returns:
+            str: 'refuse' if it doesn't fit, 'unload_model' if it fits only after unloading the resident model,
+                 'start' otherwise
+        """
+
+        model_size = os.path.getsize(model_path) if os.path.exists(model_path) else 0
+        return self._plan_memory(int(model_size * config.eval_memory_factor), model_size, resident_model)
+
+    def _plan_memory(self, required: int, model_size: int, resident_model: bool) -> str:
+        rss = self.rss()
+        available = min(self.memory_budget - rss, self._meminfo('MemAvailable'))
+        if required <= available:
+            return self._decide('start', f"needs {required >> 20} MiB, {available >> 20} MiB available")
+        # Model weights are memory-mapped, so unloading it frees about its file size
+        if resident_model and required <= available + model_size:
+            return self._decide('unload_model', f"needs {required >> 20} MiB, {available >> 20} MiB available with the model loaded")
+        return self._decide('refuse', f"needs {required >> 20} MiB, {(available + model_size) >> 20} MiB available even without the model")
+
+    def metrics(self) -> dict:
+        """
+        Resource usage per mode, decisions made and the budget.
+        """
+
+        self.sample()
+        return {'memory_budget': self.memory_budget, 'usage': self.usage, 'decisions': self.decisions}
+
+    def report(self) -> dict:
+        """
+        Logs resource usage per mode.
+        """
+
+        metrics = self.metrics()
+        for mode, usage in metrics['usage'].items():
+            self.logger.info(f"{mode}: {usage['cpu_seconds']:.1f} CPU seconds, peak RSS {usage['peak_rss'] >> 20} MiB.")
+        return metrics
@@ -0,0 +1,172 @@
+import config
+from modules import logging_utils
+
+import logging
+import http.client
+import json
+import queue
+import socket
+import subprocess
+import time
+from typing import Optional
+from urllib.parse import urlparse
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    HTTP connection over a Unix domain socket.
+    """
+
+    def __init__(self, socket_path: str, timeout: Optional[float] = None):
+        super().__init__('localhost', timeout=timeout)
+        self._socket_path = socket_path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self._socket_path)
+
+class InferenceServerClient:
+    """
+    A class serving as the PFC model when the LLM runs in a separate, local llama.cpp server process.
+
+    The model stays loaded in the server across restarts of the cognitive loop and can be shared by several
+    AS processes. Requests go through the OpenAI-compatible completions endpoint over HTTP or a Unix socket,
+    using a pool of persistent connections, so several requests can be in flight at once.
+    It mirrors the part of the langchain LlamaCpp interface used by PerceptiveFrameworkCore.
+    """
+
+    def __init__(self,
+                 server_url: str = config.inference_server_url,
+                 pool_size: int = config.inference_pool_size,
+                 temperature: float = config.model_temp,
+                 max_tokens: int = 4000):
+        """
+        Args:
+            server_url (str): Server address, 'http://host:port' or 'unix:///path/to/socket'
+            pool_size (int): Number of persistent connections, i.e. maximum number of requests in flight
+            temperature (float): Default sampling temperature
+            max_tokens (int): Default maximum number of generated tokens
+        """
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.info(f"Instantiating {self.__class__.__name__} for {server_url}")
+
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.pool_size = pool_size
+
+        self._url = urlparse(server_url)
+        self._connections = queue.LifoQueue()
+        for _ in range(pool_size):
+            self._connections.put(None)
+
+        self._ensure_server()
+
+    def _connect(self) -> http.client.HTTPConnection:
+        timeout = config.inference_server_timeout
+        if self._url.scheme == 'unix':
+            return UnixHTTPConnection(self._url.path, timeout=timeout)
+        return http.client.HTTPConnection(self._url.hostname, self._url.port or 80, timeout=timeout)
+
+    def _request(self, method: str, path: str, payload: Optional[dict] = None) -> dict:
+        """
+        Sends a request over a pooled connection, reconnecting once if a reused connection went stale.
+        Requests are never re-sent after a timeout, as the server may still be processing them.
+        """
+
+        connection = self._connections.get()
+        try:
+            body = json.dumps(payload) if payload is not None else None
+            reused = connection is not None
+            if connection is None:
+                connection = self._connect()
+            while True:
+                try:
+                    connection.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+                    response = connection.getresponse()
+                    data = response.read()
+                    break
+                except (http.client.RemoteDisconnected, BrokenPipeError):
+                    connection.close()
+                    connection = None
+                    # A keep-alive connection closed by the server fails before any response arrives
+                    if not reused:
+                        raise
+                    reused = False
+                    connection = self._connect()
+                except (http.client.HTTPException, OSError):
+                    connection.close()
+                    connection = None
+                    raise
+            if response.status != 200:
+                raise RuntimeError(f"Inference server returned {response.status}: {data[:200]}")
+            return json.loads(data)
+        finally:
+            self._connections.put(connection)
+
+    def _ensure_server(self) -> None:
+        """
+        Checks if the server is up, starting it with the configured command if it is not.
+        The server is started in a separate session, so it outlives the AS process.
+        """
+
+        try:
+            self._request('GET', '/health')
+            return
+        except (ConnectionError, OSError, RuntimeError):
+            if not config.inference_server_command:
+                raise ConnectionError(f"Inference server at {self._url.geturl()} is not available.")
+
+        self.logger.info(f"Starting inference server: {config.inference_server_command}")
+        subprocess.Popen(config.inference_server_command, start_new_session=True,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + config.inference_server_timeout
+        while time.monotonic() < deadline:
+            try:
+                self._request('GET', '/health')
+                return
+            except (ConnectionError, OSError, RuntimeError):
+                time.sleep(1)
+        raise ConnectionError(f"Inference server at {self._url.geturl()} did not start in time.")
+
+    def invoke(self, prompt: str, **kwargs) -> str:
+        """
+        Generates the model response for a given prompt.
+
+        Args:
+            prompt (str): The prompt to be processed
+            kwargs: Sampling parameters (temperature, max_tokens, stop, grammar, ...)
+
+        Returns:
+            str: Generated text
+        """
+
+        payload = {'prompt': prompt,
+                   'temperature': self.temperature,
+                   'max_tokens': self.max_tokens,
+                   'cache_prompt': True,
+                   **kwargs}
+        result = self._request('POST', '/v1/completions', payload)
+        return result['choices'][0]['text']
+
+    def tokenize(self, text: str) -> list:
+        """
+        Converts a text into token ids with the server's tokenizer.
+        """
+
+        return self._request('POST', '/tokenize', {'content': text})['tokens']
+
+    def detokenize(self, tokens: list) -> str:
+        """
+        Converts token ids into a text with the server's tokenizer.
+        """
+
+        return self._request('POST', '/detokenize', {'tokens': tokens})['content']
+
+    def get_num_tokens(self, text: str) -> int:
+        """
+        Counts tokens of a given text with the server's tokenizer.
+        """
+
+        return len(self.tokenize(text))
@@ -0,0 +1,116 @@
+import config
+from modules import logging_utils
+
+from modules.Stem import Stem
+from modules.ResponseCache import ResponseCache
+
+import logging
+import os
+import json
+import shutil
+from typing import Optional
+
+class ModelStore:
+    """
+    A class keeping previous versions of the base model, so that a transplanted model can be rolled back.
+
+    Replaced model files are moved (not copied) into the store directory, and a manifest records their
+    fingerprints and evaluation scores. Only the most recent versions are kept.
+    """
+
+    def __init__(self, store_dir: str = config.model_store_dir, keep: int = config.model_store_keep):
+        """
+        Args:
+            store_dir (str): Directory storing previous model versions and the manifest
+            keep (int): Number of previous versions kept
+        """
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.info(f"Instantiating {self.__class__.__name__}")
+
+        self._store_dir = store_dir
+        self._keep = keep
+        self._manifest_path = os.path.join(store_dir, "manifest.json")
+        Stem.prepare_directory(store_dir)
+        self.manifest = Stem.memory_read(self._manifest_path, 'json') if os.path.exists(self._manifest_path) else {}
+        self.manifest = self.manifest or {'versions': [], 'scores': {}}
+
+    def _save(self) -> None:
+        Stem.memory_write(self._manifest_path, json.dumps(self.manifest, indent=4))
+
+    @property
+    def versions(self) -> list:
+        """
+        Stored versions, oldest first, as dicts with the file path, fingerprint and storing time.
+        """
+
+        return self.manifest['versions']
+
+    def latest(self) -> Optional[dict]:
+        return self.versions[-1] if self.versions else None
+
+    def shelve(self, model_path: str) -> dict:
+        """
+        Moves the current model file into the store, pruning the oldest versions.
+
+        Args:
+            model_path (str): Path to the model file being replaced
+
+        Returns:
+            dict: The stored version
+        """
+
+        fingerprint = Stem.model_fingerprint(model_path)
+        timestamp = Stem.get_timestamp()
+        version_path = os.path.join(self._store_dir, f"{timestamp}_{os.path.basename(model_path)}")
+        self.logger.debug(f"Moving {model_path} to the model store as {version_path}.")
+        shutil.move(model_path, version_path)
+        version = {'path': version_path, 'fingerprint': fingerprint, 'stored_at': timestamp}
+        self.versions.append(version)
+
+        while len(self.versions) > self._keep:
+            expired = self.versions.pop(0)
+            self.logger.info(f"Removing expired model version {expired['path']}.")
+            if os.path.exists(expired['path']):
+                os.remove(expired['path'])
+        self._save()
+        return version
+
+    def rollback(self, model_path: str) -> dict:
+        """
+        Replaces the current model file with the latest stored version, discarding the current one.
+
+        Args:
+            model_path (str): Path to the model file to be replaced
+
+        Returns:
+            dict: The restored version
+        """
+
+        if not self.versions:
+            raise FileNotFoundError(f"No stored model version to roll back to.")
+        version = self.versions.pop()
+        self.logger.warning(f"Rolling {model_path} back to {version['path']}.")
+        if os.path.exists(model_path):
+            os.remove(model_path)
+        shutil.move(version['path'], model_path)
+        self._save()
+
+        # Responses generated by the discarded model are no longer valid
+        ResponseCache.invalidate()
+        return version
+
+    def scores(self, fingerprint: str) -> Optional[dict]:
+        """
+        Returns cached evaluation scores of a model version.
+        """
+
+        return self.manifest['scores'].get(fingerprint)
+
+    def record_scores(self, fingerprint: str, scores: dict) -> None:
+        """
+        Caches evaluation scores of a model version.
+        """
+
+        self.manifest['scores'][fingerprint] = scores
+        self._save()
@@ -0,0 +1,735 @@
+import config
+from modules import logging_utils
+
+from modules.Stem import Stem
+from modules.Cerebellum import Cerebellum
+from modules.ResponseCache import ResponseCache
+from modules.InferenceServer import InferenceServerClient
+from modules.Configuration import Configuration
+
+import logging
+import gc
+import os
+import time
+import asyncio
+import threading
+import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Optional
+
+class Preempted(Exception):
+    """
+    Raised when a generation has been stopped at a token boundary to give way to an interaction.
+    The text generated so far is kept, so that the generation can be resumed later.
+    """
+
+    def __init__(self, partial: str):
+        super().__init__("Generation preempted.")
+        self.partial = partial
+
+class DraftModel:
+    """
+    A class proposing tokens for speculative decoding of the main model with a small LLM.
+    It implements the llama_cpp.llama_speculative.LlamaDraftModel interface; llama_cpp itself
+    is imported only when the models are loaded.
+
+    It also keeps track of how many of the proposed tokens have been accepted by the main model,
+    broken down by the task currently being processed.
+    """
+
+    def __init__(self, llm, num_pred_tokens: int = 8):
+        """
+        Args:
+            llm: llama_cpp.Llama instance of the small model
+            num_pred_tokens (int): Number of tokens proposed in a single step
+        """
+
+        import numpy as np
+        self._np = np
+
+        self.llm = llm
+        self.num_pred_tokens = num_pred_tokens
+        self.task = None
+        self.stats = {}
+        self._last_input = np.array([], dtype=np.intc)
+        self._last_draft = np.array([], dtype=np.intc)
+
+    def _update_acceptance(self, input_ids) -> None:
+        """
+        Compares the previous proposal with the tokens the main model kept since then.
+        """
+
+        previous_len = len(self._last_input)
+        if previous_len == 0 or len(input_ids) <= previous_len or not self._np.array_equal(input_ids[:previous_len], self._last_input):
+            # New completion, previous proposal can't be verified
+            return
+
+        kept = input_ids[previous_len:]
+        accepted = 0
+        for kept_token, draft_token in zip(kept, self._last_draft):
+            if kept_token != draft_token:
+                break
+            accepted += 1
+
+        task_stats = self.stats.setdefault(self.task, {'rounds': 0, 'drafted': 0, 'accepted': 0})
+        task_stats['rounds'] += 1
+        task_stats['drafted'] += len(self._last_draft)
+        task_stats['accepted'] += accepted
+
+    def __call__(self, input_ids, **kwargs):
+        self._update_acceptance(input_ids)
+
+        draft = []
+        for token in self.llm.generate(input_ids.tolist(), top_k=1, temp=0, reset=True):
+            draft.append(token)
+            if len(draft) >= self.num_pred_tokens:
+                break
+
+        self._last_input = self._np.array(input_ids, dtype=self._np.intc)
+        self._last_draft = self._np.array(draft, dtype=self._np.intc)
+        return self._last_draft
+
+class PrefixCache:
+    """
+    A class storing evaluated model state for prompt prefixes, so that prompts sharing a prefix with a
+    previously processed one skip its evaluation. It wraps llama_cpp.LlamaRAMCache (LRU evicting the least
+    recently used states once their total size exceeds the capacity) and counts hits and prompt tokens
+    restored from the cache per task.
+    """
+
+    def __init__(self, capacity_bytes: int):
+        """
+        Args:
+            capacity_bytes (int): Maximum total size of the stored states
+        """
+
+        import llama_cpp
+        self._longest_token_prefix = llama_cpp.Llama.longest_token_prefix
+        self._cache = llama_cpp.LlamaRAMCache(capacity_bytes=capacity_bytes)
+        self.task = None
+        self.stats = {}
+
+    @property
+    def cache_size(self) -> int:
+        return self._cache.cache_size
+
+    def _task_stats(self) -> dict:
+        return self.stats.setdefault(self.task, {'lookups': 0, 'hits': 0, 'saved_tokens': 0})
+
+    def __getitem__(self, key):
+        task_stats = self._task_stats()
+        task_stats['lookups'] += 1
+        state = self._cache[key]
+        task_stats['hits'] += 1
+        task_stats['saved_tokens'] += self._longest_token_prefix(state.input_ids.tolist(), list(key))
+        return state
+
+    def __contains__(self, key) -> bool:
+        return key in self._cache
+
+    def __setitem__(self, key, value) -> None:
+        self._cache[key] = value
+
+    def clear(self) -> None:
+        """
+        Drops all stored states, e.g. after the model weights changed.
+        """
+
+        self._cache.cache_state.clear()
+
+class PerceptiveFrameworkCore:
+    """
+    A class wrapping the LLM serving as the entity's Prefrontal Cortex.
+
+    This class owns loading of the base model and of the LoRA adapters stacked on top of it by
+    the self-finetuning sessions, so that other modules can simply invoke it with prompts.
+    Optionally, a small draft model speeds up the main model with speculative decoding and
+    answers cheap structural tasks on its own.
+
+    The model is either loaded into the process, or served by a local llama.cpp server process
+    (config.inference_backend), in which case adapters, runtime parameters and prompt caching are
+    managed by the server.
+    """
+
+    def __init__(self, model_path: str = config.model_path):
+        """
+        Initializes the PerceptiveFrameworkCore class. The model itself is loaded with load().
+
+        Args:
+            model_path (str): Path to the base LLM model file on disk
+        """
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.info(f"Instantiating {self.__class__.__name__}")
+
+        self._model_path = model_path
+        self.llm = None
+
+        # Reason the model has been unloaded for (e.g. a finetuning session holding its memory), None if it can be reloaded
+        self.suspended = None
+        self.draft_llm = None
+        self._draft_model = None
+        self._prefix_cache = None
+        self._response_cache = None
+        self.adapters = []
+
+        # Weights of attached adapters, and their handles when loaded separately from the base weights
+        self._adapter_weights = {}
+        self._adapter_handles = {}
+
+        # Fingerprints of loaded model files, part of the response cache keys
+        self._model_versions = {}
+
+        # Runtime parameters keyed by workload, and the workload the model is currently tuned for
+        self.runtime_params = {}
+        self.workload = None
+
+        # Number of processes (e.g. background workers) splitting the threads of a workload between them
+        self.cpu_shares = 1
+
+        # Generation statistics per task (prompt template key)
+        self.stats = {}
+
+        # Context window size, and generation parameters attached to prompt templates, by task
+        self.n_ctx = None
+        self._generation_params = {}
+
+        # Compiled grammars by their definitions
+        self._grammars = {}
+
+        # Duration of loading phases in seconds
+        self.load_phases = {}
+
+        # Serializes access to the in-process model, which is not thread-safe
+        self._lock = threading.Lock()
+
+        Configuration.subscribe(self._on_configuration_change)
+
+    def load(self) -> None:
+        """
+        Loads the base model, the draft model if configured, and applies all LoRA adapters awaiting compaction.
+        """
+
+        self._generation_params = {}
+        if config.inference_backend == 'server':
+            self.n_ctx = Configuration.profile('interactive').get('n_ctx') or 4096
+            with Stem.timed_phase(self.load_phases, 'model_load'):
+                self.llm = InferenceServerClient()
+            self.workload = None
+            self.set_workload('interactive')
+            if config.response_cache_bytes:
+                # The served model file may not be accessible from this host
+                self._model_versions['main'] = (Stem.model_fingerprint(self._model_path) if os.path.exists(self._model_path)
+                                                else config.inference_server_url)
+                self._response_cache = ResponseCache()
+            return
+
+        with Stem.timed_phase(self.load_phases, 'llm_imports'):
+            from langchain_community.llms import LlamaCpp
+
+        with Stem.timed_phase(self.load_phases, 'runtime_calibration'):
+            self.runtime_params = Cerebellum(self._model_path).runtime_params()
+        params = self.workload_params('interactive')
+        profile = Configuration.profile('interactive')
+        n_ctx = profile.get('n_ctx') or 4096
+        self.n_ctx = n_ctx
+
+        model_kwargs = {'n_threads_batch': params['n_threads_batch'], 'numa': params['numa']}
+        if config.draft_model_path:
+            self.logger.debug(f"Loading draft LLM from {config.draft_model_path}.")
+            self.draft_llm = LlamaCpp(model_path=config.draft_model_path,
+                                      temperature=config.model_temp,
+                                      n_ctx=n_ctx,
+                                      max_tokens=4000,
+                                      n_threads=params['n_threads'],
+                                      n_batch=params['n_batch'],
+                                      model_kwargs=dict(model_kwargs))
+            self._draft_model = DraftModel(self.draft_llm.client, config.draft_tokens_num)
+            model_kwargs['draft_model'] = self._draft_model
+
+        self.logger.debug(f"Loading LLM from {self._model_path} with runtime parameters: {params}.")
+        model_load_start = time.perf_counter()
+        self.llm = LlamaCpp(model_path=self._model_path,
+                            temperature=config.model_temp,
+                            n_ctx=n_ctx,
+                            max_tokens=4000,
+                            n_threads=params['n_threads'],
+                            n_batch=params['n_batch'],
+                            use_mmap=params['use_mmap'],
+                            use_mlock=params['use_mlock'],
+                            model_kwargs=model_kwargs)
+        self.workload = None
+        self.set_workload('interactive')
+        if config.prefix_cache_bytes:
+            self._prefix_cache = PrefixCache(config.prefix_cache_bytes)
+            self.llm.client.set_cache(self._prefix_cache)
+        self.adapters = []
+        self._adapter_weights = {}
+        self._adapter_handles = {}
+        for adapter in Stem.read_adapter_stack():
+            self.attach_adapter(adapter['adapter'], adapter['weight'])
+        self.load_phases['model_load'] = time.perf_counter() - model_load_start
+
+        if config.response_cache_bytes:
+            self._model_versions['main'] = Stem.model_fingerprint(self._model_path)
+            if self.draft_llm:
+                self._model_versions['draft'] = Stem.model_fingerprint(config.draft_model_path)
+            self._response_cache = ResponseCache()
+        self.logger.debug(f"LLM loaded with {len(self.adapters)} LoRA adapter(s).")
+
+    def unload(self) -> None:
+        """
+        Frees the resident model, e.g. to make room for a finetuning session. It is loaded again with load().
+        """
+
+        if not self.in_process:
+            return
+        self.logger.debug(f"Unloading LLM.")
+        with self._lock:
+            self.llm = None
+            self.draft_llm = None
+            self._draft_model = None
+            self._prefix_cache = None
+            self.adapters = []
+            self._adapter_weights = {}
+            self._adapter_handles = {}
+            self.workload = None
+        gc.collect()
+
+    def suspend(self, reason: str) -> None:
+        """
+        Unloads the model and keeps it from being reloaded on demand until resume() is called.
+
+        Args:
+            reason (str): What the model's memory is needed for
+        """
+
+        self.unload()
+        self.suspended = reason
+
+    def resume(self) -> None:
+        """
+        Allows the model to be loaded again after suspend().
+        """
+
+        self.suspended = None
+
+    @property
+    def loaded(self) -> bool:
+        """
+        Informs if the model is loaded (or the inference server connected).
+        """
+
+        return self.llm is not None
+
+    @property
+    def in_process(self) -> bool:
+        """
+        Informs if the model is loaded into this process, rather than served by an inference server.
+        """
+
+        return not isinstance(self.llm, InferenceServerClient)
+
+    @property
+    def parallelism(self) -> int:
+        """
+        Number of prompts that can be processed concurrently.
+        """
+
+        parallelism = self.llm.pool_size if not self.in_process else 1
+        concurrency = Configuration.profile(self.workload or 'interactive').get('concurrency')
+        return min(parallelism, concurrency) if concurrency else parallelism
+
+    def workload_params(self, workload: str) -> dict:
+        """
+        Returns runtime parameters of a workload: calibrated ones, overridden by the workload's performance profile.
+        """
+
+        params = dict(self.runtime_params.get(workload) or self.runtime_params.get('interactive', {}))
+        profile = Configuration.profile(workload)
+        params.update({key: profile[key] for key in ('n_threads', 'n_threads_batch', 'n_batch') if profile.get(key)})
+        for key in ('n_threads', 'n_threads_batch'):
+            if params.get(key):
+                params[key] = max(1, params[key] // self.cpu_shares)
+        return params
+
+    def set_workload(self, workload: str) -> None:
+        """
+        Switches thread counts and sampling parameters of the resident model to the ones of a given workload.
+        Parameters fixed at load time (batch size, context size, mlock/mmap, NUMA) stay as set for the interactive workload.
+
+        Args:
+            workload (str): Workload name, 'interactive' or 'batch'
+        """
+
+        if workload == self.workload or not self.loaded:
+            return
+        profile = Configuration.profile(workload)
+        for llm in (self.llm, self.draft_llm):
+            if llm is not None:
+                llm.temperature = profile['temperature'] if profile.get('temperature') is not None else config.model_temp
+                if profile.get('max_tokens'):
+                    llm.max_tokens = profile['max_tokens']
+        self.workload = workload
+        if workload not in self.runtime_params or not self.in_process:
+            return
+        import llama_cpp
+
+        params = self.workload_params(workload)
+        self.logger.debug(f"Switching to {workload} workload threads: {params['n_threads']} / {params['n_threads_batch']}.")
+        llama_cpp.llama_set_n_threads(self.llm.client.ctx, params['n_threads'], params['n_threads_batch'])
+
+    def _on_configuration_change(self, changes: dict) -> None:
+        """
+        Re-applies the current workload's profile after live configuration changes.
+        """
+
+        if 'profiles' in changes or 'model_temp' in changes:
+            workload, self.workload = self.workload, None
+            self.set_workload(workload or 'interactive')
+        if 'lora_weight' in changes and config.lora_mode == 'adapter':
+            self.reweight_adapters(changes['lora_weight'])
+
+    def attach_adapter(self, adapter_path: str, weight: float) -> None:
+        """
+        Applies a LoRA adapter on top of the resident model without reloading it.
+
+        Adapters are loaded with the adapter API of llama-cpp-python (0.2.8x and later), which keeps
+        them separate from the base weights, so that they can be reweighted later. Older versions
+        only merge the adapter into the loaded weights, and reweighting requires a reload.
+
+        Args:
+            adapter_path (str): Path to the LoRA adapter file
+            weight (float): Scale applied to the adapter weights
+        """
+
+        self.logger.debug(f"Applying LoRA adapter {adapter_path} with weight {weight}.")
+        if not self.in_process:
+            self.logger.warning(f"LoRA adapter {adapter_path} can't be attached to the inference server, it has to be restarted with it.")
+            return
+        if not os.path.exists(adapter_path):
+            raise FileNotFoundError(f"LoRA adapter not found at {adapter_path}")
+
+        import llama_cpp
+
+        if hasattr(llama_cpp, 'llama_adapter_lora_init') or hasattr(llama_cpp, 'llama_lora_adapter_init'):
+            adapter_init = getattr(llama_cpp, 'llama_adapter_lora_init', None) or llama_cpp.llama_lora_adapter_init
+            handle = adapter_init(self.llm.client.model, adapter_path.encode())
+            if not handle:
+                raise RuntimeError(f"Failed to load LoRA adapter {adapter_path}")
+            self._adapter_handles[adapter_path] = handle
+            self._set_adapter_weight(adapter_path, weight)
+        else:
+            lora_base = config.lora_base.encode() if config.lora_base else None
+            result = llama_cpp.llama_model_apply_lora_from_file(self.llm.client.model,
+                                                                adapter_path.encode(),
+                                                                float(weight),
+                                                                lora_base,
+                                                                config.available_threads)
+            if result != 0:
+                raise RuntimeError(f"Failed to apply LoRA adapter {adapter_path}")
+            self._invalidate_context()
+        self.adapters.append(adapter_path)
+        self._adapter_weights[adapter_path] = float(weight)
+
+    def _set_adapter_weight(self, adapter_path: str, weight: float) -> None:
+        """
+        Sets the scale of a LoRA adapter loaded with the adapter API.
+        """
+
+        import llama_cpp
+
+        adapter_set = getattr(llama_cpp, 'llama_set_adapter_lora', None) or llama_cpp.llama_lora_adapter_set
+        result = adapter_set(self.llm.client.ctx, self._adapter_handles[adapter_path], float(weight))
+        if result != 0:
+            raise RuntimeError(f"Failed to set weight of LoRA adapter {adapter_path}")
+        self._invalidate_context()
+
+    def _invalidate_context(self) -> None:
+        # Context state evaluated with previous weights is no longer valid
+        self.llm.client.reset()
+        if self._prefix_cache:
+            self._prefix_cache.clear()
+
+    def reweight_adapters(self, weight: float = None) -> None:
+        """
+        Applies the weights of the adapter stack to the attached LoRA adapters.
+
+        Args:
+            weight (float): New weight of all stacked adapters, saved to the adapter stack (None to keep the saved weights)
+        """
+
+        stack = Stem.read_adapter_stack()
+        if weight is not None and stack:
+            for adapter in stack:
+                adapter['weight'] = weight
+            Stem.write_adapter_stack(stack)
+        if not self.in_process or not self.loaded:
+            return
+
+        changed = [adapter for adapter in stack if adapter['adapter'] in self._adapter_weights
+                   and self._adapter_weights[adapter['adapter']] != float(adapter['weight'])]
+        if not changed:
+            return
+        if any(adapter['adapter'] not in self._adapter_handles for adapter in changed):
+            # Adapters merged into the loaded weights by older llama-cpp-python can only be reapplied from scratch
+            self.logger.info(f"Reloading LLM to reweight {len(changed)} merged LoRA adapter(s).")
+            self.unload()
+            self.load()
+            return
+        with self._lock:
+            for adapter in changed:
+                self.logger.debug(f"Reweighting LoRA adapter {adapter['adapter']} to {adapter['weight']}.")
+                self._set_adapter_weight(adapter['adapter'], adapter['weight'])
+                self._adapter_weights[adapter['adapter']] = float(adapter['weight'])
+
+    def tokenize(self, text: str) -> list:
+        """
+        Converts a text into token ids with the model's tokenizer, parsing special tokens (e.g. <s>).
+        """
+
+        if not self.in_process:
+            return self.llm.tokenize(text)
+        return self.llm.client.tokenize(text.encode(), add_bos=False, special=True)
+
+    def detokenize(self, tokens: list) -> str:
+        """
+        Converts token ids into a text with the model's tokenizer, rendering special tokens.
+        """
+
+        if not self.in_process:
+            return self.llm.detokenize(tokens)
+        return self.llm.client.detokenize(tokens, special=True).decode(errors='replace')
+
+    def generation_params(self, task: Optional[str]) -> dict:
+        """
+        Returns generation parameters (max_tokens, stop, temperature) attached to the task's prompt template.
+        """
+
+        if task not in self._generation_params:
+            self._generation_params[task] = Stem.get_generation_params(task) if task else {}
+        return dict(self._generation_params[task])
+
+    def _fit_context(self, prompt: str, resume_from: str, max_tokens: int, task: Optional[str]) -> tuple:
+        """
+        Caps the number of generated tokens by the space the prompt leaves in the context window. A prompt leaving
+        less than config.generation_min_tokens free is trimmed in the middle, keeping the instructions at its start
+        and the latest content at its end.
+
+        Args:
+            prompt (str): The prompt to be processed
+            resume_from (str): Text already generated for this prompt, counted in max_tokens
+            max_tokens (int): Generation limit of the task
+
+        Returns:
+            tuple: The prompt, trimmed if needed, and the maximum number of tokens to be generated
+        """
+
+        prompt_ids = self.tokenize(prompt)
+        resumed_tokens = len(self.tokenize(resume_from)) if resume_from else 0
+        available = self.n_ctx - len(prompt_ids) - resumed_tokens
+        if available < config.generation_min_tokens:
+            kept = max(self.n_ctx - resumed_tokens - config.generation_min_tokens, 0)
+            head = kept // 4
+            self.logger.warning(f"Prompt for {task} of {len(prompt_ids)} tokens leaves {available} of {self.n_ctx} context tokens "
+                                f"for generation, trimming it to {kept} tokens.")
+            prompt = self.detokenize(prompt_ids[:head]) + self.detokenize(prompt_ids[len(prompt_ids) - (kept - head):])
+            available = self.n_ctx - kept - resumed_tokens
+        if available < max_tokens - resumed_tokens:
+            self.logger.debug(f"Generation for {task} capped at {available} tokens by the context window.")
+        return prompt, max(min(max_tokens - resumed_tokens, available), 1)
+
+    def invoke(self,
+               prompt: str,
+               task: Optional[str] = None,
+               grammar: Optional[str] = None,
+               preempt: Optional[asyncio.Event] = None,
+               resume_from: str = '',
+               **kwargs) -> str:
+        """
+        Generates the model response for a given prompt.
+
+        Args:
+            prompt (str): The prompt to be processed
+            task (str): Key of the prompt template the prompt was built from, used for routing, generation parameters and statistics
+            grammar (str): GBNF grammar the output has to conform to
+            preempt (asyncio.Event): Event which, once set, stops the generation at a token boundary raising Preempted
+            resume_from (str): Text generated for this prompt before it was preempted, to be continued
+            kwargs: Generation parameters, overriding the ones attached to the prompt template
+
+        Returns:
+            str: Generated text
+        """
+
+        if not self.loaded:
+            if self.suspended:
+                raise RuntimeError(f"LLM unloaded for {self.suspended}, it can't be used for {task} until it is resumed.")
+            self.logger.warning(f"LLM not loaded, loading it for {task}.")
+            self.load()
+
+        if self.draft_llm and task in config.draft_model_tasks:
+            llm = self.draft_llm
+            model = 'draft'
+        else:
+            llm = self.llm
+            model = 'main'
+            if self._draft_model:
+                self._draft_model.task = task
+            if self._prefix_cache:
+                self._prefix_cache.task = task
+
+        kwargs = {**self.generation_params(task), **kwargs}
+        prompt, kwargs['max_tokens'] = self._fit_context(prompt, resume_from, kwargs.get('max_tokens') or llm.max_tokens, task)
+
+        cache_key = None
+        params = {'temperature': llm.temperature, 'max_tokens': llm.max_tokens, 'grammar': grammar, **kwargs}
+        if self._response_cache and ResponseCache.cacheable(params):
+            model_version = f"{self._model_versions[model]}|{self._adapter_weights if model == 'main' else {}}"
+            cache_key = ResponseCache.make_key(model_version, prompt, params)
+            response = self._response_cache.get(cache_key)
+            if response is not None:
+                self.logger.debug(f"Response for {task} found in the response cache.")
+                return response
+
+        if grammar and not self.in_process:
+            kwargs['grammar'] = grammar
+        elif grammar:
+            import llama_cpp
+            if grammar not in self._grammars:
+                self._grammars[grammar] = llama_cpp.LlamaGrammar.from_string(grammar, verbose=False)
+            kwargs['grammar'] = self._grammars[grammar]
+        if grammar and resume_from:
+            # Grammar state can't be restored mid-output, the generation starts over
+            resume_from = ''
+
+        if preempt is not None and preempt.is_set():
+            raise Preempted(resume_from)
+
+        with self._lock if self.in_process else nullcontext():
+            start = time.perf_counter()
+            if preempt is not None and self.in_process:
+                response = self._generate_preemptible(llm, prompt, preempt, resume_from, **kwargs)
+            else:
+                response = resume_from + llm.invoke(prompt + resume_from, **kwargs)
+            elapsed = time.perf_counter() - start
+
+        task_stats = self.stats.setdefault(task, {'calls': 0, 'models': {},
+                                                  'generated': deque(maxlen=config.generation_stats_window), 'truncated': 0})
+        generated_tokens = llm.get_num_tokens(response[len(resume_from):])
+        # Throughput is kept per model, so that tasks answered directly by the draft model can be compared with the main one
+        model_stats = task_stats['models'].setdefault(model, {'calls': 0, 'seconds': 0.0, 'tokens': 0})
+        task_stats['calls'] += 1
+        model_stats['calls'] += 1
+        model_stats['seconds'] += elapsed
+        model_stats['tokens'] += generated_tokens
+        task_stats['generated'].append(generated_tokens + (llm.get_num_tokens(resume_from) if resume_from else 0))
+        task_stats['max_tokens'] = kwargs['max_tokens']
+        if generated_tokens >= kwargs['max_tokens']:
+            task_stats['truncated'] += 1
+
+        if cache_key:
+            self._response_cache.put(cache_key, response)
+        return response
+
+    def _generate_preemptible(self, llm, prompt: str, preempt: asyncio.Event, resume_from: str, **kwargs) -> str:
+        """
+        Streams the generation token by token, stopping it as soon as the preempt event is set.
+
+        Raises:
+            Preempted: With the text generated so far, including resume_from
+        """
+
+        response = resume_from
+        stream = llm.stream(prompt + resume_from, **kwargs)
+        try:
+            for chunk in stream:
+                response += chunk
+                if preempt.is_set():
+                    self.logger.debug(f"Generation preempted after {len(response)} characters.")
+                    raise Preempted(response)
+        finally:
+            stream.close()
+        return response
+
+    def invoke_many(self, prompts: list, task: Optional[str] = None, **kwargs) -> list:
+        """
+        Generates responses for several prompts. An inference server processes them concurrently,
+        an in-process model one after another.
+
+        Args:
+            prompts (list): Prompts to be processed
+            task (str): Key of the prompt template the prompts were built from
+
+        Returns:
+            list: Generated texts, in the order of prompts
+        """
+
+        if self.in_process or len(prompts) < 2:
+            return [self.invoke(prompt, task=task, **kwargs) for prompt in prompts]
+
+        self.logger.debug(f"Sending {len(prompts)} {task} prompts to the inference server at once.")
+        with ThreadPoolExecutor(max_workers=self.parallelism) as executor:
+            return list(executor.map(lambda prompt: self.invoke(prompt, task=task, **kwargs), prompts))
+
+    async def ainvoke(self, prompt: str, task: Optional[str] = None, **kwargs) -> str:
+        """
+        Generates the model response for a given prompt in a separate thread, without blocking the event loop.
+        """
+
+        return await asyncio.get_running_loop().run_in_executor(None, lambda: self.invoke(prompt, task=task, **kwargs))
+
+    async def ainvoke_many(self, prompts: list, task: Optional[str] = None, **kwargs) -> list:
+        """
+        Generates responses for several prompts in a separate thread, without blocking the event loop.
+        """
+
+        return await asyncio.get_running_loop().run_in_executor(None, lambda: self.invoke_many(prompts, task=task, **kwargs))
+
+    def report(self) -> dict:
+        """
+        Logs and returns generation statistics per task: throughput of each model that served the task (main, draft),
+        generated length distribution with the share of generations cut by the limit, prefix cache hit rate and
+        prompt tokens restored from it and, when speculative decoding is used, acceptance rate of draft tokens and
+        the average number of tokens produced per main model pass. Generated length statistics are exported to config.generation_stats_path.
+
+        Returns:
+            dict: Statistics keyed by task
+        """
+
+        report = {}
+        draft_stats = self._draft_model.stats if self._draft_model else {}
+        cache_stats = self._prefix_cache.stats if self._prefix_cache else {}
+        for task, task_stats in self.stats.items():
+            entry = {'calls': task_stats['calls']}
+            for model, model_stats in task_stats['models'].items():
+                entry[f'{model}_calls'] = model_stats['calls']
+                entry[f'{model}_tokens_per_second'] = model_stats['tokens'] / model_stats['seconds'] if model_stats['seconds'] else 0.0
+            generated = list(task_stats['generated'])
+            if generated:
+                entry['generated_tokens'] = {'p50': Stem.percentile(generated, 0.5),
+                                             'p90': Stem.percentile(generated, 0.9),
+                                             'p99': Stem.percentile(generated, 0.99),
+                                             'max': max(generated),
+                                             'last_max_tokens': task_stats['max_tokens'],
+                                             'truncated_rate': task_stats['truncated'] / task_stats['calls'],
+                                             # Headroom over the observed tail, a lower bound if generations were truncated
+                                             'suggested_max_tokens': int(Stem.percentile(generated, 0.99) * 1.25) + 1}
+            caching = cache_stats.get(task)
+            if caching and caching['lookups']:
+                entry['prefix_cache_hit_rate'] = caching['hits'] / caching['lookups']
+                entry['prefix_cache_saved_tokens'] = caching['saved_tokens']
+            speculation = draft_stats.get(task)
+            if speculation and speculation['rounds']:
+                entry['acceptance_rate'] = speculation['accepted'] / speculation['drafted'] if speculation['drafted'] else 0.0
+                entry['tokens_per_main_pass'] = (speculation['accepted'] + speculation['rounds']) / speculation['rounds']
+            report[task] = entry
+            self.logger.info(f"Generation statistics for {task}: {entry}")
+        if config.generation_stats_path:
+            Stem.memory_write(config.generation_stats_path,
+                              json.dumps({task: entry['generated_tokens'] for task, entry in report.items() if 'generated_tokens' in entry},
+                                         indent=4, default=str))
+        if self._response_cache:
+            self.logger.info(f"Response cache hits: {self._response_cache.hits}, misses: {self._response_cache.misses}")
+        return report
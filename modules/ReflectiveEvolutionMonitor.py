@@ -2,11 +2,19 @@ import config
 from modules import logging_utils
 
 from modules.Stem import Stem
+from modules.PerceptiveFrameworkCore import Preempted
+from modules.SynapticHomeostasis import SynapticHomeostasis, NoveltyMonitor
+from modules.Engram import DreamWriter
+from modules.AnteriorCingulate import AnteriorCingulate
+from modules.Configuration import Configuration
 
 import logging
 import asyncio
-import subprocess
+import signal
+import shutil
 import os
+import json
+import time
 from glob import glob
 from typing import Optional, Union
 
@@ -16,12 +24,15 @@ class ReflectiveEvolutionMonitor:
     The class uses the same LLM for reading summaries, preparing fine-tuning materials, and the fine-tuning process.
     """
 
-    def __init__(self, pfc):
+    def __init__(self, pfc, engaged_event: Optional[asyncio.Event] = None, governor=None, thalamus=None):
         """
         Initializes the ReflectiveEvolutionMonitor class. 
 
         Arguments:
             pfc: Large Language Model used as a base of the system
+            engaged_event: event set during interactions, which interrupt dreaming and pause finetuning tools
+            governor: Hypothalamus deciding if finetuning fits resource budgets
+            thalamus: Thalamus indexing pending conclusions and dreams, directories are scanned if not given
             base_model_path: path to  LLM model file on disk
             conclusions_storage_path: path to folder containing not-permeated new perspectives
             dream_storage_path: path to a folder to store finetune materials to be used in this session
@@ -31,6 +42,9 @@ class ReflectiveEvolutionMonitor:
         self.logger.info(f"Instantiating {self.__class__.__name__}")
     
         self.pfc = pfc
+        self.engaged = engaged_event
+        self.governor = governor
+        self.thalamus = thalamus
         
         self._base_model_path = config.model_path
 
@@ -43,6 +57,9 @@ class ReflectiveEvolutionMonitor:
 
         self._dream_spinning_prompt_template = Stem.get_prompt("dream_spinning")
         self._dream_prompt_template = Stem.get_prompt("dream_template")
+        # Template split around its placeholders once, so dreams are rendered by concatenation
+        self._dream_prefix, _, rest = self._dream_prompt_template.partition("{stimulus}")
+        self._dream_infix, _, self._dream_suffix = rest.partition("{reaction}")
 
         self._conclusions = ''
         
@@ -52,18 +69,102 @@ class ReflectiveEvolutionMonitor:
         self.lora_weight = str(config.lora_weight)
 
         self._lora_to_integrate = config.lora_to_integrate    
+
+        # Informs if the base model file has been replaced and needs to be reloaded
+        self.transplanted = False
+
+        # Informs if dreaming has been interrupted by an interaction and needs to be resumed
+        self.interrupted = False
+
+        # Informs if the resident model has been unloaded for finetuning and needs to be reloaded
+        self.model_unloaded = False
+
+        # Number of dreams, their diversity and generation time (saved) of the last dreaming session
+        self.generation_report = {}
+        self._checkpoint_path = config.rem_checkpoint_path
+        self._checkpoint = {}
     
-    def _gather_conclusion(self) -> bool:
+    def _count_tokens(self, text: str) -> int:
+        """
+        Counts tokens of a text with the model's tokenizer, falling back to counting words.
+        """
+
+        try:
+            return self.pfc.llm.get_num_tokens(text)
+        except Exception:
+            return len(text.split())
+
+    def _secure_resources(self) -> bool:
+        """
+        Asks the governor if finetuning fits the resource budgets, unloading the resident model if needed,
+        and sets the number of finetuning threads.
+
+        Returns:
+            bool: True if finetuning can start, False if it has to be postponed
+        """
+
+        if self.governor is None:
+            return True
+        resident_model = self.pfc.in_process and self.pfc.loaded
+        plan = self.governor.plan_finetuning(self._base_model_path, resident_model)
+        if plan == 'refuse':
+            self.logger.warning(f"Self-finetuning postponed by the resource governor.")
+            return False
+        if plan == 'unload_model':
+            self.logger.murmur(f"Letting go of my thoughts for the deep sleep...")
+            self.pfc.suspend('self-finetuning')
+            self.model_unloaded = True
+            resident_model = False
+        interactive_threads = self.pfc.workload_params('interactive').get('n_threads', 0) if resident_model else 0
+        self._available_threads = str(self.governor.finetune_threads(interactive_threads))
+        return True
+
+    def _evaluate_transplant(self) -> bool:
+        """
+        Evaluates the transplanted model, making room for it first. The resident model holds the replaced weights
+        and is reloaded after the transplant anyway, so it is released unless the governor confirms both models fit.
+
+        Returns:
+            bool: True if the model has been accepted, False if it has been rolled back
+        """
+
+        resident_model = self.pfc.in_process and self.pfc.loaded
+        if self.governor is not None:
+            plan = self.governor.plan_evaluation(self._base_model_path, resident_model)
+        else:
+            plan = 'unload_model' if resident_model else 'start'
+        if plan == 'refuse':
+            self.logger.warning(f"Not enough memory to evaluate {self._base_model_path}, accepting it without evaluation.")
+            return True
+        if plan == 'unload_model':
+            self.pfc.suspend('model evaluation')
+            self.model_unloaded = True
+        return AnteriorCingulate().gate(self._base_model_path)
+
+    def _pending_files(self, name: str) -> Optional[list]:
+        """
+        Snapshots pending files of a Thalamus index, None without a Thalamus. Reading the index applies inotify
+        events handled by the event loop, so it is called on the loop and the snapshot is passed to file
+        operations running in the I/O pool.
+        """
+
+        return self.thalamus.pending_files(name) if self.thalamus else None
+
+    def _gather_conclusion(self, conclusion_files: Optional[list] = None) -> bool:
         """
         Reads a summary document as a text file.
 
+        Args:
+            conclusion_files (list): Pending conclusion files, the conclusions directory is scanned if not given
+
         Returns:
             bool: True if the summary was successfully read, False otherwise.
         """
 
-        conclusions_pattern = os.path.join(self._conclusions_dir, "conclusion*")
-        self.logger.debug(f"Searching for following pattern:\n{conclusions_pattern}.")
-        conclusion_files = glob(conclusions_pattern)
+        if conclusion_files is None:
+            conclusions_pattern = os.path.join(self._conclusions_dir, "conclusion*")
+            self.logger.debug(f"Searching for following pattern:\n{conclusions_pattern}.")
+            conclusion_files = glob(conclusions_pattern)
         self.logger.debug(f"Following files found: {conclusion_files}")
 
         if not conclusion_files:
@@ -76,18 +177,32 @@ class ReflectiveEvolutionMonitor:
         self._conclusions = Stem.memory_read(self._conclusion_file)
         return True
 
-    def _spin_dream(self, dream_prompt: str) -> Union[str, None]:
+    async def _spin_dream(self, dream_prompt: str, resume_from: str = '') -> Union[str, None]:
         """
         Prepares a single piece of data required for the fine-tuning process by interpreting the summary content.
 
         Args:
             dream_prompt (str): Prompt to generate a single piece of training material.
+            resume_from (str): Dream content generated before an interruption, to be continued.
 
         Returns:
             dict: Data structured for fine-tuning.
         """
 
-        dream_content = self.pfc.invoke(dream_prompt)
+        dream_content = await self.pfc.ainvoke(dream_prompt, task='dream_spinning', preempt=self.engaged, resume_from=resume_from)
+        return self._interpret_dream(dream_content)
+
+    def _interpret_dream(self, dream_content: str) -> Union[str, None]:
+        """
+        Converts raw LLM output into a single piece of training material.
+
+        Args:
+            dream_content (str): LLM output generated with the dream spinning prompt.
+
+        Returns:
+            str: Training material formatted with the dream template, or None if the output is malformed.
+        """
+
         self.logger.monologue(f"I had a dream:\n{dream_content}")
 
         try:
@@ -104,9 +219,7 @@ class ReflectiveEvolutionMonitor:
             self.logger.prompt(f"Dreamt response:\n{dreamt_reaction}")
 
             if len(dreamt_stimulus) > 0 and len(dreamt_reaction) > 0 and dreamt_reaction != config.dream_markers['end']:
-                dream = self._dream_prompt_template.replace("{stimulus}", dreamt_stimulus) 
-                dream = dream.replace("{reaction}", dreamt_reaction) 
-                return dream
+                return f"{self._dream_prefix}{dreamt_stimulus}{self._dream_infix}{dreamt_reaction}{self._dream_suffix}"
             else:
                 return None
         
@@ -117,31 +230,121 @@ class ReflectiveEvolutionMonitor:
     async def _weave_dreams(self, num_dreams: int = 1) -> str:
         """
         Generates a specified number of materials (dreams) and writes them into a single text file.
-        Each 'dream' is appended to the file as it is generated.
+        Dreams are written in batches to a temporary file, which becomes the dataset once all of them are generated.
+        In the adaptive mode, generation stops earlier, once new dreams stop bringing new content.
 
         Args:
-            num_dreams (int): Number of training materials to be generated
+            num_dreams (int): Number of training materials to be generated (the maximum in the adaptive mode)
 
         Returns:
             str: Concated training materials set
         """
         
         self.logger.info(f"Generating {num_dreams} dreams.")
-        dreams_path = os.path.join(self._dream_storage_path, f"dream_{Stem.get_timestamp()}.txt")
+        dreams_path = self._checkpoint.get('dreams_path') or os.path.join(self._dream_storage_path, f"dream_{Stem.get_timestamp()}.txt")
         self.logger.debug(f"Dreams for this sessions will be saved to: {dreams_path}")        
         dream_spinning_prompt = self._dream_spinning_prompt_template.replace("{adaptation_summary}", self._conclusions) 
         self.logger.prompt(f"Prompt for generating training material from conversation conclusions:\n{dream_spinning_prompt}.")   
 
-        generated_dreams = 0
-        while generated_dreams < num_dreams:
-            self.logger.info(f"Generating dream # {generated_dreams} of {num_dreams}.")
-            dream = self._spin_dream(dream_spinning_prompt) 
-            if dream:
-                with open(dreams_path, 'a') as file: 
-                    file.write(dream + '\n')
-                generated_dreams += 1
+        if DreamWriter.verify(dreams_path):
+            # Completed before the session was interrupted (e.g. by lack of resources for finetuning)
+            return dreams_path
+        writer = DreamWriter(dreams_path, self._checkpoint.get('generated_dreams', 0), config.dream_write_batch)
+        novelty = NoveltyMonitor(config.dreams_min_num, config.dream_novelty_ngram,
+                                 config.dream_novelty_window, config.dream_novelty_threshold)
+        if writer.dreams:
+            novelty.prime(Stem.memory_read(writer.temp_path) or '')
+        resumed_dreams = writer.dreams
+        generation_seconds = 0.0
+        while writer.dreams < num_dreams:
+            if config.dreams_adaptive and novelty.converged(writer.dreams):
+                self.logger.info(f"Dreams converged after {writer.dreams} of {num_dreams}, "
+                                 f"recent novelty {novelty.recent_novelty:.2f}.")
+                break
+            self.logger.info(f"Generating dream # {writer.dreams} of {num_dreams}.")
+            dreams_in_flight = min(self.pfc.parallelism, num_dreams - writer.dreams)
+            started_at = time.perf_counter()
+            try:
+                if dreams_in_flight > 1:
+                    dream_contents = await self.pfc.ainvoke_many([dream_spinning_prompt] * dreams_in_flight,
+                                                                 task='dream_spinning',
+                                                                 preempt=self.engaged)
+                    dreams = [self._interpret_dream(dream_content) for dream_content in dream_contents]
+                else:
+                    dreams = [await self._spin_dream(dream_spinning_prompt, self._checkpoint.pop('dream_partial', ''))]
+            except Preempted as e:
+                writer.close()
+                self._checkpoint.update(conclusion_file=self._conclusion_file,
+                                        dreams_path=dreams_path,
+                                        generated_dreams=writer.dreams,
+                                        dream_partial=e.partial)
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            generation_seconds += time.perf_counter() - started_at
+            for dream in dreams:
+                if dream:
+                    novelty.observe(dream)
+                    writer.write(dream)
+
+        session_dreams = writer.dreams - resumed_dreams
+        seconds_per_dream = generation_seconds / session_dreams if session_dreams else 0.0
+        self.generation_report = {'adaptive': config.dreams_adaptive,
+                                  'dreams': writer.dreams,
+                                  'max_dreams': num_dreams,
+                                  'diversity': round(novelty.diversity(), 4),
+                                  'recent_novelty': round(novelty.recent_novelty, 4),
+                                  'generation_seconds': round(generation_seconds, 1),
+                                  # Estimated from the mean generation time of this session's dreams
+                                  'saved_seconds': round(max(num_dreams - writer.dreams, 0) * seconds_per_dream, 1)}
+        manifest = writer.commit(self.generation_report)
+        self.logger.info(f"{manifest['dreams']} dreams saved to {dreams_path}, generation: {self.generation_report}")
         return dreams_path
     
+    async def _run_pausable(self, command: list) -> int:
+        """
+        Runs an external tool without blocking the event loop. The tool is paused (SIGSTOP) for the duration 
+        of interactions and continued (SIGCONT) afterwards, so it doesn't compete with them for resources.
+        If the model has been unloaded to make room for the tool, the interaction needs that room back,
+        so the tool is stopped instead.
+
+        Args:
+            command (list): The command to be run
+
+        Returns:
+            int: Return code of the tool
+
+        Raises:
+            Preempted: If the tool has been stopped for an interaction
+        """
+
+        process = await asyncio.create_subprocess_exec(*command)
+        paused = False
+        while process.returncode is None:
+            try:
+                await asyncio.wait_for(process.wait(), timeout=1)
+            except asyncio.TimeoutError:
+                pass
+            if process.returncode is not None or self.engaged is None:
+                continue
+            if self.engaged.is_set() and self.model_unloaded:
+                self.logger.murmur(f"Waking up from the deep sleep for an interaction.")
+                if paused:
+                    process.send_signal(signal.SIGCONT)
+                process.terminate()
+                await process.wait()
+                raise Preempted('')
+            if self.engaged.is_set() and not paused:
+                self.logger.debug(f"Pausing {command[0]} for the duration of an interaction.")
+                process.send_signal(signal.SIGSTOP)
+                paused = True
+            elif not self.engaged.is_set() and paused:
+                self.logger.debug(f"Continuing {command[0]}.")
+                process.send_signal(signal.SIGCONT)
+                paused = False
+        return process.returncode
+
     async def _deepsleep(self, dreams_path: str) -> None:
         """
         Executes the fine-tuning process using the prepared data.
@@ -167,6 +370,8 @@ class ReflectiveEvolutionMonitor:
 
         
         # Fine-tuning command
+        # In 'adapter' mode the base model file holds only compacted weights, so the new adapter is trained
+        # against the bare base model rather than against the adapters stacked on the resident model
         finetune_command = [
             finetune_tool_path,
             "--model-base", self._base_model_path,
@@ -175,48 +380,118 @@ class ReflectiveEvolutionMonitor:
             "--sample-start", "<s>",
             "--epochs", self._epochs
         ]
+        profile = Configuration.profile('finetune')
+        if profile.get('n_ctx'):
+            finetune_command += ["--ctx", str(profile['n_ctx'])]
+        if profile.get('n_batch'):
+            finetune_command += ["--batch", str(profile['n_batch'])]
 
         self.logger.murmur(f"Self-finetuning: Creating LoRA")
         self.logger.debug(f"Running command:\n{finetune_command}")
 
-        try:
-            subprocess.run(finetune_command, check=True)
-        except subprocess.CalledProcessError as e:
-            self.logger.error(f"Self-finetuning session failed the return code {e.returncode}")   
+        returncode = await self._run_pausable(finetune_command)
+        if returncode != 0:
+            self.logger.error(f"Self-finetuning session failed the return code {returncode}")   
             return False
         
+        if config.lora_mode == 'adapter':
+            stack = self._stack_adapter()
+            if len(stack) < config.lora_compaction_threshold:
+                self.logger.murmur(f"Self-finetuning: Attaching new LoRA adapter.")
+                # Attaching restarts background workers, which waits for their current jobs
+                await asyncio.get_running_loop().run_in_executor(None, self.pfc.attach_adapter, stack[-1]['adapter'], stack[-1]['weight'])
+                Stem.finetune_cleanup()
+                return True
+            self.logger.info(f"{len(stack)} LoRA adapters stacked. Compacting them into the base model.")
+            lora_args = []
+            for adapter in stack:
+                lora_args += ["--lora-scaled", adapter['adapter'], str(adapter['weight'])]
+        else:
+            stack = []
+            lora_args = ["--lora-scaled", self._lora_to_integrate, self.lora_weight]
+
         # Export LoRA model command - output to llm_tmp.gguf
         tmp_model_path = r"llm_tmp.gguf"
         export_command = [
             lora_tool_path,
             "--model-base", self._base_model_path,
-            "--model-out", tmp_model_path,
-            "--lora-scaled", self._lora_to_integrate, self.lora_weight
-        ]
+            "--model-out", tmp_model_path
+        ] + lora_args
 
         self.logger.murmur(f"Self-finetuning: Merging base model with LoRA")
         self.logger.debug(f"Running command:\n{export_command}")
 
-        try:
-            subprocess.run(export_command, check=True)
-        except subprocess.CalledProcessError as e:
-            self.logger.error(f"LoRA merge failed with the return code {e.returncode}")   
+        returncode = await self._run_pausable(export_command)
+        if returncode != 0:
+            self.logger.error(f"LoRA merge failed with the return code {returncode}")   
             return False        
 
         self.logger.murmur(f"Self-finetuning: Transplanting brain to a new one.")
         self.logger.info(f"Removing old {self._base_model_path}, moving {tmp_model_path} as new {self._base_model_path}.")
         Stem.transplantation(self._base_model_path, tmp_model_path)
+        # Loading the evaluated model may unload the resident one, which stops background workers and waits for their current jobs
+        if config.eval_gate and not await asyncio.get_running_loop().run_in_executor(None, self._evaluate_transplant):
+            self.logger.murmur(f"Self-finetuning: The new brain didn't take, waking up with the old one.")
+            Stem.finetune_cleanup()
+            return False
+        self.transplanted = True
+        if stack:
+            self._clear_adapter_stack(stack)
         Stem.finetune_cleanup()
+        return True
+
+    def _stack_adapter(self) -> list:
+        """
+        Moves freshly trained LoRA adapter to the adapter directory and puts it on top of the adapter stack.
+
+        Returns:
+            list: Updated adapter stack, oldest first
+        """
+
+        Stem.prepare_directory(config.lora_dir)
+        timestamp = Stem.get_timestamp()
+        adapter_path = os.path.join(config.lora_dir, f"lora_{timestamp}.gguf")
+        self.logger.debug(f"Stacking {self._lora_to_integrate} as {adapter_path}.")
+        shutil.move(self._lora_to_integrate, adapter_path)
+
+        stack = Stem.read_adapter_stack()
+        stack.append({'adapter': adapter_path, 'weight': config.lora_weight, 'created': timestamp})
+        Stem.write_adapter_stack(stack)
+        return stack
+
+    def _clear_adapter_stack(self, stack: list) -> None:
+        """
+        Removes adapters compacted into the base model.
+
+        Args:
+            stack (list): Adapter entries merged into the base model
+        """
+
+        for adapter in stack:
+            try:
+                os.remove(adapter['adapter'])
+            except OSError as e:
+                self.logger.warning(f"Failed to remove compacted LoRA adapter {adapter['adapter']}: {e}")
+        Stem.write_adapter_stack([])
             
-    def _dream_prunning(self) -> None:
+    def _dream_prunning(self, dream_files: Optional[list] = None) -> None:
         """
         Archives dream materials by moving them from the dream storage path to the archive path.
+
+        Args:
+            dream_files (list): Pending dream files, the dream storage directory is scanned if not given
         """
         
         self.logger.info("Archiving dream materials.")
-        for file_name in os.listdir(self._dream_storage_path):
-            if file_name[:6] == 'dream_':
-                Stem.archive(self._dream_storage_path, file_name)
+        if dream_files is not None:
+            dream_files = [os.path.basename(path) for path in dream_files]
+        else:
+            dream_files = [file_name for file_name in os.listdir(self._dream_storage_path) if file_name[:6] == 'dream_']
+        for file_name in dream_files:
+            Stem.archive(self._dream_storage_path, file_name)
+        # Datasets left incomplete by sessions which were never resumed (e.g. after a crash)
+        for partial_path in glob(os.path.join(self._dream_storage_path, ".dream_*.partial")):
+            os.remove(partial_path)
         Stem.archive(self._conclusion_file)
     
     async def dream(self) -> Optional[bool]:
@@ -227,12 +502,58 @@ class ReflectiveEvolutionMonitor:
         self.logger.murmur(f"Closing eyes for a well-deserved nap.")
         self.logger.info(f"Self-finetuning process started.")        
 
-        conclusions_found = self._gather_conclusion()        
-        if not conclusions_found:
-            return False
+        if os.path.exists(self._checkpoint_path):
+            self._checkpoint = await Stem.amemory_read(self._checkpoint_path, 'json') or {}
+        if self._checkpoint.get('conclusion_file') and os.path.exists(self._checkpoint['conclusion_file']):
+            self.logger.info(f"Resuming interrupted dream about {self._checkpoint['conclusion_file']}.")
+            self._conclusion_file = self._checkpoint['conclusion_file']
+            self._conclusions = await Stem.amemory_read(self._conclusion_file)
+        else:
+            self._checkpoint = {}
+            conclusions_found = await Stem.run_io(self._gather_conclusion, self._pending_files('conclusions'))
+            if not conclusions_found:
+                return False
         self.logger.info(f"Selected conclusion to permeate.")
-        dreams_path = await self._weave_dreams(self._dreams_to_generate_num)  # Generate 50 materials, modify as needed
-        self.logger.info(f"Self-finetuning materials generated. Staring self-finetuning.")        
-        await self._deepsleep(dreams_path)
-        self._dream_prunning()
+        try:
+            dreams_path = await self._weave_dreams(self._dreams_to_generate_num)  # Generate 50 materials, modify as needed
+        except Preempted:
+            self.logger.info(f"Dreaming interrupted by an interaction.")
+            await Stem.amemory_write(self._checkpoint_path, json.dumps(self._checkpoint))
+            self.interrupted = True
+            return False
+        if os.path.exists(self._checkpoint_path):
+            os.remove(self._checkpoint_path)
+        if not await Stem.run_io(DreamWriter.verify, dreams_path):
+            self.logger.error(f"Dreams dataset {dreams_path} is incomplete or corrupted, skipping self-finetuning.")
+            return False
+        self.logger.info(f"Self-finetuning materials generated. Curating them.")
+        homeostasis = SynapticHomeostasis(count_tokens=self._count_tokens)
+        training_path, curation_stats = await Stem.run_io(homeostasis.curate, dreams_path)
+        if not curation_stats['kept_samples']:
+            self.logger.warning(f"No dreams left after curation, skipping self-finetuning.")
+            await Stem.run_io(self._dream_prunning, self._pending_files('dreams'))
+            return False
+        # Unloading stops background workers, which waits for their current jobs
+        if not await asyncio.get_running_loop().run_in_executor(None, self._secure_resources):
+            self._checkpoint = {'conclusion_file': self._conclusion_file,
+                                'dreams_path': dreams_path,
+                                'generated_dreams': self._dreams_to_generate_num}
+            await Stem.amemory_write(self._checkpoint_path, json.dumps(self._checkpoint))
+            self.interrupted = self.engaged is not None and self.engaged.is_set()
+            return False
+        self.logger.info(f"Staring self-finetuning.")        
+        try:
+            await self._deepsleep(training_path)
+        except Preempted:
+            self.logger.info(f"Self-finetuning stopped by an interaction, it will be repeated afterwards.")
+            self._checkpoint = {'conclusion_file': self._conclusion_file,
+                                'dreams_path': dreams_path,
+                                'generated_dreams': self._dreams_to_generate_num}
+            await Stem.amemory_write(self._checkpoint_path, json.dumps(self._checkpoint))
+            self.interrupted = True
+            return False
+        finally:
+            if self.model_unloaded:
+                self.pfc.resume()
+        await Stem.run_io(self._dream_prunning, self._pending_files('dreams'))
         self.logger.info(f"Self-finetuning session ended.")        
\ No newline at end of file
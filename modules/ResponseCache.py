@@ -0,0 +1,152 @@
+import config
+from modules import logging_utils
+
+from modules.Stem import Stem
+
+import logging
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+import time
+from typing import Optional
+
+class ResponseCache:
+    """
+    A class storing LLM responses on disk, so that deterministic calls repeated with the same inputs
+    (e.g. after a crash-and-retry) are not generated again.
+
+    Responses are keyed by the model version, the prompt and the sampling parameters. The total size of
+    stored responses is bounded, and the least recently used ones are evicted first.
+    """
+
+    def __init__(self, cache_path: str = config.response_cache_path, capacity_bytes: int = config.response_cache_bytes):
+        """
+        Args:
+            cache_path (str): Location of the SQLite database file storing responses
+            capacity_bytes (int): Maximum total size of stored prompts and responses
+        """
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.info(f"Instantiating {self.__class__.__name__}")
+
+        self._capacity_bytes = capacity_bytes
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir:
+            Stem.prepare_directory(cache_dir)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(cache_path, check_same_thread=False)
+        self._connection.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                        key TEXT PRIMARY KEY,
+                                        response TEXT NOT NULL,
+                                        size INTEGER NOT NULL,
+                                        last_access REAL NOT NULL)""")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._connection.commit()
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def invalidate(cache_path: str = config.response_cache_path) -> None:
+        """
+        Removes all cached responses, e.g. after the model they were generated with has been replaced.
+        Rows are deleted through SQLite rather than by removing the file, which connections of running
+        caches would keep using.
+
+        Args:
+            cache_path (str): Location of the SQLite database file storing responses
+        """
+
+        if not os.path.exists(cache_path):
+            return
+        connection = sqlite3.connect(cache_path, timeout=30)
+        try:
+            connection.execute("DELETE FROM responses")
+            connection.commit()
+        except sqlite3.OperationalError as e:
+            # The cache was never written, e.g. the table doesn't exist yet
+            logging.getLogger(ResponseCache.__name__).debug(f"Response cache {cache_path} not invalidated: {e}")
+        finally:
+            connection.close()
+        logging.getLogger(ResponseCache.__name__).info(f"Response cache {cache_path} invalidated.")
+
+    @staticmethod
+    def cacheable(params: dict) -> bool:
+        """
+        Checks if a call with given sampling parameters is deterministic enough to be cached.
+
+        Args:
+            params (dict): Sampling parameters of the call
+
+        Returns:
+            bool: True if the response can be cached
+        """
+
+        return params.get('temperature', config.model_temp) <= 0 or config.response_cache_sampled
+
+    @staticmethod
+    def make_key(model_version: str, prompt: str, params: dict) -> str:
+        """
+        Builds a cache key from the model version, prompt and sampling parameters.
+        """
+
+        payload = json.dumps({'model': model_version, 'prompt': prompt, 'params': params}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Returns the cached response for a given key, or None if it is not cached.
+        A database locked by another process (e.g. a background worker) counts as a miss.
+        """
+
+        with self._lock:
+            try:
+                row = self._connection.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+                    self._connection.commit()
+            except sqlite3.OperationalError as e:
+                self._connection.rollback()
+                self.logger.warning(f"Response cache lookup failed, treating it as a miss: {e}")
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, response: str) -> None:
+        """
+        Stores a response and evicts the least recently used ones if the cache exceeds its capacity.
+        The response is not stored if the database is locked by another process.
+        """
+
+        size = len(response.encode())
+        with self._lock:
+            try:
+                self._connection.execute("INSERT OR REPLACE INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?)",
+                                         (key, response, size, time.time()))
+                total_size = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+                while total_size > self._capacity_bytes:
+                    oldest = self._connection.execute("SELECT key, size FROM responses ORDER BY last_access LIMIT 1").fetchone()
+                    if oldest is None:
+                        break
+                    self._connection.execute("DELETE FROM responses WHERE key = ?", (oldest[0],))
+                    total_size -= oldest[1]
+                self._connection.commit()
+            except sqlite3.OperationalError as e:
+                self._connection.rollback()
+                self.logger.warning(f"Response not cached: {e}")
+
+    def clear(self) -> None:
+        """
+        Removes all cached responses.
+        """
+
+        with self._lock:
+            self._connection.execute("DELETE FROM responses")
+            self._connection.commit()
+        self.logger.debug(f"Response cache cleared.")
@@ -3,6 +3,7 @@ from modules import logging_utils
 
 from modules.Stem import Stem
 from modules.ShortTermMemory import ShortTermMemory
+from modules.Hippocampus import Hippocampus
 
 import logging
 import asyncio
@@ -42,14 +43,14 @@ class SensoryProcessing(ABC):
         pass
 
     @abstractmethod
-    def _summarize_interaction(self):
+    async def _summarize_interaction(self):
         """
         Abstract method to summarize the interaction.
         """
         pass
     
     @abstractmethod
-    def _save_interaction_history(self):
+    async def _save_interaction_history(self):
         """
         Abstract method to save the interaction history.
         """
@@ -67,7 +68,8 @@ class LanguageProcessingModule(SensoryProcessing):
     def __init__(self,
                  pfc,
                  engaged_event: asyncio.Event = asyncio.Event(),
-                 interaction_storage_path: str ='conversations'):
+                 interaction_storage_path: str ='conversations',
+                 background_pfc = None):
         """
         Initializes the LanguageProcessingModule class.
 
@@ -78,21 +80,25 @@ class LanguageProcessingModule(SensoryProcessing):
             pfc: The large learning model used for generating conversation responses.
             ready_for_input_event: An event flag indicating readiness for user input.
             interaction_storage_path: Path to a folder where all the conversations are being logged to 
+            background_pfc: The model used for background tasks like conversation summarization, pfc if not given
         """
 
         super().__init__(pfc, engaged_event, interaction_storage_path)
 
         self.logger.info(f"Instantiating {self.__class__.__name__} with interaction_storage_path: {interaction_storage_path}")
 
+        self.background_pfc = background_pfc if background_pfc is not None else pfc
+
         self.ready_for_input = asyncio.Event()
         self.ready_for_input.set()  # Initially set to ready
 
         self.stm = ShortTermMemory()
+        self.hippocampus = Hippocampus()
 
         self._conversation_prompt = Stem.get_prompt("human_interaction")
         self._interaction_history = ''
 
-        self._keywords_generation_prompt_template = Stem.get_prompt("keyword_generation")
+        self._keywords_generation_prompt_template = Stem.get_keywords_prompt("keyword_generation")
     
     async def start_interaction(self) -> None:
         """
@@ -110,6 +116,7 @@ class LanguageProcessingModule(SensoryProcessing):
         
         while True:
             if not self.ready_for_input.is_set():
+                logging_utils.mark_mode('interaction')
                 self.logger.flag(f"ready_for_input: {self.ready_for_input.is_set()}")
                 self.logger.debug(f"Received input:\n{self.stimulus}")        
 
@@ -122,7 +129,12 @@ class LanguageProcessingModule(SensoryProcessing):
                 
                 self.logger.monologue(f"LLM will receive following prompt:\n{self._conversation_prompt}")
                 self.logger.debug(f"Awaiting response...")
-                response = self.pfc.invoke(self._conversation_prompt)
+                if self.pfc.suspended:
+                    # The model has been unloaded for finetuning, which stops once the interaction is noticed
+                    print("AI: Give me a moment, I'm waking up from a deep sleep...")
+                    while self.pfc.suspended or not self.pfc.loaded:
+                        await asyncio.sleep(1)
+                response = self.pfc.invoke(self._conversation_prompt, task='human_interaction')
                 self.logger.murmur(f"Response generated:\n{response}") 
                 print("AI:", response)
 
@@ -131,6 +143,7 @@ class LanguageProcessingModule(SensoryProcessing):
                 
                 self.ready_for_input.set()  # Signal that the handler is ready for new input
                 self.logger.flag(f"ready_for_input: {self.ready_for_input.is_set()}")
+                logging_utils.mark_mode('idle')
                 self._inactivity_count = 0
             else:
                 await asyncio.sleep(1)
@@ -147,7 +160,7 @@ class LanguageProcessingModule(SensoryProcessing):
         This method saves the conversation history, clears event flags, and performs necessary cleanup actions.
         """
         self.logger.debug(f"Conversation cleanup started.")        
-        self._save_interaction_history()
+        await self._save_interaction_history()
         self._conversation_prompt = Stem.get_prompt("human_interaction")
         self._interaction_history = ''
         self.ready_for_input.set()
@@ -155,7 +168,7 @@ class LanguageProcessingModule(SensoryProcessing):
         self._inactivity_count = 0
         self.engaged.clear()
     
-    def _summarize_interaction(self) -> list:
+    async def _summarize_interaction(self) -> list:
         """
         Summarizes the conversation and returns the list of relevant keywords.
 
@@ -169,13 +182,14 @@ class LanguageProcessingModule(SensoryProcessing):
         self.logger.debug(f"Interaction history:\n{self._interaction_history}")    
         keywords_generation_prompt = self._keywords_generation_prompt_template.replace("{chat_history}", self._interaction_history)
         self.logger.prompt(f"Prompt for generating keywords from conversation:\n{keywords_generation_prompt}")          
-        keywords_generated_raw_output = self.pfc.invoke(keywords_generation_prompt)
+        grammar = Stem.keywords_grammar() if config.structured_keywords else None
+        keywords_generated_raw_output = await self.background_pfc.ainvoke(keywords_generation_prompt, task='keyword_generation', grammar=grammar)
         self.logger.monologue(f"Full text for summarizing conversation with keywords:\n{keywords_generated_raw_output}")  
         keywords_generated_pure = Stem.extract_keywords(keywords_generated_raw_output)
         
         return keywords_generated_pure
 
-    def _save_interaction_history(self) -> None:
+    async def _save_interaction_history(self) -> None:
         """
         Saves the interaction history to a file.
 
@@ -184,12 +198,13 @@ class LanguageProcessingModule(SensoryProcessing):
         
         memory_path = os.path.join(self._interaction_storage_path, f"conversation_{Stem.get_timestamp()}.txt")
         self.logger.debug(f"This conversation will be saved to: {memory_path}")                
-        Stem.memory_write(memory_path, self._interaction_history)
+        await Stem.amemory_write(memory_path, self._interaction_history)
+        await Stem.run_io(self.hippocampus.remember, memory_path, self._interaction_history)
         self.logger.debug(f"Starting conversation saving.")        
-        interaction_keywords = self._summarize_interaction()
+        interaction_keywords = await self._summarize_interaction()
         
         # Update the ShortTermMemory with the conversation and its keywords
-        self.stm.memorize_keywords(interaction_keywords, memory_path)
+        await Stem.run_io(self.stm.memorize_keywords, interaction_keywords, memory_path)
     
     async def get_user_input(self) -> None:
         """
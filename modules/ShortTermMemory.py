@@ -7,6 +7,8 @@ import logging
 import os
 import json
 import re
+import math
+import time
 from datetime import datetime
 from typing import Union
 
@@ -17,6 +19,11 @@ class ShortTermMemory:
 
     This class handles the storage, retrieval, and management of conversations
     linked to specific keywords. The conversations are stored as file paths in a JSON file.
+
+    The memory is bounded: keywords not mentioned for config.stm_ttl_days are forgotten, and above
+    config.stm_capacity the ones with the lowest score (number of mentions decayed with time since 
+    the last one) are evicted. Keyword statistics are kept in a sidecar JSON file, ordered from the least
+    recently mentioned, so that expired keywords are found without scanning the whole memory.
     """
 
     def __init__(self):
@@ -32,6 +39,69 @@ class ShortTermMemory:
         if not os.path.exists(self._stm_path):
             with open(self._stm_path, 'w') as file:
                 json.dump({}, file)
+        self._meta_path = config.stm_meta_path
+
+    def _read_meta(self, data: dict) -> dict:
+        """
+        Reads keyword statistics, initializing them for keywords memorized before statistics were kept.
+        """
+
+        meta = Stem.memory_read(self._meta_path, 'json') if os.path.exists(self._meta_path) else {}
+        meta = meta or {}
+        now = time.time()
+        for keyword, filenames in data.items():
+            if keyword not in meta:
+                meta[keyword] = {'first_seen': now, 'last_seen': now, 'mentions': len(filenames)}
+        return meta
+
+    def _write_meta(self, meta: dict) -> None:
+        Stem.memory_write(self._meta_path, json.dumps(meta))
+
+    @staticmethod
+    def score(stats: dict, now: float) -> float:
+        """
+        Scores a keyword by its number of mentions, decayed exponentially with time since the last one.
+
+        Args:
+            stats (dict): Keyword statistics
+            now (float): Current time (epoch seconds)
+
+        Returns:
+            float: Keyword score
+        """
+
+        age_days = (now - stats['last_seen']) / 86400
+        return stats['mentions'] * math.pow(0.5, age_days / config.stm_half_life_days)
+
+    def _evict(self, data: dict, meta: dict) -> list:
+        """
+        Forgets a bounded number of expired keywords, then the lowest scoring ones above capacity.
+
+        Returns:
+            list: Evicted keywords
+        """
+
+        now = time.time()
+        evicted = []
+        for keyword in list(meta)[:config.stm_eviction_batch]:
+            if now - meta[keyword]['last_seen'] < config.stm_ttl_days * 86400:
+                # Statistics are ordered from the least recently mentioned keyword
+                break
+            evicted.append(keyword)
+            del meta[keyword]
+            data.pop(keyword, None)
+
+        overflow = len(data) - config.stm_capacity
+        if overflow > 0:
+            lowest = sorted(data, key=lambda keyword: self.score(meta[keyword], now))[:overflow]
+            for keyword in lowest:
+                evicted.append(keyword)
+                del meta[keyword]
+                del data[keyword]
+
+        if evicted:
+            self.logger.debug(f"Evicted {len(evicted)} keywords from short term memory: {evicted}")
+        return evicted
 
     def memorize_keywords(self, keywords: list, filename: str) -> None:
         """
@@ -46,17 +116,26 @@ class ShortTermMemory:
 
         self.logger.debug(f"Saving keywords: {keywords}, related to conversation from: {filename}.")
         try:
-            with open(self._stm_path, 'r+') as file:
-                data = json.load(file)
+            # Locked for the whole read-modify-write, so that concurrent sessions don't lose each other's keywords
+            with Stem.file_lock(self._stm_path):
+                with open(self._stm_path, 'r') as file:
+                    data = json.load(file)
+                meta = self._read_meta(data)
+                now = time.time()
                 for keyword in keywords:
                     if keyword in data:
                         if filename not in data[keyword]:
                             data[keyword].append(filename)
                     else:
                         data[keyword] = [filename]
-                file.seek(0)
-                json.dump(data, file, indent=4)
-                file.truncate()
+                    # Re-inserted to keep statistics ordered by the last mention
+                    stats = meta.pop(keyword, {'first_seen': now, 'last_seen': now, 'mentions': 0})
+                    stats['last_seen'] = now
+                    stats['mentions'] += 1
+                    meta[keyword] = stats
+                self._evict(data, meta)
+                self._write_meta(meta)
+                Stem.memory_write(self._stm_path, json.dumps(data, indent=4))
         except FileNotFoundError:
             self.logger.error(f"Short Term Memory file {self._stm_path} not found.")
         except Exception as e:
@@ -127,14 +206,16 @@ class ShortTermMemory:
         self.logger.debug(f"Clearing {keywords_to_clear} from {self._stm_path}.")
 
         try:
-            with open(self._stm_path, 'r+') as file:
-                data = json.load(file)
+            with Stem.file_lock(self._stm_path):
+                with open(self._stm_path, 'r') as file:
+                    data = json.load(file)
+                meta = self._read_meta(data)
                 for keyword in keywords_to_clear:
                     if keyword in data:
                         del data[keyword]
-                file.seek(0)
-                json.dump(data, file, indent=4)
-                file.truncate()
+                    meta.pop(keyword, None)
+                self._write_meta(meta)
+                Stem.memory_write(self._stm_path, json.dumps(data, indent=4))
             self.logger.debug(f"Selected keywords removed from {self._stm_path}.")
             
         except FileNotFoundError:
@@ -142,6 +223,78 @@ class ShortTermMemory:
         except Exception as e:
             self.logger.error(f"Unexpected error reading Short Term Memory file {self._stm_path}: {e}")
 
+    def cluster_keywords(self, max_keywords: int = None) -> list:
+        """
+        Groups all stored keywords into clusters of keywords co-occurring in the same conversations.
+
+        Keywords sharing at least one conversation file belong to the same cluster. Clusters exceeding 
+        the size limit are split, keeping keywords with the most conversations in common together.
+
+        Args:
+            max_keywords (int): Maximum number of keywords in a cluster, config.dmn_cluster_max_keywords if not given.
+
+        Returns:
+            list: Lists of keywords, largest clusters (by number of related conversations) first.
+        """
+
+        max_keywords = max_keywords if max_keywords is not None else config.dmn_cluster_max_keywords
+        data = Stem.memory_read(self._stm_path, 'json') or {}
+
+        # Union-find over keywords, joined through shared conversation files
+        parent = {keyword: keyword for keyword in data}
+        def find(keyword):
+            while parent[keyword] != keyword:
+                parent[keyword] = parent[parent[keyword]]
+                keyword = parent[keyword]
+            return keyword
+
+        file_owner = {}
+        for keyword, filenames in data.items():
+            for filename in filenames:
+                if filename in file_owner:
+                    parent[find(keyword)] = find(file_owner[filename])
+                else:
+                    file_owner[filename] = keyword
+
+        components = {}
+        for keyword in data:
+            components.setdefault(find(keyword), []).append(keyword)
+
+        clusters = []
+        for keywords in components.values():
+            while keywords:
+                # Seed with the keyword with most conversations, add the ones sharing most of them
+                seed = max(keywords, key=lambda keyword: len(data[keyword]))
+                seed_files = set(data[seed])
+                ranked = sorted((keyword for keyword in keywords if keyword != seed),
+                                key=lambda keyword: len(seed_files & set(data[keyword])), reverse=True)
+                cluster = [seed] + ranked[:max_keywords - 1]
+                clusters.append(cluster)
+                keywords = [keyword for keyword in keywords if keyword not in cluster]
+
+        clusters.sort(key=lambda cluster: len({filename for keyword in cluster for filename in data[keyword]}), reverse=True)
+        self.logger.debug(f"{len(data)} keywords grouped into {len(clusters)} clusters.")
+        return clusters
+
+    def recall_top_keywords(self, k: int = None) -> Union[list, None]:
+        """
+        Retrieves the k highest scoring keywords stored in memory.
+
+        Args:
+            k (int): Number of keywords to retrieve, config.stm_prompt_keywords if not given.
+
+        Returns:
+            list: Keywords, highest scoring first.
+        """
+
+        data = Stem.memory_read(self._stm_path, 'json')
+        if not data:
+            return None
+        k = k if k is not None else config.stm_prompt_keywords
+        meta = self._read_meta(data)
+        now = time.time()
+        return sorted(data, key=lambda keyword: self.score(meta[keyword], now), reverse=True)[:k]
+
     def recall_all_keywords(self) -> Union[bool, None]:
         """
         Retrieves a list of all keywords stored in memory.
@@ -8,7 +8,24 @@ from glob import glob
 import re
 from datetime import datetime
 import json
-from typing import Optional
+import hashlib
+import time
+import asyncio
+import fcntl
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+# Bounded thread pool running file operations of coroutines, created on first use
+_io_pool = None
+
+# Latency of file operations by operation name
+_io_stats = {}
+
+# File locks held by the current thread, by lock stripe, with their reentrancy count
+_held_locks = threading.local()
 
 class Stem:
     """
@@ -22,6 +39,9 @@ class Stem:
         """
         Extracts keywords from the summary output.
 
+        Output constrained with the keywords grammar is parsed as a JSON list, 
+        free text output is searched for words flanked with double asterisks.
+
         Args:
             raw_output (str): The output from which to extract keywords.
 
@@ -29,12 +49,41 @@ class Stem:
             list: A list of extracted keywords.
         """
 
+        try:
+            structured_output = json.loads(raw_output)
+        except ValueError:
+            structured_output = None
+        if isinstance(structured_output, list):
+            keywords = [str(keyword).strip(' *').lower() for keyword in structured_output]
+            return [keyword for keyword in keywords if keyword]
+
         # Regex pattern to find all occurrences of words flanked by **
         pattern = r"\*\*(.*?)\*\*"
         # Find all matches and strip the ** from each keyword
         keywords = [keyword.lower() for keyword in re.findall(pattern, raw_output)]
         return keywords
 
+    @staticmethod
+    def keywords_grammar(max_keywords: int = config.keywords_max_num) -> str:
+        """
+        Builds a GBNF grammar restricting LLM output to a JSON list of at most max_keywords short keywords.
+
+        Args:
+            max_keywords (int): Maximum number of keywords in the list
+
+        Returns:
+            str: Grammar definition in llama.cpp GBNF format
+        """
+
+        rules = ['root ::= "[" ( keyword more1 )? "]"' if max_keywords > 1 else 'root ::= "[" keyword? "]"']
+        for i in range(1, max_keywords - 1):
+            rules.append(f'more{i} ::= ( ", " keyword more{i + 1} )?')
+        if max_keywords > 1:
+            rules.append(f'more{max_keywords - 1} ::= ( ", " keyword )?')
+        rules.append('keyword ::= "\\"" word ( " " word )? ( " " word )? "\\""')
+        rules.append("word ::= [a-zA-Z0-9'-]+")
+        return '\n'.join(rules)
+
     @staticmethod
     def get_timestamp() -> datetime:
         """
@@ -48,6 +97,23 @@ class Stem:
         """
         return datetime.now().strftime("%Y%m%d%H%M%S")
 
+    @staticmethod
+    @contextmanager
+    def timed_phase(phases: dict, phase: str):
+        """
+        Context manager measuring the duration of a code block.
+
+        Args:
+            phases (dict): Dictionary to store the duration (in seconds) in
+            phase (str): Name of the measured phase
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            phases[phase] = phases.get(phase, 0.0) + time.perf_counter() - start
+
     @staticmethod
     def archive(source_dir: str, source_file: Optional[str] = None, archive_suffix='archive') -> bool:
         """
@@ -77,7 +143,8 @@ class Stem:
         
         logger = logging.getLogger('Stem')        
         try:
-            shutil.move(source_path, destination_path)
+            with Stem._timed_io('archive'), Stem.file_lock(source_path):
+                shutil.move(source_path, destination_path)
             return True
         except FileNotFoundError:
             logger.error(f"File not found: {source_path}")
@@ -133,7 +200,7 @@ class Stem:
         
         logger = logging.getLogger('Stem')
         try:
-            with open(file_path, 'r') as file:
+            with Stem._timed_io('read'), open(file_path, 'r') as file:
                 if filetype == 'json':
                     data = json.load(file)
                 elif filetype == 'text':
@@ -156,22 +223,242 @@ class Stem:
     def memory_write(file_path, file_content) -> None:
         """Function for saving files, mainly  related to the system memory.
         Performs checks and ensures that lack of the file won't cause overall program termination. 
+        The file is locked for the duration of the write, and replaced atomically, so concurrent
+        readers see either the previous or the new content.
 
         Args: 
             file_path (str): Path to the file to be accessed
-            filetype (str): Type of the file to be read [json, text]
+            file_content (str): Content of the file
         """
 
         logger = logging.getLogger('Stem')
         try:
-            with open(file_path, "w") as file:
-                file.write(file_content)
+            with Stem._timed_io('write'), Stem.file_lock(file_path):
+                Stem._replace(file_path, file_content, durable=False)
         except PermissionError:
             logger.error(f"Permission denied: Unable to write to file {file_path}.")
         except OSError as e:
             logger.error(f"File system error when writing to file {file_path}: {e}")
         except Exception as e:
             logger.error(f"Unexpected error wrtiting to file {file_path}: {e}")
+
+    @staticmethod
+    def fsync_directory(directory: str) -> None:
+        """
+        Flushes directory entries (e.g. a rename) to disk.
+        """
+
+        fd = os.open(directory or '.', os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def atomic_write(file_path, file_content) -> None:
+        """Function for saving files other processes or later stages may read at any time.
+        The content is written to a temporary file, flushed to disk and renamed over the target,
+        so readers see either the previous or the complete new file, never a partial one.
+
+        Args:
+            file_path (str): Path to the file to be written
+            file_content (str): Content of the file
+        """
+
+        logger = logging.getLogger('Stem')
+        try:
+            with Stem._timed_io('atomic_write'), Stem.file_lock(file_path):
+                Stem._replace(file_path, file_content, durable=True)
+        except OSError as e:
+            logger.error(f"File system error when writing to file {file_path}: {e}")
+
+    @staticmethod
+    def _replace(file_path: str, file_content: str, durable: bool) -> None:
+        directory, file_name = os.path.split(file_path)
+        temp_path = os.path.join(directory, f".{file_name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(temp_path, "w") as file:
+                file.write(file_content)
+                if durable:
+                    file.flush()
+                    os.fsync(file.fileno())
+            os.replace(temp_path, file_path)
+            if durable:
+                Stem.fsync_directory(directory)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    @staticmethod
+    @contextmanager
+    def file_lock(file_path: str):
+        """
+        Context manager holding an advisory (flock) lock of a file, excluding other threads and processes
+        locking it. Locks are reentrant within a thread. Files are mapped onto a fixed number of lock files
+        in config.io_lock_dir, so that no lock files are left next to memory files.
+
+        Args:
+            file_path (str): Path to the locked file
+        """
+
+        stripe = int(hashlib.sha1(os.path.abspath(file_path).encode()).hexdigest(), 16) % config.io_lock_stripes
+        held = _held_locks.__dict__.setdefault('stripes', {})
+        if stripe in held:
+            held[stripe] += 1
+            try:
+                yield
+            finally:
+                held[stripe] -= 1
+            return
+
+        os.makedirs(config.io_lock_dir, exist_ok=True)
+        fd = os.open(os.path.join(config.io_lock_dir, f"stripe_{stripe:03d}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            with Stem._timed_io('lock_wait'):
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            held[stripe] = 1
+            try:
+                yield
+            finally:
+                del held[stripe]
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def memory_update(file_path: str, update: Callable, filetype: str = 'json', default=None):
+        """
+        Reads, updates and writes a file back while holding its lock, so that concurrent updates are not lost.
+
+        Args:
+            file_path (str): Path to the file to be updated
+            update (Callable): Function receiving the content and returning the updated content
+            filetype (str): Type of the file [json, text]
+            default: Content assumed if the file doesn't exist
+
+        Returns:
+            Updated content
+        """
+
+        with Stem.file_lock(file_path):
+            content = Stem.memory_read(file_path, filetype) if os.path.exists(file_path) else default
+            content = update(content if content is not False else default)
+            Stem.memory_write(file_path, json.dumps(content, indent=4) if filetype == 'json' else content)
+        return content
+
+    @staticmethod
+    @contextmanager
+    def _timed_io(operation: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stats = _io_stats.setdefault(operation, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'event_loop_stalls': 0,
+                                                     'recent': deque(maxlen=1000)})
+            stats['calls'] += 1
+            stats['seconds'] += elapsed
+            stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+            stats['recent'].append(elapsed)
+            if elapsed > config.io_slow_seconds and Stem._on_event_loop():
+                # Called synchronously from a coroutine, the whole event loop waited for it
+                stats['event_loop_stalls'] += 1
+                logging.getLogger('Stem').warning(f"File {operation} blocked the event loop for {elapsed * 1000:.0f} ms.")
+
+    @staticmethod
+    def _on_event_loop() -> bool:
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        return True
+
+    @staticmethod
+    async def run_io(function: Callable, *args, **kwargs):
+        """
+        Runs a blocking file operation in the bounded I/O thread pool, without blocking the event loop.
+
+        Args:
+            function (Callable): Blocking function
+            args, kwargs: Its arguments
+
+        Returns:
+            The function's result
+        """
+
+        global _io_pool
+        if _io_pool is None:
+            _io_pool = ThreadPoolExecutor(max_workers=config.io_threads, thread_name_prefix='stem-io')
+        return await asyncio.get_running_loop().run_in_executor(_io_pool, lambda: function(*args, **kwargs))
+
+    @staticmethod
+    async def amemory_read(file_path: str, filetype: str = 'text'):
+        """
+        Reads a file like memory_read, in the I/O thread pool.
+        """
+
+        return await Stem.run_io(Stem.memory_read, file_path, filetype)
+
+    @staticmethod
+    async def amemory_write(file_path: str, file_content: str) -> None:
+        """
+        Writes a file like memory_write (locked, atomically replaced), in the I/O thread pool.
+        """
+
+        await Stem.run_io(Stem.memory_write, file_path, file_content)
+
+    @staticmethod
+    async def aatomic_write(file_path: str, file_content: str) -> None:
+        """
+        Writes a file like atomic_write (locked, flushed to disk, atomically replaced), in the I/O thread pool.
+        """
+
+        await Stem.run_io(Stem.atomic_write, file_path, file_content)
+
+    @staticmethod
+    async def amemory_update(file_path: str, update: Callable, filetype: str = 'json', default=None):
+        """
+        Updates a file like memory_update (read-modify-write under its lock), in the I/O thread pool.
+        """
+
+        return await Stem.run_io(Stem.memory_update, file_path, update, filetype, default)
+
+    @staticmethod
+    async def aarchive(source_dir: str, source_file: Optional[str] = None, archive_suffix='archive') -> bool:
+        """
+        Moves a processed file to the respective archive folder like archive, in the I/O thread pool.
+        """
+
+        return await Stem.run_io(Stem.archive, source_dir, source_file, archive_suffix)
+
+    @staticmethod
+    async def aprepare_directory(dir_path: str) -> bool:
+        """
+        Checks existence / creates a directory like prepare_directory, in the I/O thread pool.
+        """
+
+        return await Stem.run_io(Stem.prepare_directory, dir_path)
+
+    @staticmethod
+    def io_report() -> dict:
+        """
+        Logs and returns latency statistics of file operations: number of calls, mean, p99 and maximum latency,
+        and the number of synchronous calls which blocked the event loop.
+
+        Returns:
+            dict: Statistics keyed by operation
+        """
+
+        report = {}
+        for operation, stats in _io_stats.items():
+            recent = list(stats['recent'])
+            report[operation] = {'calls': stats['calls'],
+                                 'mean_ms': round(stats['seconds'] * 1000 / stats['calls'], 3),
+                                 'p99_ms': round(Stem.percentile(recent, 0.99) * 1000, 3),
+                                 'max_ms': round(stats['max_seconds'] * 1000, 3),
+                                 'event_loop_stalls': stats['event_loop_stalls']}
+        logging.getLogger('Stem').info(f"File I/O statistics: {report}")
+        return report
     
     @staticmethod
     def get_prompt(key) -> str:
@@ -187,11 +474,57 @@ class Stem:
         """
 
         prompts = Stem.memory_read('conversations/prompt_templates.json', 'json')
-        return prompts.get(key, "")
+        prompt = prompts.get(key, "")
+        # Templates with generation parameters are stored as {"template": ..., "generation": {...}}
+        return prompt.get('template', "") if isinstance(prompt, dict) else prompt
+
+    @staticmethod
+    def get_keywords_prompt(key) -> str:
+        """
+        Retrieves a keyword generation or selection prompt template matching the keyword output format.
+
+        With structured keywords the grammar forces a JSON list, so the variant asking for a JSON list is used
+        instead of the one asking for keywords flanked with double asterisks.
+
+        Args:
+            key (str): The key of the prompt to retrieve.
+
+        Returns:
+            str: The prompt template associated with the given key and the configured output format.
+        """
+
+        return Stem.get_prompt(f"{key}_structured" if config.structured_keywords else key)
+
+    @staticmethod
+    def get_generation_params(key) -> dict:
+        """
+        Retrieves generation parameters (e.g. max_tokens, stop, temperature) attached to a prompt template.
+
+        Args:
+            key (str): The key of the prompt template.
+
+        Returns:
+            dict: Generation parameters, empty if the template has none.
+        """
+
+        prompts = Stem.memory_read('conversations/prompt_templates.json', 'json') or {}
+        prompt = prompts.get(key, "")
+        return dict(prompt.get('generation', {})) if isinstance(prompt, dict) else {}
+
+    @staticmethod
+    def percentile(values: list, fraction: float) -> float:
+        """
+        Returns the value below which a given fraction of values falls (nearest rank), 0 for no values.
+        """
+
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
 
     @staticmethod
     def transplantation(base_model_path: str, new_model_path: str) -> None:
-        """Function moving new, finetuned model in place of an old one.
+        """Function moving new, finetuned model in place of an old one, which is kept in the model store.
 
         Args:
             base_model_path (str): Path to the original model file
@@ -209,19 +542,15 @@ class Stem:
                 else:
                     raise Exception(f"Missing both model files: {base_model_path} and {new_model_path}")
 
-            backup_path = base_model_path + "_bck"
-            logger.debug(f"Trying to backup old model file to {backup_path}.")            
+            logger.debug(f"Trying to move old model file to the model store.")            
             if os.path.exists(base_model_path):
+                from modules.ModelStore import ModelStore
                 try:
-                    shutil.copy(base_model_path, backup_path)
+                    ModelStore().shelve(base_model_path)
                 except Exception as e:
-                    raise Exception(f"Warning: can't make a backup: {e}") from e
-            
-            logger.debug(f"Trying to remove original model file: {base_model_path}.")                    
-            if os.path.exists(base_model_path):
-                os.remove(base_model_path)
+                    raise Exception(f"Warning: can't store the old model: {e}") from e
                 if os.path.exists(base_model_path):
-                    raise Exception("Failed to remove the existing model file.")
+                    raise Exception("Failed to move the existing model file.")
         
             logger.debug(f"Trying to move new model file {new_model_path} to take place of {base_model_path}.")                    
             shutil.move(new_model_path, base_model_path)
@@ -230,12 +559,67 @@ class Stem:
         
             logger.info("Base LLM File swap successful.")
 
+            # Responses generated by the previous model are no longer valid
+            from modules.ResponseCache import ResponseCache
+            ResponseCache.invalidate()
+
         except Exception as e:
             # Update the error logging to handle general exceptions, not just subprocess-related ones
             logger.error(f"Self brain transplantation failed: {str(e)}")
             # Reraise the exception with a custom message
             raise Exception(f"At least we tried... {e}") from e 
 
+    @staticmethod
+    def model_fingerprint(model_path: str, sample_size: int = 1 << 20) -> str:
+        """
+        Computes a fingerprint identifying a model file version without hashing the whole, multi-GB file.
+        The fingerprint covers the file size and its first and last sample_size bytes.
+
+        Args:
+            model_path (str): Path to the model file
+            sample_size (int): Number of bytes hashed at both ends of the file
+
+        Returns:
+            str: Hex digest identifying the model file version
+        """
+
+        digest = hashlib.sha256()
+        file_size = os.path.getsize(model_path)
+        digest.update(str(file_size).encode())
+        with open(model_path, 'rb') as file:
+            digest.update(file.read(sample_size))
+            if file_size > sample_size:
+                file.seek(max(file_size - sample_size, sample_size))
+                digest.update(file.read(sample_size))
+        return digest.hexdigest()
+
+    @staticmethod
+    def read_adapter_stack() -> list:
+        """
+        Reads the stack of LoRA adapters applied on top of the base model and awaiting compaction.
+
+        Returns:
+            list: Adapter entries (dicts with 'adapter', 'weight' and 'created' keys), oldest first
+        """
+
+        stack_path = os.path.join(config.lora_dir, 'adapter-stack.json')
+        if not os.path.exists(stack_path):
+            return []
+        stack = Stem.memory_read(stack_path, 'json')
+        return stack if stack else []
+
+    @staticmethod
+    def write_adapter_stack(stack: list) -> None:
+        """
+        Saves the stack of LoRA adapters applied on top of the base model.
+
+        Args:
+            stack (list): Adapter entries (dicts with 'adapter', 'weight' and 'created' keys), oldest first
+        """
+
+        Stem.prepare_directory(config.lora_dir)
+        Stem.memory_write(os.path.join(config.lora_dir, 'adapter-stack.json'), json.dumps(stack, indent=4))
+
     @staticmethod
     def clean_string(s) -> str:
         """
@@ -268,6 +652,7 @@ class Stem:
         - Creates a timestamped subdirectory in the logs directory.
         - Moves specific final LoRA files (checkpoint-LATEST.gguf, ggml-lora-LATEST-f32.gguf) to this subdirectory.
         - Removes any remaining 'checkpoint-*' and 'ggml-lora-*' files from the logs directory.
+        - Applies the log retention policy, removing expired finetuning archives and log segments.
 
         This method uses the 'Stem.get_timestamp()' method to generate a unique timestamp for the subdirectory.
         It ensures that only the specified final files are archived and the rest are cleaned up, maintaining a neat logs directory.
@@ -284,8 +669,7 @@ class Stem:
         #Final LoRA files to archive
         files_to_archive = [
             "checkpoint-LATEST.gguf",
-            "ggml-lora-LATEST-f32.gguf",
-            "llama-2-13b-chat.Q8_0.gguf_bck"
+            "ggml-lora-LATEST-f32.gguf"
         ]
 
         for file_name in files_to_archive:
@@ -304,4 +688,7 @@ class Stem:
                 if tmp_file not in files_to_archive:
                     os.remove(tmp_file)
         except Exception as e:
-            logger.debug(f"Error removing tmp files: {e}")
\ No newline at end of file
+            logger.debug(f"Error removing tmp files: {e}")
+
+        # Old finetuning archives and log segments are removed according to the retention policy
+        logging_utils.prune_logs()
\ No newline at end of file
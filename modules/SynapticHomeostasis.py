@@ -0,0 +1,270 @@
+import config
+from modules import logging_utils
+
+from modules.Stem import Stem
+
+import logging
+import os
+import re
+import json
+import math
+import random
+import hashlib
+from collections import Counter
+from typing import Callable, Optional
+
+class SynapticHomeostasis:
+    """
+    A class curating dreams before they are used for self-finetuning.
+
+    Generated dreams contain degenerate samples (empty responses, leaked markers) and many paraphrases
+    of the same answer, which burn finetuning epochs on redundant tokens. Samples are filtered by
+    structure and length, then deduplicated exactly, by word shingles overlap (MinHash) and by similarity
+    of their hashed bag-of-words embeddings. The remaining ones are shuffled and written to a compact
+    training file, together with statistics of the curation.
+    """
+
+    def __init__(self,
+                 count_tokens: Optional[Callable[[str], int]] = None,
+                 min_tokens: int = None,
+                 max_tokens: int = None,
+                 shingle_threshold: float = None,
+                 embedding_threshold: float = None):
+        """
+        Limits and thresholds not given are read from config (dream_*) when the instance is created.
+
+        Args:
+            count_tokens (Callable): Function counting tokens of a text with the model's tokenizer,
+                                     words are counted if not provided
+            min_tokens (int): Minimum number of tokens of a kept sample
+            max_tokens (int): Maximum number of tokens of a kept sample
+            shingle_threshold (float): Estimated Jaccard similarity of word shingles above which samples are duplicates
+            embedding_threshold (float): Cosine similarity of embeddings above which samples are duplicates
+        """
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.info(f"Instantiating {self.__class__.__name__}")
+
+        self._count_tokens = count_tokens or (lambda text: len(text.split()))
+        self._min_tokens = min_tokens if min_tokens is not None else config.dream_min_tokens
+        self._max_tokens = max_tokens if max_tokens is not None else config.dream_max_tokens
+        self._shingle_threshold = shingle_threshold if shingle_threshold is not None else config.dream_shingle_threshold
+        self._embedding_threshold = embedding_threshold if embedding_threshold is not None else config.dream_embedding_threshold
+
+        template = Stem.get_prompt("dream_template")
+        self._sample_start = template[:template.index("{stimulus}")].split()[0] if "{stimulus}" in template else "<s>"
+        self._sample_pattern = re.compile(re.escape(template.strip())
+                                            .replace(re.escape("{stimulus}"), r"(?P<stimulus>.*?)")
+                                            .replace(re.escape("{reaction}"), r"(?P<reaction>.*?)")
+                                            .replace(r"\ ", r"\s*"), re.DOTALL)
+
+        self._num_perm = 64
+        self._bands = 16
+        self._embedding_dim = 1024
+
+    def _split_samples(self, dreams: str) -> list:
+        """
+        Splits the dream file content into single samples.
+        """
+
+        return [self._sample_start + chunk for chunk in dreams.split(self._sample_start) if chunk.strip()]
+
+    def _leaks_marker(self, text: str) -> bool:
+        return any(marker in text for marker in config.dream_markers.values())
+
+    @staticmethod
+    def _normalize(text: str) -> str:
+        return ' '.join(re.findall(r"\w+", text.lower()))
+
+    def _minhash(self, words: list) -> tuple:
+        """
+        Computes the MinHash signature of word 3-shingles of a sample.
+        """
+
+        shingles = {' '.join(words[i:i + 3]) for i in range(max(len(words) - 2, 1))}
+        hashes = [int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), 'little') for shingle in shingles]
+        mask = (1 << 64) - 1
+        return tuple(min(((h ^ (seed * 0x9E3779B97F4A7C15)) * 0xBF58476D1CE4E5B9) & mask for h in hashes)
+                     for seed in range(1, self._num_perm + 1))
+
+    def _embed(self, words: list) -> dict:
+        """
+        Computes a normalized, hashed bag-of-words embedding of a sample.
+        """
+
+        vector = Counter(int.from_bytes(hashlib.blake2b(word.encode(), digest_size=4).digest(), 'little') % self._embedding_dim
+                         for word in words)
+        norm = math.sqrt(sum(value * value for value in vector.values())) or 1.0
+        return {index: value / norm for index, value in vector.items()}
+
+    @staticmethod
+    def _cosine(a: dict, b: dict) -> float:
+        if len(a) > len(b):
+            a, b = b, a
+        return sum(value * b.get(index, 0.0) for index, value in a.items())
+
+    def curate(self, dreams_path: str, seed: Optional[int] = None) -> tuple:
+        """
+        Filters and deduplicates dreams and writes the kept ones to a compact training file.
+
+        Args:
+            dreams_path (str): Path to the file with generated dreams
+            seed (int): Seed of the shuffle, random if not provided
+
+        Returns:
+            tuple: Path to the curated training file and curation statistics
+        """
+
+        samples = self._split_samples(Stem.memory_read(dreams_path) or '')
+        stats = Counter(raw_samples=len(samples))
+        stats['raw_tokens'] = 0
+
+        seen_texts = set()
+        bands = {}
+        embeddings = []
+        kept = []
+        rows_per_band = self._num_perm // self._bands
+
+        for sample in samples:
+            tokens = self._count_tokens(sample)
+            stats['raw_tokens'] += tokens
+
+            match = self._sample_pattern.search(sample)
+            if not match:
+                stats['dropped_malformed'] += 1
+                continue
+            stimulus, reaction = match.group('stimulus').strip(), match.group('reaction').strip()
+            if not stimulus or not reaction:
+                stats['dropped_empty'] += 1
+                continue
+            if self._leaks_marker(stimulus) or self._leaks_marker(reaction):
+                stats['dropped_marker_leak'] += 1
+                continue
+            if not self._min_tokens <= tokens <= self._max_tokens:
+                stats['dropped_length'] += 1
+                continue
+
+            normalized = self._normalize(f"{stimulus} {reaction}")
+            if normalized in seen_texts:
+                stats['dropped_exact_duplicate'] += 1
+                continue
+
+            words = normalized.split()
+            signature = self._minhash(words)
+            candidates = set()
+            for band in range(self._bands):
+                candidates.update(bands.get((band, signature[band * rows_per_band:(band + 1) * rows_per_band]), ()))
+            if any(sum(a == b for a, b in zip(signature, kept[i][1])) / self._num_perm >= self._shingle_threshold
+                   for i in candidates):
+                stats['dropped_shingle_duplicate'] += 1
+                continue
+
+            # Paraphrases share little word order, but most of the vocabulary of the answer
+            embedding = self._embed(self._normalize(reaction).split())
+            if any(self._cosine(embedding, other) >= self._embedding_threshold for other in embeddings):
+                stats['dropped_embedding_duplicate'] += 1
+                continue
+
+            seen_texts.add(normalized)
+            for band in range(self._bands):
+                bands.setdefault((band, signature[band * rows_per_band:(band + 1) * rows_per_band]), []).append(len(kept))
+            embeddings.append(embedding)
+            kept.append((sample.strip(), signature, tokens))
+
+        random.Random(seed).shuffle(kept)
+        stats['kept_samples'] = len(kept)
+        stats['kept_tokens'] = sum(tokens for _, _, tokens in kept)
+
+        base_path = os.path.splitext(dreams_path)[0]
+        curated_path = f"{base_path}_curated.txt"
+        Stem.atomic_write(curated_path, '\n'.join(sample for sample, _, _ in kept) + '\n')
+        Stem.atomic_write(f"{base_path}_curation.json", json.dumps(dict(stats), indent=4))
+
+        self.logger.info(f"Dreams curated: {stats['kept_samples']} of {stats['raw_samples']} samples kept, "
+                         f"{stats['kept_tokens']} of {stats['raw_tokens']} tokens.")
+        self.logger.debug(f"Curation statistics: {dict(stats)}")
+        return curated_path, dict(stats)
+
+class NoveltyMonitor:
+    """
+    A class tracking how much new content dreams bring as they are generated, so that dreaming about
+    a conclusion stops once it converges instead of after a fixed number of dreams.
+
+    Novelty of a dream is the share of its word n-grams not seen in previous dreams of the session.
+    Dreaming has converged once the mean novelty of the most recent dreams falls below a threshold,
+    with at least the minimum number of dreams generated.
+    """
+
+    def __init__(self,
+                 min_dreams: int = None,
+                 ngram: int = None,
+                 window: int = None,
+                 threshold: float = None):
+        """
+        Settings not given are read from config (dreams_min_num, dream_novelty_*) when the instance is created.
+
+        Args:
+            min_dreams (int): Minimum number of dreams before convergence
+            ngram (int): Length of word n-grams compared
+            window (int): Number of most recent dreams whose mean novelty is compared with the threshold
+            threshold (float): Mean novelty below which dreaming has converged
+        """
+
+        self._min_dreams = min_dreams if min_dreams is not None else config.dreams_min_num
+        self._ngram = ngram if ngram is not None else config.dream_novelty_ngram
+        self._window = window if window is not None else config.dream_novelty_window
+        self._threshold = threshold if threshold is not None else config.dream_novelty_threshold
+        self._seen = set()
+        self._total_ngrams = 0
+        self.novelty = []
+
+    def _ngrams(self, text: str) -> list:
+        words = SynapticHomeostasis._normalize(text).split()
+        return [' '.join(words[i:i + self._ngram]) for i in range(max(len(words) - self._ngram + 1, 1))] if words else []
+
+    def prime(self, text: str) -> None:
+        """
+        Marks the content of dreams generated before an interruption as seen.
+        """
+
+        ngrams = self._ngrams(text)
+        self._seen.update(ngrams)
+        self._total_ngrams += len(ngrams)
+
+    def observe(self, dream: str) -> float:
+        """
+        Scores a new dream and marks its content as seen.
+
+        Returns:
+            float: Share of the dream's n-grams not seen before
+        """
+
+        ngrams = self._ngrams(dream)
+        novelty = len(set(ngrams) - self._seen) / len(set(ngrams)) if ngrams else 0.0
+        self._seen.update(ngrams)
+        self._total_ngrams += len(ngrams)
+        self.novelty.append(novelty)
+        return novelty
+
+    @property
+    def recent_novelty(self) -> float:
+        recent = self.novelty[-self._window:]
+        return sum(recent) / len(recent) if recent else 1.0
+
+    def converged(self, dreams: int) -> bool:
+        """
+        Informs if dreaming has converged.
+
+        Args:
+            dreams (int): Number of dreams generated in the session, including the ones before an interruption
+        """
+
+        return (dreams >= self._min_dreams and len(self.novelty) >= self._window
+                and self.recent_novelty < self._threshold)
+
+    def diversity(self) -> float:
+        """
+        Share of distinct n-grams among all n-grams of the session's dreams.
+        """
+
+        return len(self._seen) / self._total_ngrams if self._total_ngrams else 0.0
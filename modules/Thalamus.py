@@ -0,0 +1,182 @@
+import config
+from modules import logging_utils
+
+import logging
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import struct
+from typing import Callable
+
+# inotify event masks, from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+EVENT_HEADER = struct.Struct('iIII')
+
+class Thalamus:
+    """
+    A class relaying changes of the entity's memory directories to other modules.
+
+    It keeps an in-memory index of pending files (e.g. conclusions awaiting self-finetuning, dreams
+    awaiting archiving), updated from inotify events, so that modules don't scan growing directories
+    every cycle. Where inotify is not available, directories are polled instead. Subscribers are
+    notified with the current index after each batch of changes.
+    """
+
+    def __init__(self, watched: dict = None):
+        """
+        Args:
+            watched (dict): Watched indexes by name, as (directory, file name prefix) tuples
+        """
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.info(f"Instantiating {self.__class__.__name__}")
+
+        self._watched = watched or {'conclusions': (config.conclusions_dir, "conclusion_"),
+                                    'dreams': (config.context_dir, "dream_")}
+        self.pending = {name: set() for name in self._watched}
+        self._subscribers = []
+        self._fd = None
+        self._watch_descriptors = {}
+        self._poller = None
+
+    def _scan(self, name: str) -> set:
+        directory, prefix = self._watched[name]
+        if not os.path.isdir(directory):
+            return set()
+        with os.scandir(directory) as entries:
+            return {os.path.join(directory, entry.name) for entry in entries if entry.name.startswith(prefix) and entry.is_file()}
+
+    def pending_files(self, name: str) -> list:
+        """
+        Returns pending files of an index, applying inotify events queued since the last loop iteration first.
+
+        Args:
+            name (str): Index name, e.g. 'conclusions' or 'dreams'
+
+        Returns:
+            list: Sorted paths of pending files
+        """
+
+        if self._fd is not None:
+            self._read_events()
+        elif self._poller is not None:
+            self.pending[name] = self._scan(name)
+        return sorted(self.pending[name])
+
+    def subscribe(self, callback: Callable[[str, set], None]) -> None:
+        """
+        Registers a callback called with the index name and its pending files after each change.
+        """
+
+        self._subscribers.append(callback)
+
+    def _notify(self, changed: set) -> None:
+        for name in changed:
+            for callback in self._subscribers:
+                try:
+                    callback(name, set(self.pending[name]))
+                except Exception as e:
+                    self.logger.error(f"Subscriber of {name} failed: {e}")
+
+    def start(self) -> None:
+        """
+        Builds the index and starts watching. Needs to be called from the running event loop.
+        """
+
+        # Watches are added before the initial scan, so that no change is missed in between
+        if not self._start_inotify():
+            self.logger.info(f"inotify not available, polling every {config.thalamus_poll_seconds}s.")
+            self._poller = asyncio.create_task(self._poll())
+        for name in self._watched:
+            self.pending[name] = self._scan(name)
+        self.logger.debug(f"Pending files: { {name: len(files) for name, files in self.pending.items()} }")
+
+    def _start_inotify(self) -> bool:
+        library = ctypes.util.find_library('c')
+        if not library:
+            return False
+        libc = ctypes.CDLL(library, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            return False
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            self.logger.warning(f"inotify_init1 failed: {os.strerror(ctypes.get_errno())}")
+            return False
+        for name, (directory, _) in self._watched.items():
+            os.makedirs(directory, exist_ok=True)
+            wd = libc.inotify_add_watch(fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                self.logger.warning(f"inotify_add_watch on {directory} failed: {os.strerror(ctypes.get_errno())}")
+                os.close(fd)
+                return False
+            self._watch_descriptors[wd] = name
+        self._fd = fd
+        asyncio.get_running_loop().add_reader(fd, self._read_events)
+        return True
+
+    def _read_events(self) -> None:
+        """
+        Applies all queued inotify events to the index, then notifies subscribers once.
+        """
+
+        changed = set()
+        while True:
+            try:
+                buffer = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+                offset += EVENT_HEADER.size
+                file_name = os.fsdecode(buffer[offset:offset + length].rstrip(b'\0'))
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    self.logger.warning(f"inotify queue overflowed, rescanning.")
+                    for name in self._watched:
+                        self.pending[name] = self._scan(name)
+                        changed.add(name)
+                    continue
+                name = self._watch_descriptors.get(wd)
+                if name is None or not file_name.startswith(self._watched[name][1]):
+                    continue
+                path = os.path.join(self._watched[name][0], file_name)
+                if mask & (IN_CREATE | IN_MOVED_TO | IN_CLOSE_WRITE):
+                    self.pending[name].add(path)
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self.pending[name].discard(path)
+                changed.add(name)
+        self._notify(changed)
+
+    async def _poll(self) -> None:
+        while True:
+            await asyncio.sleep(config.thalamus_poll_seconds)
+            changed = set()
+            for name in self._watched:
+                files = self._scan(name)
+                if files != self.pending[name]:
+                    self.pending[name] = files
+                    changed.add(name)
+            self._notify(changed)
+
+    def stop(self) -> None:
+        """
+        Stops watching.
+        """
+
+        if self._fd is not None:
+            asyncio.get_running_loop().remove_reader(self._fd)
+            os.close(self._fd)
+            self._fd = None
+        if self._poller:
+            self._poller.cancel()
+            self._poller = None
@@ -0,0 +1,292 @@
+import config
+from modules import logging_utils
+
+import logging
+import asyncio
+import heapq
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Optional
+
+# Job priorities, lower values are dispatched first
+INTERACTIVE = 0
+BACKGROUND = 10
+
+# Priorities of tasks finishing the user's interaction (e.g. summarizing the conversation just held),
+# which are dispatched also while the entity is engaged; other tasks run with BACKGROUND priority
+TASK_PRIORITIES = {'keyword_generation': INTERACTIVE}
+
+def _worker_main(jobs, results, worker_id: int, generation: int, workers: int) -> None:
+    """
+    Worker process loop: loads its own PFC and processes jobs until it receives None.
+    Model weights are memory-mapped, so they are shared with other processes through the page cache,
+    while the prefix cache memory budget and the threads are split between the workers.
+    """
+
+    from modules.PerceptiveFrameworkCore import PerceptiveFrameworkCore
+
+    if config.background_worker_nice:
+        os.nice(config.background_worker_nice)
+    config.prefix_cache_bytes //= workers
+    pfc = PerceptiveFrameworkCore(config.model_path)
+    pfc.cpu_shares = workers
+    pfc.load()
+    pfc.set_workload('batch')
+    results.put((generation, worker_id, None, None, None))
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        job_id, prompt, task, kwargs = job
+        try:
+            results.put((generation, worker_id, job_id, pfc.invoke(prompt, task=task, **kwargs), None))
+        except Exception as e:
+            results.put((generation, worker_id, job_id, None, f"{e.__class__.__name__}: {e}"))
+
+class WorkerPool:
+    """
+    A class running background cognition (DMN pondering, conversation summarization, dream weaving)
+    in a pool of worker processes, each with its own model context, so it does not contend with the
+    user-facing generation in the main process.
+
+    Jobs wait in a priority queue. While the entity is engaged in an interaction, background jobs are
+    not dispatched, and workers run with a lower OS priority, so interactive turns always come first.
+    Other PFC functions (adapters, workloads, statistics) are delegated to the main process PFC.
+    """
+
+    def __init__(self, pfc, engaged_event: asyncio.Event, size: int = config.background_workers):
+        """
+        Args:
+            pfc: PerceptiveFrameworkCore of the main process
+            engaged_event (asyncio.Event): Event set while the entity interacts with the environment
+            size (int): Number of worker processes
+        """
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.info(f"Instantiating {self.__class__.__name__} with {size} workers")
+
+        self.pfc = pfc
+        self.engaged = engaged_event
+        self.size = size
+
+        self._context = multiprocessing.get_context('spawn')
+        self._results = self._context.Queue()
+        self._workers = []
+        # Incremented on every (re)start, so that idle notices of stopped workers are ignored
+        self._generation = 0
+
+        self._pending = []
+        self._sequence = itertools.count()
+        self._futures = {}
+        self._idle = []
+        # Jobs being processed by worker id, and ids of workers which exited unexpectedly
+        self._assigned = {}
+        self._dead = set()
+        self._condition = threading.Condition()
+        self._running = True
+
+        self._start_workers()
+        threading.Thread(target=self._dispatch, daemon=True).start()
+        threading.Thread(target=self._collect, daemon=True).start()
+
+    def __getattr__(self, name):
+        return getattr(self.pfc, name)
+
+    @property
+    def parallelism(self) -> int:
+        return self.size
+
+    def _start_workers(self) -> None:
+        self._generation += 1
+        for worker_id in range(self.size):
+            jobs = self._context.Queue()
+            process = self._context.Process(target=_worker_main, args=(jobs, self._results, worker_id, self._generation, self.size),
+                                            daemon=True)
+            process.start()
+            self._workers.append((process, jobs))
+
+    def _stop_workers(self) -> None:
+        """
+        Stops worker processes after their current job, terminating the ones which don't exit in time.
+        It blocks, so coroutines run it in an executor.
+        """
+
+        with self._condition:
+            workers, self._workers = self._workers, []
+            assigned, self._assigned = self._assigned, {}
+            self._idle = []
+            self._dead = set()
+        for process, jobs in workers:
+            jobs.put(None)
+        for worker_id, (process, jobs) in enumerate(workers):
+            process.join(timeout=config.background_worker_stop_seconds)
+            if process.is_alive():
+                self.logger.warning(f"Background worker {worker_id} didn't stop in {config.background_worker_stop_seconds}s, terminating it.")
+                process.terminate()
+                process.join()
+                if worker_id in assigned:
+                    self._resolve(assigned[worker_id], error=f"worker {worker_id} terminated")
+
+    def _resolve(self, job_id: int, response: str = None, error: str = None) -> None:
+        """
+        Resolves the future of a job, unless it has been resolved already.
+        """
+
+        with self._condition:
+            future = self._futures.pop(job_id, None)
+        if future is None:
+            return
+        if error:
+            future.set_exception(RuntimeError(f"Background job failed: {error}"))
+        else:
+            future.set_result(response)
+
+    def _check_workers(self) -> None:
+        """
+        Fails jobs of workers which exited unexpectedly (e.g. killed for lack of memory), and all queued jobs
+        once no worker is left.
+        """
+
+        failed = []
+        with self._condition:
+            for worker_id, (process, jobs) in enumerate(self._workers):
+                if worker_id in self._dead or process.is_alive():
+                    continue
+                self.logger.error(f"Background worker {worker_id} exited with code {process.exitcode}.")
+                self._dead.add(worker_id)
+                if worker_id in self._idle:
+                    self._idle.remove(worker_id)
+                if worker_id in self._assigned:
+                    failed.append((self._assigned.pop(worker_id), f"worker {worker_id} exited"))
+            if self._workers and len(self._dead) == len(self._workers):
+                failed += [(job[1], "no background worker running") for job in self._pending]
+                self._pending = []
+        for job_id, error in failed:
+            self._resolve(job_id, error=error)
+
+    def _dispatch(self) -> None:
+        """
+        Dispatcher thread: hands the highest priority job to an idle worker, holding background jobs while engaged.
+        """
+
+        while self._running:
+            with self._condition:
+                job = None
+                if self._pending and self._idle:
+                    priority = self._pending[0][0]
+                    if priority <= INTERACTIVE or not self.engaged.is_set():
+                        job = heapq.heappop(self._pending)
+                        worker_id = self._idle.pop()
+                if job is None:
+                    # Engaged state is not signalled to this thread, so it is rechecked periodically
+                    self._condition.wait(timeout=0.5)
+                    continue
+                # Handed over under the lock, so that a stopping worker gets the job before its stop signal
+                _, job_id, prompt, task, kwargs = job
+                self._assigned[worker_id] = job_id
+                self._workers[worker_id][1].put((job_id, prompt, task, kwargs))
+
+    def _collect(self) -> None:
+        """
+        Collector thread: resolves futures of finished jobs and marks their workers idle.
+        """
+
+        while self._running:
+            try:
+                generation, worker_id, job_id, response, error = self._results.get(timeout=0.5)
+            except queue.Empty:
+                self._check_workers()
+                continue
+            if job_id is not None:
+                self._resolve(job_id, response, error)
+            with self._condition:
+                if generation == self._generation:
+                    self._assigned.pop(worker_id, None)
+                    self._idle.append(worker_id)
+                    self._condition.notify()
+
+    def submit(self, prompt: str, task: Optional[str] = None, priority: Optional[int] = None, **kwargs) -> Future:
+        """
+        Puts a generation job into the queue.
+
+        Args:
+            prompt (str): The prompt to be processed
+            task (str): Key of the prompt template the prompt was built from
+            priority (int): Job priority, INTERACTIVE jobs are dispatched also while engaged (by default from TASK_PRIORITIES)
+
+        Returns:
+            Future: Future resolved with the generated text
+        """
+
+        # Workers don't share the model with interactions, so their generations are not preempted
+        kwargs.pop('preempt', None)
+
+        priority = priority if priority is not None else TASK_PRIORITIES.get(task, BACKGROUND)
+        future = Future()
+        with self._condition:
+            job_id = next(self._sequence)
+            self._futures[job_id] = future
+            heapq.heappush(self._pending, (priority, job_id, prompt, task, kwargs))
+            self._condition.notify()
+        return future
+
+    def invoke(self, prompt: str, task: Optional[str] = None, **kwargs) -> str:
+        return self.submit(prompt, task, **kwargs).result()
+
+    def invoke_many(self, prompts: list, task: Optional[str] = None, **kwargs) -> list:
+        futures = [self.submit(prompt, task, **kwargs) for prompt in prompts]
+        return [future.result() for future in futures]
+
+    async def ainvoke(self, prompt: str, task: Optional[str] = None, **kwargs) -> str:
+        return await asyncio.wrap_future(self.submit(prompt, task, **kwargs))
+
+    async def ainvoke_many(self, prompts: list, task: Optional[str] = None, **kwargs) -> list:
+        return await asyncio.gather(*[self.ainvoke(prompt, task, **kwargs) for prompt in prompts])
+
+    def attach_adapter(self, adapter_path: str, weight: float) -> None:
+        """
+        Applies a LoRA adapter to the main process model and restarts workers, which load the updated adapter stack.
+        """
+
+        self.pfc.attach_adapter(adapter_path, weight)
+        self.restart()
+
+    def unload(self) -> None:
+        """
+        Stops worker processes and frees the main process model. Workers are started again with restart().
+        """
+
+        self._stop_workers()
+        self.pfc.unload()
+
+    def suspend(self, reason: str) -> None:
+        """
+        Stops worker processes and suspends the main process model. Workers are started again with restart().
+        """
+
+        self._stop_workers()
+        self.pfc.suspend(reason)
+
+    def restart(self) -> None:
+        """
+        Restarts worker processes, e.g. after the model files changed. Queued jobs are kept.
+        """
+
+        self.logger.debug(f"Restarting background workers.")
+        self._stop_workers()
+        self._start_workers()
+
+    def close(self) -> None:
+        """
+        Stops worker processes and the dispatching threads.
+        """
+
+        self._stop_workers()
+        self._running = False
+        with self._condition:
+            self._condition.notify_all()
@@ -2,7 +2,25 @@ import config
 
 import logging
 import os
+import gzip
+import queue
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from glob import glob
 from datetime import datetime
+from typing import Iterator, Optional
+
+# Mode the entity is in, as (sequence number, mode name); each mark_mode() call starts a new indexed log slice
+_mode_mark = (0, 'startup')
+
+# File handler of the current session, whose active segment is never pruned
+_segmented_handler = None
+
+# Serializes retention passes started by concurrent rollovers
+_prune_lock = threading.Lock()
 
 # Logging utility
 def setup_custom_log_levels():
@@ -92,11 +110,11 @@ def setup_logging(file_log_level: int, console_log_level: int) -> None:
     if not os.path.exists(log_directory):
         os.makedirs(log_directory)
 
+    global _segmented_handler
     current_time = datetime.now().strftime("%Y%m%d_%H%M%S")
-    log_file_name = f"{log_directory}/log_{current_time}.log"
-
-    file_handler = logging.FileHandler(log_file_name)
+    file_handler = SegmentedFileHandler(log_directory, current_time)
     file_handler.setLevel(file_log_level)
+    _segmented_handler = file_handler
 
     console_handler = logging.StreamHandler()
     console_handler.setLevel(console_log_level)
@@ -114,4 +132,388 @@ def setup_logging(file_log_level: int, console_log_level: int) -> None:
     root_logger.addHandler(file_handler)
     root_logger.addHandler(console_handler)
 
-setup_logging(file_log_level=config.file_log_level, console_log_level=config.console_log_level)
\ No newline at end of file
+    # Segments left uncompressed by previous sessions are compressed, expired ones removed
+    threading.Thread(target=prune_logs, daemon=True).start()
+
+def mark_mode(mode: str) -> None:
+    """
+    Marks the start of a new log slice in a given mode (e.g. a conversation turn, a DMN or REM session),
+    so that its log lines can be found through the log index.
+
+    Args:
+        mode (str): Mode name, e.g. 'interaction', 'dmn', 'rem' or 'idle'
+    """
+
+    global _mode_mark
+    _mode_mark = (_mode_mark[0] + 1, mode)
+
+class LogIndex:
+    """
+    A SQLite index of log segments and mode marks (byte offsets within segments where a mode slice starts),
+    by session, mode and timestamp.
+    """
+
+    def __init__(self, index_path: str = config.log_index_path):
+        if os.path.dirname(index_path):
+            os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(index_path, check_same_thread=False)
+        self._connection.execute("""CREATE TABLE IF NOT EXISTS segments (
+                                        path TEXT PRIMARY KEY,
+                                        session TEXT NOT NULL,
+                                        started REAL NOT NULL,
+                                        ended REAL,
+                                        bytes INTEGER,
+                                        pid INTEGER)""")
+        # Indexes created before segments recorded the process writing them
+        if 'pid' not in [column[1] for column in self._connection.execute("PRAGMA table_info(segments)")]:
+            self._connection.execute("ALTER TABLE segments ADD COLUMN pid INTEGER")
+        self._connection.execute("""CREATE TABLE IF NOT EXISTS marks (
+                                        path TEXT NOT NULL,
+                                        session TEXT NOT NULL,
+                                        mode TEXT NOT NULL,
+                                        created REAL NOT NULL,
+                                        offset INTEGER NOT NULL)""")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS segments_session ON segments (session, started)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS marks_path ON marks (path, offset)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS marks_created ON marks (created)")
+        self._connection.commit()
+
+    def _execute(self, query: str, params: tuple = ()) -> list:
+        with self._lock:
+            rows = self._connection.execute(query, params).fetchall()
+            self._connection.commit()
+        return rows
+
+    def open_segment(self, path: str, session: str, started: float) -> None:
+        self._execute("INSERT OR REPLACE INTO segments (path, session, started, ended, bytes, pid) VALUES (?, ?, ?, NULL, NULL, ?)",
+                      (path, session, started, os.getpid()))
+
+    def segment(self, path: str) -> Optional[tuple]:
+        """
+        Returns the end time (None while open) and the writing process id of an indexed segment, None if it is not indexed.
+        """
+
+        rows = self._execute("SELECT ended, pid FROM segments WHERE path = ?", (path,))
+        return rows[0] if rows else None
+
+    def close_segment(self, path: str, ended: float, size: int) -> None:
+        self._execute("UPDATE segments SET ended = ?, bytes = ? WHERE path = ?", (ended, size, path))
+
+    def move_segment(self, path: str, new_path: str, ended: float) -> None:
+        # Segments of sessions which didn't close them (e.g. crashed) end with their last write
+        self._execute("UPDATE segments SET path = ?, ended = COALESCE(ended, ?) WHERE path = ?", (new_path, ended, path))
+        self._execute("UPDATE marks SET path = ? WHERE path = ?", (new_path, path))
+
+    def forget_segment(self, path: str) -> None:
+        self._execute("DELETE FROM segments WHERE path = ?", (path,))
+        self._execute("DELETE FROM marks WHERE path = ?", (path,))
+
+    def add_mark(self, path: str, session: str, mode: str, created: float, offset: int) -> None:
+        self._execute("INSERT INTO marks VALUES (?, ?, ?, ?, ?)", (path, session, mode, created, offset))
+
+    def sessions(self) -> list:
+        """
+        Returns indexed sessions as (session, started, ended, segments, bytes) rows.
+        """
+
+        return self._execute("""SELECT session, MIN(started), MAX(ended), COUNT(*), SUM(bytes)
+                                FROM segments GROUP BY session ORDER BY MIN(started)""")
+
+    def slices(self, since: Optional[float] = None, until: Optional[float] = None,
+               session: Optional[str] = None, mode: Optional[str] = None) -> list:
+        """
+        Returns log slices overlapping a time range, as (path, mode, started, ended, start offset, end offset) tuples,
+        end offset being None for the end of the segment.
+        """
+
+        since = since if since is not None else 0.0
+        until = until if until is not None else float('inf')
+        segments = self._execute("""SELECT path, ended FROM segments
+                                    WHERE (? IS NULL OR session = ?) AND started <= ? AND (ended IS NULL OR ended >= ?)
+                                    ORDER BY started""", (session, session, until, since))
+        slices = []
+        for path, segment_ended in segments:
+            marks = self._execute("SELECT mode, created, offset FROM marks WHERE path = ? ORDER BY offset", (path,))
+            for index, (mark_mode, created, offset) in enumerate(marks):
+                following = marks[index + 1] if index + 1 < len(marks) else None
+                ended = following[1] if following else (segment_ended or float('inf'))
+                if (mode is None or mark_mode == mode) and created <= until and ended >= since:
+                    slices.append((path, mark_mode, created, ended, offset, following[2] if following else None))
+        return slices
+
+class SegmentedFileHandler(logging.FileHandler):
+    """
+    A file handler writing a session's log into size- and age-bounded segments. Full segments are compressed
+    in the background, and mode marks are recorded in the log index with their byte offsets. Marks are queued
+    and written to the index by a background thread, so that logging calls never wait for SQLite.
+    """
+
+    def __init__(self, log_directory: str, session: str,
+                 max_bytes: int = config.log_max_bytes, max_seconds: float = config.log_segment_seconds):
+        """
+        Args:
+            log_directory (str): Directory of log segments
+            session (str): Session name, the timestamp of the process start
+            max_bytes (int): Maximum size of a segment
+            max_seconds (float): Maximum age of a segment
+        """
+
+        self._directory = log_directory
+        self.session = session
+        self._max_bytes = max_bytes
+        self._max_seconds = max_seconds
+        self._segment = 0
+        self._index = LogIndex()
+        super().__init__(self._segment_path())
+        self._started = time.time()
+        self._last_created = self._started
+        self._indexed_mark = None
+        self._index.open_segment(self.baseFilename, self.session, self._started)
+        self._marks = queue.Queue()
+        self._mark_writer = threading.Thread(target=self._write_marks, daemon=True)
+        self._mark_writer.start()
+
+    def _write_marks(self) -> None:
+        while True:
+            mark = self._marks.get()
+            try:
+                if mark is None:
+                    return
+                self._index.add_mark(*mark)
+            except sqlite3.Error as e:
+                # Not logged: the handler may be waiting for this thread while holding its lock
+                sys.stderr.write(f"Failed to index {mark[2]} mark of {mark[0]}: {e}\n")
+            finally:
+                self._marks.task_done()
+
+    def flush_marks(self) -> None:
+        """
+        Waits until queued mode marks are written to the log index.
+        """
+
+        if self._mark_writer.is_alive():
+            self._marks.join()
+
+    def _segment_path(self) -> str:
+        return os.path.abspath(os.path.join(self._directory, f"log_{self.session}_{self._segment:04d}.log"))
+
+    def _should_rollover(self) -> bool:
+        return (self.stream.tell() >= self._max_bytes) or (time.time() - self._started >= self._max_seconds)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            if self.stream is not None and self._should_rollover():
+                self.do_rollover()
+            if self.stream is None:
+                self.stream = self._open()
+            if _mode_mark != self._indexed_mark:
+                self._indexed_mark = _mode_mark
+                self._marks.put((self.baseFilename, self.session, _mode_mark[1], record.created, self.stream.tell()))
+            self._last_created = record.created
+        except Exception:
+            self.handleError(record)
+            return
+        super().emit(record)
+
+    def do_rollover(self) -> None:
+        """
+        Closes the current segment, compressing it in the background, and starts a new one.
+        """
+
+        closed = self.baseFilename
+        size = self.stream.tell()
+        # Marks of the closed segment are indexed before it is moved by compression
+        self.flush_marks()
+        self.stream.close()
+        self.stream = None
+        self._index.close_segment(closed, self._last_created, size)
+        threading.Thread(target=compress_segment, args=(closed, self._index), daemon=True).start()
+
+        self._segment += 1
+        self.baseFilename = self._segment_path()
+        self.stream = self._open()
+        self._started = time.time()
+        # The current mode is marked again at the start of the new segment
+        self._indexed_mark = None
+        self._index.open_segment(self.baseFilename, self.session, self._started)
+        threading.Thread(target=prune_logs, args=(self._index,), daemon=True).start()
+
+    def close(self) -> None:
+        if self._mark_writer.is_alive():
+            self._marks.put(None)
+            self._mark_writer.join()
+        if self.stream is not None:
+            self._index.close_segment(self.baseFilename, self._last_created, self.stream.tell())
+        super().close()
+
+def compress_segment(path: str, index: Optional[LogIndex] = None) -> str:
+    """
+    Compresses a closed log segment with gzip, replacing it.
+
+    Returns:
+        str: Path to the compressed segment
+    """
+
+    compressed = f"{path}.gz"
+    ended = os.path.getmtime(path)
+    with open(path, 'rb') as source, gzip.open(f"{compressed}.tmp", 'wb') as target:
+        shutil.copyfileobj(source, target)
+    os.replace(f"{compressed}.tmp", compressed)
+    (index or LogIndex()).move_segment(path, compressed, ended)
+    os.remove(path)
+    return compressed
+
+def _tree_size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+def prune_logs(index: Optional[LogIndex] = None) -> list:
+    """
+    Compresses log segments left uncompressed by previous sessions, and applies the retention policy to
+    log segments and finetuning archives: removes the ones older than config.log_retention_days, finetuning
+    archives beyond config.log_finetuning_keep, then the oldest ones until their total size fits
+    config.log_retention_bytes. Segments of the current session are never removed.
+
+    Returns:
+        list: Removed paths
+    """
+
+    with _prune_lock:
+        return _prune_logs(index or LogIndex())
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _prune_logs(index: LogIndex) -> list:
+    logger = logging.getLogger('logging_utils')
+    # Segments of the current session are compressed by its handler
+    current = f"log_{_segmented_handler.session}_" if _segmented_handler else None
+    for path in glob(os.path.join(config.log_dir, "log_*.log")):
+        if current is not None and os.path.basename(path).startswith(current):
+            continue
+        path = os.path.abspath(path)
+        ended, pid = index.segment(path) or (None, None)
+        # Segments of other running sessions (e.g. the replay session) are compressed by their own handlers,
+        # segments of sessions which didn't close them only once they are no longer written to
+        if pid is not None and _process_alive(pid):
+            continue
+        try:
+            if ended is None and time.time() - os.path.getmtime(path) < config.log_stale_seconds:
+                continue
+            compress_segment(path, index)
+        except OSError as e:
+            logger.warning(f"Failed to compress log segment {path}: {e}")
+
+    segments = [os.path.abspath(path) for path in glob(os.path.join(config.log_dir, "log_*.log.gz"))
+                if current is None or not os.path.basename(path).startswith(current)]
+    archives = [os.path.abspath(path) for path in glob(os.path.join(config.log_dir, "finetuning_*")) if os.path.isdir(path)]
+    entries = sorted(((os.path.getmtime(path), path) for path in segments + archives))
+
+    expired = set()
+    if config.log_retention_days:
+        cutoff = time.time() - config.log_retention_days * 86400
+        expired.update(path for mtime, path in entries if mtime < cutoff)
+    kept_archives = [path for _, path in entries if path in archives and path not in expired]
+    expired.update(kept_archives[:max(len(kept_archives) - config.log_finetuning_keep, 0)])
+    if config.log_retention_bytes:
+        sizes = {path: _tree_size(path) for _, path in entries}
+        total = sum(size for path, size in sizes.items() if path not in expired)
+        for _, path in entries:
+            if total <= config.log_retention_bytes:
+                break
+            if path not in expired:
+                expired.add(path)
+                total -= sizes[path]
+
+    removed = []
+    for _, path in entries:
+        if path not in expired:
+            continue
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+                index.forget_segment(path)
+            removed.append(path)
+        except OSError as e:
+            logger.warning(f"Failed to remove {path}: {e}")
+    if removed:
+        logger.debug(f"Removed {len(removed)} expired log segments and finetuning archives.")
+    return removed
+
+def _line_time(line: bytes) -> Optional[float]:
+    try:
+        return datetime.strptime(line[:23].decode(), "%Y-%m-%d %H:%M:%S,%f").timestamp()
+    except ValueError:
+        return None
+
+def slice_logs(since: Optional[float] = None, until: Optional[float] = None,
+               session: Optional[str] = None, mode: Optional[str] = None) -> Iterator[str]:
+    """
+    Yields log lines of a time range, session and mode, reading only the indexed slices that overlap them
+    instead of whole logs. Continuation lines of multi-line records follow their record.
+
+    Args:
+        since (float): Start of the time range (epoch seconds)
+        until (float): End of the time range (epoch seconds)
+        session (str): Session name (process start timestamp)
+        mode (str): Mode name, e.g. 'interaction', 'dmn', 'rem'
+
+    Yields:
+        str: Log lines
+    """
+
+    if _segmented_handler is not None:
+        _segmented_handler.flush_marks()
+    for path, _, _, _, start, end in LogIndex().slices(since, until, session, mode):
+        if not os.path.exists(path):
+            continue
+        with (gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')) as file:
+            file.seek(start)
+            included = True
+            position = start
+            for line in file:
+                if end is not None and position >= end:
+                    break
+                position += len(line)
+                created = _line_time(line)
+                if created is not None:
+                    included = (since is None or created >= since) and (until is None or created <= until)
+                if included:
+                    yield line.decode(errors='replace').rstrip('\n')
+
+# Custom log levels are needed by every module logger, handlers are configured by the entry point
+setup_custom_log_levels()
+
+if __name__ == '__main__':
+    import argparse
+
+    def timestamp(value: str) -> float:
+        return datetime.fromisoformat(value).timestamp()
+
+    parser = argparse.ArgumentParser(description="Lists logged sessions or prints log lines of a session, mode and time range.")
+    parser.add_argument('command', choices=['sessions', 'slice', 'prune'])
+    parser.add_argument('--session', help="Session name, e.g. 20240101_120000")
+    parser.add_argument('--mode', help="Mode: interaction, dmn, rem, idle or startup")
+    parser.add_argument('--since', type=timestamp, help="Start of the time range, e.g. '2024-01-01 12:00:00'")
+    parser.add_argument('--until', type=timestamp, help="End of the time range")
+    args = parser.parse_args()
+
+    if args.command == 'sessions':
+        for session, started, ended, segments, size in LogIndex().sessions():
+            print(f"{session}\t{datetime.fromtimestamp(started)}\t{datetime.fromtimestamp(ended) if ended else 'active'}\t"
+                  f"{segments} segment(s)\t{size or 0} bytes")
+    elif args.command == 'slice':
+        for line in slice_logs(args.since, args.until, args.session, args.mode):
+            print(line)
+    else:
+        print('\n'.join(prune_logs()))
@@ -0,0 +1,238 @@
+"""
+Replays recorded conversations against the conversation front-end to characterize its latency and throughput.
+
+Transcripts (by default the topic/scenario fixtures in conversations/) are parsed into user turns.
+Sessions arrive as a Poisson process at a given rate, at most a given number of them run concurrently,
+and each replays its transcript's user turns with a think time in between. Per-turn latencies and
+throughput are reported, and optionally saved as JSON.
+
+Usage:
+    python replay.py --target pfc --concurrency 4 --rate 0.5 --sessions 20 --output replay-report.json
+
+Targets:
+    pfc     Conversation prompts sent directly to PerceptiveFrameworkCore, concurrently if it is served (default)
+    lpm     LanguageProcessingModule driven through its input events, as by a human. The module polls for input
+            once a second and generates on the event loop, so turn latencies include up to a second of polling
+            delay and concurrent sessions are served one at a time; use it to check the front-end end to end,
+            not to measure latency or throughput
+    module:factory   Custom front-end: factory(pfc) returning an object with async open_session(),
+                     whose sessions provide async respond(text) -> str and async close()
+"""
+
+import config
+from modules import logging_utils
+from modules.Stem import Stem
+
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import random
+import re
+import time
+from glob import glob
+
+def parse_transcript(transcript: str) -> list:
+    """
+    Splits a conversation transcript into user turns.
+
+    Args:
+        transcript (str): Conversation with 'User:' and 'You:' prefixed turns
+
+    Returns:
+        list: Texts of user turns
+    """
+
+    turns = []
+    for part in re.split(r'^(User|You):', transcript, flags=re.MULTILINE)[1:]:
+        if part in ('User', 'You'):
+            speaker = part
+        elif speaker == 'User' and part.strip():
+            turns.append(part.strip())
+    return turns
+
+class LPMTarget:
+    """
+    Drives LanguageProcessingModule instances the way get_user_input() does, one per session.
+    Latencies include the module's input polling delay, and its generations block the event loop,
+    serializing concurrent sessions.
+    """
+
+    def __init__(self, pfc, end_sessions: bool = False):
+        from modules.SensoryProcessing import LanguageProcessingModule
+
+        self._module = LanguageProcessingModule
+        self._pfc = pfc
+        self._end_sessions = end_sessions
+
+    async def open_session(self):
+        return LPMSession(self._module(self._pfc, asyncio.Event()), self._end_sessions)
+
+class LPMSession:
+    def __init__(self, lpm, end_session: bool):
+        self._lpm = lpm
+        self._end_session = end_session
+        self._interaction = None
+
+    async def _submit(self, text: str) -> None:
+        self._lpm.stimulus = text
+        self._lpm.ready_for_input.clear()
+        if self._interaction is None:
+            self._interaction = asyncio.create_task(self._lpm.start_interaction())
+
+    async def respond(self, text: str) -> str:
+        await self._submit(text)
+        await self._lpm.ready_for_input.wait()
+        return self._lpm._interaction_history.rsplit("You: ", 1)[-1].rstrip('\n')
+
+    async def close(self) -> None:
+        if self._interaction is None:
+            return
+        if self._end_session:
+            # Saves and summarizes the conversation, as a human ending it would
+            await self._submit(config.interaction_break)
+            await self._interaction
+        else:
+            self._interaction.cancel()
+
+class PFCTarget:
+    """
+    Sends conversation prompts built as in LanguageProcessingModule directly to the PFC.
+    """
+
+    def __init__(self, pfc, end_sessions: bool = False):
+        self._pfc = pfc
+
+    async def open_session(self):
+        return PFCSession(self._pfc)
+
+class PFCSession:
+    def __init__(self, pfc):
+        self._pfc = pfc
+        self._prompt = Stem.get_prompt("human_interaction")
+
+    async def respond(self, text: str) -> str:
+        self._prompt += f"{text} [/INST] "
+        response = await self._pfc.ainvoke(self._prompt, task='human_interaction')
+        self._prompt += f"{response}</s><s> [INST] "
+        return response
+
+    async def close(self) -> None:
+        pass
+
+TARGETS = {'lpm': LPMTarget, 'pfc': PFCTarget}
+
+async def replay(target, transcripts: list, sessions: int, concurrency: int, rate: float, think_time: float, max_turns: int, seed: int) -> dict:
+    """
+    Replays transcripts as sessions against a target.
+
+    Args:
+        target: Front-end providing open_session()
+        transcripts (list): User turns of each transcript
+        sessions (int): Number of sessions to run, transcripts are used round-robin
+        concurrency (int): Maximum number of sessions in progress
+        rate (float): Mean session arrival rate (per second), 0 to start them all at once
+        think_time (float): Pause between a response and the next user turn (in seconds)
+        max_turns (int): Maximum number of turns replayed per session, 0 for all
+        seed (int): Seed of the arrival times
+
+    Returns:
+        dict: Latency and throughput report
+    """
+
+    logger = logging.getLogger('Replay')
+    rng = random.Random(seed)
+    slots = asyncio.Semaphore(concurrency)
+    latencies = []
+    queueing = []
+    errors = []
+    in_flight = 0
+    peak_in_flight = 0
+
+    async def run_session(index: int, turns: list, arrived_at: float) -> None:
+        nonlocal in_flight, peak_in_flight
+        async with slots:
+            queueing.append(time.perf_counter() - arrived_at)
+            in_flight += 1
+            peak_in_flight = max(peak_in_flight, in_flight)
+            try:
+                session = await target.open_session()
+                for turn_index, turn in enumerate(turns[:max_turns or None]):
+                    if turn_index:
+                        await asyncio.sleep(think_time)
+                    sent_at = time.perf_counter()
+                    await session.respond(turn)
+                    latencies.append(time.perf_counter() - sent_at)
+                    logger.debug(f"Session {index}, turn {turn_index}: {latencies[-1]:.2f}s")
+                await session.close()
+            except Exception as e:
+                logger.error(f"Session {index} failed: {e}")
+                errors.append(f"{e.__class__.__name__}: {e}")
+            finally:
+                in_flight -= 1
+
+    started_at = time.perf_counter()
+    tasks = []
+    for index in range(sessions):
+        if rate and index:
+            await asyncio.sleep(rng.expovariate(rate))
+        tasks.append(asyncio.create_task(run_session(index, transcripts[index % len(transcripts)], time.perf_counter())))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started_at
+
+    return {'sessions': sessions,
+            'concurrency': concurrency,
+            'arrival_rate': rate,
+            'turns': len(latencies),
+            'errors': errors,
+            'elapsed_seconds': round(elapsed, 3),
+            'throughput_turns_per_second': round(len(latencies) / elapsed, 4) if elapsed else 0.0,
+            'peak_sessions_in_flight': peak_in_flight,
+            'latency_seconds': {'mean': round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+                                'p50': round(Stem.percentile(latencies, 0.5), 3),
+                                'p90': round(Stem.percentile(latencies, 0.9), 3),
+                                'p99': round(Stem.percentile(latencies, 0.99), 3),
+                                'max': round(max(latencies, default=0.0), 3)},
+            'session_queueing_seconds': {'p50': round(Stem.percentile(queueing, 0.5), 3),
+                                         'max': round(max(queueing, default=0.0), 3)}}
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays recorded conversations against the conversation front-end.")
+    parser.add_argument('--fixtures', default="conversations/_conversation_*.txt", help="Glob of transcripts to replay")
+    parser.add_argument('--target', default='pfc', help="Front-end: pfc, lpm or module:factory")
+    parser.add_argument('--sessions', type=int, default=20, help="Number of sessions")
+    parser.add_argument('--concurrency', type=int, default=1, help="Maximum number of concurrent sessions")
+    parser.add_argument('--rate', type=float, default=0.0, help="Mean session arrival rate per second, 0 for all at once")
+    parser.add_argument('--think-time', type=float, default=0.0, help="Pause between turns of a session (in seconds)")
+    parser.add_argument('--max-turns', type=int, default=0, help="Maximum number of turns per session, 0 for all")
+    parser.add_argument('--end-sessions', action='store_true', help="End sessions with the interaction break, saving them to memory")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of session arrival times")
+    parser.add_argument('--output', help="Path of the JSON report")
+    args = parser.parse_args()
+
+    logging_utils.setup_logging(file_log_level=config.file_log_level, console_log_level=config.console_log_level)
+
+    transcripts = [turns for turns in (parse_transcript(Stem.memory_read(path) or '') for path in sorted(glob(args.fixtures))) if turns]
+    if not transcripts:
+        raise SystemExit(f"No transcripts found matching {args.fixtures}")
+
+    from modules.PerceptiveFrameworkCore import PerceptiveFrameworkCore
+
+    pfc = PerceptiveFrameworkCore(config.model_path)
+    pfc.load()
+    if args.target in TARGETS:
+        target = TARGETS[args.target](pfc, end_sessions=args.end_sessions)
+    else:
+        module_name, factory_name = args.target.split(':')
+        target = getattr(importlib.import_module(module_name), factory_name)(pfc)
+
+    report = asyncio.run(replay(target, transcripts, args.sessions, args.concurrency, args.rate,
+                                args.think_time, args.max_turns, args.seed))
+    report['pfc'] = pfc.report()
+    print(json.dumps(report, indent=4, default=str))
+    if args.output:
+        Stem.memory_write(args.output, json.dumps(report, indent=4, default=str))
+
+if __name__ == '__main__':
+    main()
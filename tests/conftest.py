@@ -0,0 +1,33 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+# config has to be imported before the modules, it applies overrides through modules.Configuration
+import config
+from modules import logging_utils  # registers the custom log levels
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """
+    Runs each test in an empty working directory, so that memory files, caches, locks and logs
+    (relative paths in config) are created there instead of in the repository.
+    """
+
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+@pytest.fixture
+def prompt_templates(workdir):
+    """
+    Makes the repository's prompt templates available in the test working directory.
+    """
+
+    os.makedirs(workdir / "conversations", exist_ok=True)
+    shutil.copy(os.path.join(REPO_DIR, "conversations", "prompt_templates.json"), workdir / "conversations")
+    return workdir / "conversations" / "prompt_templates.json"
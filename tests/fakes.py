@@ -0,0 +1,64 @@
+"""
+Stand-ins for llama_cpp / langchain model objects, so that model-facing logic can be tested without a model.
+Texts are tokenized into whitespace separated words.
+"""
+
+
+class FakeClient:
+    """
+    Mimics the llama_cpp.Llama instance behind a langchain LlamaCpp model.
+    """
+
+    def __init__(self):
+        self.model = 'model'
+        self.ctx = 'ctx'
+        self.resets = 0
+
+    def reset(self):
+        self.resets += 1
+
+    def tokenize(self, text: bytes, add_bos: bool = False, special: bool = False) -> list:
+        return text.decode().split()
+
+    def detokenize(self, tokens: list, special: bool = False) -> bytes:
+        return (' '.join(tokens) + ' ').encode() if tokens else b''
+
+
+class FakeLLM:
+    """
+    Mimics a langchain LlamaCpp model answering every prompt with a fixed response.
+    """
+
+    def __init__(self, response: str = 'response', temperature: float = 1.0, max_tokens: int = 4000):
+        self.response = response
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.client = FakeClient()
+        self.calls = []
+
+    def invoke(self, prompt: str, **kwargs) -> str:
+        self.calls.append((prompt, kwargs))
+        return self.response
+
+    def stream(self, prompt: str, **kwargs):
+        self.calls.append((prompt, kwargs))
+        for word in self.response.split(' '):
+            yield word + ' '
+
+    def get_num_tokens(self, text: str) -> int:
+        return len(text.split())
+
+
+def loaded_pfc(response: str = 'response', n_ctx: int = 4096, draft_response: str = None):
+    """
+    Returns a PerceptiveFrameworkCore with fake models in place of loaded ones.
+    """
+
+    from modules.PerceptiveFrameworkCore import PerceptiveFrameworkCore
+
+    pfc = PerceptiveFrameworkCore('model.gguf')
+    pfc.llm = FakeLLM(response)
+    if draft_response is not None:
+        pfc.draft_llm = FakeLLM(draft_response)
+    pfc.n_ctx = n_ctx
+    return pfc
@@ -0,0 +1,93 @@
+import sys
+import types
+
+import numpy as np
+import pytest
+
+import config
+from modules.AnteriorCingulate import AnteriorCingulate
+from modules.ModelStore import ModelStore
+from modules.Stem import Stem
+
+VOCABULARY_SIZE = 50
+BOS = 1
+
+
+class FakeEvalLlama:
+    """
+    Model predicting every token with the same probability, recording the evaluated token sequences.
+    """
+
+    evaluated = []
+
+    def __init__(self, model_path, **kwargs):
+        self.scores = None
+
+    def tokenize(self, text, add_bos=False, special=False):
+        return ([BOS] if add_bos else []) + [2 + len(word) for word in text.decode().split()]
+
+    def reset(self):
+        pass
+
+    def eval(self, tokens):
+        FakeEvalLlama.evaluated.append(list(tokens))
+        self.scores = np.zeros((len(tokens), VOCABULARY_SIZE))
+
+
+@pytest.fixture
+def gate(workdir, monkeypatch):
+    module = types.ModuleType('llama_cpp')
+    module.Llama = FakeEvalLlama
+    monkeypatch.setitem(sys.modules, 'llama_cpp', module)
+    FakeEvalLlama.evaluated = []
+    return AnteriorCingulate(ModelStore(str(workdir / "model_store"), keep=1))
+
+
+def test_trim_middle_keeps_start_and_end():
+    tokens = list(range(20))
+
+    assert AnteriorCingulate._trim_middle(tokens, 8) == [0, 1, 14, 15, 16, 17, 18, 19]
+    assert AnteriorCingulate._trim_middle(tokens, 20) == tokens
+
+
+def test_score_keeps_bos_of_long_probes(gate, monkeypatch):
+    monkeypatch.setattr(config, 'eval_probe_tokens', 8)
+    probe = {'prompt': ' '.join(['instruction'] * 4 + ['history'] * 20 + ['question']),
+             'continuation': 'an answer of more than eight words in a row'}
+    monkeypatch.setattr(gate, 'probes', lambda: [probe])
+
+    scores = gate.score('model.gguf')
+
+    evaluated = FakeEvalLlama.evaluated[0]
+    assert evaluated[0] == BOS
+    assert evaluated[7] == 2 + len('question')
+    assert len(evaluated) == 16
+    assert scores['perplexity'] == pytest.approx(VOCABULARY_SIZE)
+    assert scores['tokens'] == 16
+
+
+def test_gate_rolls_back_regressed_model(gate, workdir, monkeypatch):
+    model_path = workdir / "model.gguf"
+    model_path.write_bytes(b'previous weights')
+    gate.store.shelve(str(model_path))
+    gate.store.record_scores(gate.store.latest()['fingerprint'], {'perplexity': 10.0, 'ms_per_token': 1.0})
+    model_path.write_bytes(b'regressed weights')
+    monkeypatch.setattr(gate, 'probes', lambda: [{'prompt': '', 'continuation': 'text'}])
+    monkeypatch.setattr(gate, 'score', lambda path: {'perplexity': 12.0, 'ms_per_token': 1.0})
+
+    assert not gate.gate(str(model_path))
+    assert model_path.read_bytes() == b'previous weights'
+    assert gate.store.scores(Stem.model_fingerprint(str(model_path)))['perplexity'] == 10.0
+
+
+def test_gate_accepts_comparable_model(gate, workdir, monkeypatch):
+    model_path = workdir / "model.gguf"
+    model_path.write_bytes(b'previous weights')
+    gate.store.shelve(str(model_path))
+    gate.store.record_scores(gate.store.latest()['fingerprint'], {'perplexity': 10.0, 'ms_per_token': 1.0})
+    model_path.write_bytes(b'finetuned weights')
+    monkeypatch.setattr(gate, 'probes', lambda: [{'prompt': '', 'continuation': 'text'}])
+    monkeypatch.setattr(gate, 'score', lambda path: {'perplexity': 10.5, 'ms_per_token': 1.1})
+
+    assert gate.gate(str(model_path))
+    assert model_path.read_bytes() == b'finetuned weights'
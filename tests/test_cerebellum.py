@@ -0,0 +1,69 @@
+import struct
+
+import config
+from modules.Cerebellum import Cerebellum, WORKLOAD_SHAPES
+
+
+def gguf_string(text):
+    data = text.encode()
+    return struct.pack('<Q', len(data)) + data
+
+
+def write_gguf(path, metadata, weights=b''):
+    header = b'GGUF' + struct.pack('<I', 3) + struct.pack('<Q', 0) + struct.pack('<Q', len(metadata))
+    for key, (value_type, value) in metadata.items():
+        header += gguf_string(key) + struct.pack('<I', value_type)
+        if value_type == 8:
+            header += gguf_string(value)
+        elif value_type == 9:
+            header += struct.pack('<I', 4) + struct.pack('<Q', len(value)) + b''.join(struct.pack('<I', item) for item in value)
+        else:
+            header += struct.pack('<I', value)
+    path.write_bytes(header + weights)
+
+
+def test_gguf_metadata_skips_unrequested_keys(workdir):
+    model_path = workdir / "model.gguf"
+    write_gguf(model_path, {'general.name': (8, 'test'),
+                            'tokenizer.ids': (9, [1, 2, 3]),
+                            'general.architecture': (8, 'llama'),
+                            'general.file_type': (4, 15)})
+
+    metadata = Cerebellum._gguf_metadata(str(model_path), ('general.architecture', 'general.file_type'))
+
+    assert metadata == {'general.architecture': 'llama', 'general.file_type': 15}
+
+
+def test_gguf_metadata_of_other_files_is_empty(workdir):
+    model_path = workdir / "model.bin"
+    model_path.write_bytes(b'not a gguf file')
+
+    assert Cerebellum._gguf_metadata(str(model_path), ('general.architecture',)) == {}
+
+
+def test_model_signature_ignores_weights(workdir):
+    metadata = {'general.architecture': (8, 'llama'), 'general.file_type': (4, 15)}
+    write_gguf(workdir / "base.gguf", metadata, weights=b'\x00' * 64)
+    write_gguf(workdir / "finetuned.gguf", metadata, weights=b'\x01' * 64)
+    write_gguf(workdir / "requantized.gguf", {**metadata, 'general.file_type': (4, 7)}, weights=b'\x00' * 64)
+
+    base = Cerebellum.model_signature(str(workdir / "base.gguf"))
+
+    assert base.startswith('llama|15|')
+    assert Cerebellum.model_signature(str(workdir / "finetuned.gguf")) == base
+    assert Cerebellum.model_signature(str(workdir / "requantized.gguf")) != base
+
+
+def test_runtime_params_are_cached_per_signature(workdir, monkeypatch):
+    write_gguf(workdir / "model.gguf", {'general.architecture': (8, 'llama')})
+    monkeypatch.setattr(config, 'runtime_autotune', True)
+    monkeypatch.setattr(config, 'runtime_calibration_path', str(workdir / "calibration.json"))
+    cerebellum = Cerebellum(str(workdir / "model.gguf"))
+    calibrations = []
+    monkeypatch.setattr(cerebellum, '_calibrate', lambda: calibrations.append(1) or {workload: {'n_batch': 256} for workload in WORKLOAD_SHAPES})
+
+    first = cerebellum.runtime_params()
+    second = Cerebellum(str(workdir / "model.gguf")).runtime_params()
+
+    assert first == second
+    assert len(calibrations) == 1
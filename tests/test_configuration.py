@@ -0,0 +1,101 @@
+import json
+
+import pytest
+
+import config
+from modules.Configuration import Configuration
+
+
+@pytest.fixture
+def overrides(workdir, monkeypatch):
+    """
+    Writes the override file, restoring settings changed by reloads and the reload state after the test.
+    """
+
+    for name in ('model_temp', 'dmn_countdown', 'inference_backend'):
+        monkeypatch.setattr(config, name, getattr(config, name))
+        monkeypatch.delenv(f"{config.config_env_prefix}{name.upper()}", raising=False)
+    monkeypatch.setattr(Configuration, '_subscribers', [])
+    monkeypatch.setattr(Configuration, '_sources', {})
+    monkeypatch.setattr(Configuration, '_file_mtime', None)
+
+    def write(settings):
+        (workdir / config.config_override_path).write_text(json.dumps(settings))
+    return write
+
+
+def test_validate_coerces_and_checks_values():
+    assert Configuration.validate('model_temp', 1) == 1.0
+    with pytest.raises(ValueError, match="at most"):
+        Configuration.validate('model_temp', 3)
+    with pytest.raises(ValueError, match="type int"):
+        Configuration.validate('dmn_countdown', True)
+    with pytest.raises(ValueError, match="one of"):
+        Configuration.validate('inference_backend', 'cloud')
+    with pytest.raises(ValueError, match="unknown settings"):
+        Configuration.validate('profiles', {'chat': {'n_gpu_layers': 10}})
+
+
+def test_validate_fills_profiles():
+    profiles = Configuration.validate('profiles', {'chat': {'n_threads': 4}})
+
+    assert profiles['chat']['n_threads'] == 4
+    assert profiles['chat']['temperature'] is None
+
+
+def test_reload_applies_live_settings_only(overrides):
+    changes = []
+    Configuration.subscribe(lambda applied: changes.append(applied))
+    backend = config.inference_backend
+    overrides({'model_temp': 0.5, 'inference_backend': 'server'})
+
+    assert Configuration.reload() == {'model_temp': 0.5}
+    assert config.model_temp == 0.5
+    # Structural settings need a restart
+    assert config.inference_backend == backend
+    assert changes == [{'model_temp': 0.5}]
+
+
+def test_environment_takes_precedence_over_file(overrides, monkeypatch):
+    overrides({'model_temp': 0.5})
+    monkeypatch.setenv(f"{config.config_env_prefix}MODEL_TEMP", '0.25')
+
+    Configuration.reload()
+
+    assert config.model_temp == 0.25
+    assert Configuration._sources['model_temp'] == f"{config.config_env_prefix}MODEL_TEMP"
+
+
+def test_invalid_reload_is_rejected_as_a_whole(overrides):
+    temperature, countdown = config.model_temp, config.dmn_countdown
+    overrides({'model_temp': 0.5, 'dmn_countdown': -1})
+
+    assert Configuration.reload() == {}
+    assert (config.model_temp, config.dmn_countdown) == (temperature, countdown)
+
+
+def test_unknown_override_is_rejected(overrides):
+    overrides({'model_tmep': 0.5})
+
+    assert Configuration.reload() == {}
+
+
+def test_collected_subscribers_are_dropped(overrides):
+    class Subscriber:
+        def __init__(self):
+            self.changes = []
+
+        def apply(self, changes):
+            self.changes.append(changes)
+
+    subscriber = Subscriber()
+    Configuration.subscribe(subscriber.apply)
+    overrides({'model_temp': 0.5})
+    Configuration.reload()
+    assert subscriber.changes == [{'model_temp': 0.5}]
+
+    del subscriber
+    overrides({'model_temp': 0.75})
+    Configuration.reload()
+
+    assert Configuration._subscribers == []
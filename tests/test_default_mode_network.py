@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+import config
+from modules.DefaultModeNetwork import DefaultModeNetwork
+
+
+class FakePFC:
+    """
+    PFC answering each task with a fixed response, setting an event after a given number of analyses.
+    """
+
+    n_ctx = None
+
+    def __init__(self, responses, engage_after=None, engaged=None):
+        self.responses = responses
+        self.calls = []
+        self._engage_after = engage_after
+        self._engaged = engaged
+
+    async def ainvoke(self, prompt, task=None, **kwargs):
+        self.calls.append((task, prompt))
+        if task == 'perspective_explanation' and self._engage_after is not None:
+            self._engage_after -= 1
+            if not self._engage_after:
+                self._engaged.set()
+        return self.responses[task]
+
+    def tokenize(self, text):
+        return text.split()
+
+    def generation_params(self, task):
+        return {}
+
+
+@pytest.fixture
+def conversations(prompt_templates, workdir):
+    def save(name, text, keywords, dmn):
+        path = workdir / "conversations" / name
+        path.write_text(text)
+        dmn.stm.memorize_keywords(keywords, str(path))
+        return str(path)
+    return save
+
+
+@pytest.fixture
+def events():
+    return asyncio.Event(), asyncio.Event()
+
+
+def make_dmn(pfc, events):
+    overwhelmed, engaged = events
+    return DefaultModeNetwork(pfc, overwhelmed, engaged)
+
+
+def test_backlog_is_drained_cluster_by_cluster(conversations, events, monkeypatch):
+    monkeypatch.setattr(config, 'dmn_batch_mode', True)
+    monkeypatch.setattr(config, 'hippocampus_results', 0)
+    pfc = FakePFC({'perspective_explanation': 'A new perspective.'})
+    dmn = make_dmn(pfc, events)
+    conversations('conversation_20240101120000.txt', 'About dreams and sleep', ['dreams', 'sleep'], dmn)
+    conversations('conversation_20240102120000.txt', 'About music', ['music'], dmn)
+
+    assert asyncio.run(dmn.ponder())
+
+    analyzed = [prompt for task, prompt in pfc.calls if task == 'perspective_explanation']
+    assert len(analyzed) == 2 and 'About dreams and sleep' in analyzed[0] and 'About music' in analyzed[1]
+    assert dmn.stm.recall_all_keywords() is None
+    assert dmn.metrics['drained_clusters'] == 2 and dmn.metrics['remaining_keywords'] == 0
+    assert events[0].is_set()
+
+
+def test_backlog_stops_when_engaged(conversations, events, monkeypatch):
+    monkeypatch.setattr(config, 'dmn_batch_mode', True)
+    monkeypatch.setattr(config, 'hippocampus_results', 0)
+    pfc = FakePFC({'perspective_explanation': 'A new perspective.'}, engage_after=1, engaged=events[1])
+    dmn = make_dmn(pfc, events)
+    conversations('conversation_20240101120000.txt', 'About dreams and sleep', ['dreams', 'sleep'], dmn)
+    conversations('conversation_20240102120000.txt', 'About music', ['music'], dmn)
+
+    asyncio.run(dmn.ponder())
+
+    assert dmn.stm.recall_all_keywords() == ['music']
+    assert dmn.metrics['drained_keywords'] == 2 and dmn.metrics['remaining_keywords'] == 1
+
+
+def test_uninspiring_conclusion_is_archived_without_overwhelming(conversations, events, workdir, monkeypatch):
+    monkeypatch.setattr(config, 'dmn_batch_mode', True)
+    monkeypatch.setattr(config, 'hippocampus_results', 0)
+    pfc = FakePFC({'perspective_explanation': 'Nothing new. **Uninspiring**'})
+    dmn = make_dmn(pfc, events)
+    conversations('conversation_20240101120000.txt', 'About dreams', ['dreams'], dmn)
+
+    asyncio.run(dmn.ponder())
+
+    assert not list((workdir / config.conclusions_dir).glob("conclusion_*"))
+    assert len(list((workdir / f"{config.conclusions_dir}_archive").glob("conclusion_*"))) == 1
+    assert not events[0].is_set()
+    assert dmn.stm.recall_all_keywords() is None
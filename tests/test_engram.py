@@ -0,0 +1,106 @@
+import json
+import os
+
+import pytest
+
+from modules.Engram import Engram, DreamWriter
+
+VOCABULARY = ['<s>', '[INST]', '[/INST]', '</s>', 'what', 'is', 'a', 'dream', 'story', 'of', 'the', 'night']
+
+
+def tokenize(text):
+    return [VOCABULARY.index(word) for word in text.split()]
+
+
+def detokenize(tokens):
+    return ' '.join(VOCABULARY[token] for token in tokens)
+
+
+def test_write_and_read_samples(workdir):
+    meta = Engram.write(str(workdir / "dreams"), [[0, 4, 5], [], [0, 70000]])
+
+    engram = Engram(str(workdir / "dreams"))
+
+    assert meta == {'dtype': 'uint32', 'samples': 3, 'tokens': 5}
+    assert engram.meta == meta
+    assert len(engram) == 3
+    assert [list(engram[i]) for i in range(3)] == [[0, 4, 5], [], [0, 70000]]
+
+
+def test_small_vocabulary_uses_uint16(workdir):
+    assert Engram.write(str(workdir / "dreams"), [[1, 2]])['dtype'] == 'uint16'
+
+
+def test_empty_dataset(workdir):
+    Engram.write(str(workdir / "empty"), [])
+
+    assert len(Engram(str(workdir / "empty"))) == 0
+
+
+def test_missing_dataset_raises(workdir):
+    with pytest.raises(FileNotFoundError):
+        Engram(str(workdir / "missing"))
+
+
+def test_text_roundtrip_keeps_sample_order(workdir):
+    samples = ["<s> [INST] what is a dream [/INST] a story of the night </s>",
+               "<s> [INST] what is the night [/INST] a dream </s>"]
+    (workdir / "dreams.txt").write_text('\n'.join(samples) + '\n')
+
+    engram = Engram.from_text(str(workdir / "dreams.txt"), tokenize)
+    engram.to_text(str(workdir / "rendered.txt"), detokenize)
+
+    assert (workdir / "rendered.txt").read_text().splitlines() == samples
+    assert json.loads((workdir / "dreams.engram.json").read_text())['samples'] == 2
+
+
+def test_dreams_are_written_in_batches(workdir):
+    writer = DreamWriter(str(workdir / "dreams.txt"), batch_size=2)
+
+    writer.write("first dream")
+    assert os.path.getsize(writer.temp_path) == 0
+    writer.write("second dream")
+    assert open(writer.temp_path).read() == "first dream\nsecond dream\n"
+    writer.close()
+
+
+def test_committed_dataset_is_verified(workdir):
+    dataset_path = str(workdir / "dreams.txt")
+    writer = DreamWriter(dataset_path, batch_size=10)
+    writer.write("first dream")
+    assert DreamWriter.verify(dataset_path) is None
+
+    manifest = writer.commit({'generated': 1})
+
+    assert not os.path.exists(writer.temp_path)
+    assert open(dataset_path).read() == "first dream\n"
+    assert manifest['dreams'] == 1 and manifest['bytes'] == len("first dream\n") and manifest['generation'] == {'generated': 1}
+    assert DreamWriter.verify(dataset_path) == manifest
+
+    with open(dataset_path, 'a') as file:
+        file.write("tampered\n")
+    assert DreamWriter.verify(dataset_path) is None
+
+
+def test_interrupted_dataset_is_continued(workdir):
+    dataset_path = str(workdir / "dreams.txt")
+    writer = DreamWriter(dataset_path, batch_size=10)
+    writer.write("first dream")
+    writer.write("second dream")
+    writer.close()
+    assert not os.path.exists(dataset_path)
+
+    writer = DreamWriter(dataset_path, resumed_dreams=2, batch_size=10)
+    writer.write("third dream")
+    manifest = writer.commit()
+
+    assert open(dataset_path).read() == "first dream\nsecond dream\nthird dream\n"
+    assert manifest['dreams'] == 3
+    assert DreamWriter.verify(dataset_path) == manifest
+
+
+def test_missing_partial_dataset_starts_over(workdir):
+    writer = DreamWriter(str(workdir / "dreams.txt"), resumed_dreams=5, batch_size=10)
+
+    assert writer.dreams == 0 and writer.bytes == 0
+    writer.close()
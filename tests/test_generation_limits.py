@@ -0,0 +1,54 @@
+import pytest
+
+import config
+
+from fakes import loaded_pfc
+
+
+@pytest.fixture(autouse=True)
+def min_tokens(monkeypatch):
+    monkeypatch.setattr(config, 'generation_min_tokens', 8)
+
+
+def words(start, stop):
+    return ' '.join(f"w{i}" for i in range(start, stop))
+
+
+def test_prompt_fitting_the_context_is_kept():
+    pfc = loaded_pfc(n_ctx=100)
+
+    assert pfc._fit_context(words(0, 10), '', 50, 'task') == (words(0, 10), 50)
+
+
+def test_generation_is_capped_by_the_context():
+    pfc = loaded_pfc(n_ctx=100)
+
+    assert pfc._fit_context(words(0, 70), '', 50, 'task') == (words(0, 70), 30)
+
+
+def test_resumed_text_counts_against_the_limit():
+    pfc = loaded_pfc(n_ctx=100)
+
+    assert pfc._fit_context(words(0, 10), 'already generated text', 50, 'task')[1] == 47
+    assert pfc._fit_context(words(0, 85), 'already generated text', 50, 'task')[1] == 12
+
+
+def test_oversized_prompt_is_trimmed_in_the_middle():
+    pfc = loaded_pfc(n_ctx=40)
+
+    prompt, max_tokens = pfc._fit_context(words(0, 60), '', 50, 'task')
+
+    # 32 tokens are kept, a quarter of them from the start, leaving generation_min_tokens free
+    assert prompt.split() == words(0, 8).split() + words(36, 60).split()
+    assert max_tokens == 8
+
+
+def test_template_limits_apply_without_temperature(prompt_templates):
+    pfc = loaded_pfc('keywords')
+
+    pfc.invoke('prompt', task='keyword_generation')
+
+    kwargs = pfc.llm.calls[0][1]
+    assert kwargs['max_tokens'] == 128 and kwargs['stop'] == ['[INST]']
+    # Keyword and perspective tasks sample at the configured model temperature
+    assert 'temperature' not in kwargs
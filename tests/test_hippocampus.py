@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+import config
+from modules.Hippocampus import Hippocampus
+
+
+@pytest.fixture
+def conversations_dir(workdir):
+    directory = workdir / "conversations"
+    directory.mkdir(exist_ok=True)
+    return directory
+
+
+@pytest.fixture
+def hippocampus(workdir, conversations_dir):
+    return Hippocampus(str(workdir / "memory" / "hippocampus.sqlite"), str(conversations_dir))
+
+
+def save(directory, name, text, mtime=None):
+    path = directory / name
+    path.write_text(text)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return str(path)
+
+
+def test_search_ranks_conversations_by_content(hippocampus, conversations_dir):
+    dreams = save(conversations_dir, "conversation_20240101120000.txt", "User: I dreamt of dreams within dreams.\nYou: Dreams are fascinating.")
+    music = save(conversations_dir, "conversation_20240102120000.txt", "User: Do you like music?\nYou: I like music about dreams.")
+    hippocampus.sync()
+
+    assert [path for path, _ in hippocampus.search("dreaming")] == [dreams, music]
+    assert [path for path, _ in hippocampus.search("music", limit=1)] == [music]
+
+
+def test_speaker_labels_and_operators_are_not_searched(hippocampus, conversations_dir):
+    save(conversations_dir, "conversation_20240101120000.txt", "User: Hello\nYou: Hi")
+    hippocampus.sync()
+
+    assert hippocampus.search("user") == []
+    assert hippocampus.search("hello OR (") != []
+    assert hippocampus.search("?!") == []
+
+
+def test_sync_indexes_only_changed_conversations(hippocampus, conversations_dir):
+    first = save(conversations_dir, "conversation_20240101120000.txt", "About sleep", mtime=1000)
+    save(conversations_dir, "conversation_20240102120000.txt", "About music", mtime=1000)
+    save(conversations_dir, "notes.txt", "About sleep")
+
+    assert hippocampus.sync() == 2
+    assert hippocampus.sync() == 0
+
+    save(conversations_dir, "conversation_20240101120000.txt", "About dreams", mtime=2000)
+    os.remove(conversations_dir / "conversation_20240102120000.txt")
+
+    assert hippocampus.sync() == 2
+    assert [path for path, _ in hippocampus.search("dreams")] == [first]
+    assert hippocampus.search("sleep music") == []
+
+
+def test_remembered_conversations_are_not_reindexed(hippocampus, conversations_dir):
+    path = save(conversations_dir, "conversation_20240101120000.txt", "About sleep")
+
+    hippocampus.remember(path)
+
+    assert hippocampus.sync() == 0
+    hippocampus.forget(path)
+    assert hippocampus.search("sleep") == []
+
+
+def test_search_limit_defaults_to_config(hippocampus, conversations_dir, monkeypatch):
+    for day in range(1, 4):
+        save(conversations_dir, f"conversation_2024010{day}120000.txt", "About sleep")
+    hippocampus.sync()
+
+    monkeypatch.setattr(config, 'hippocampus_results', 2)
+
+    assert len(hippocampus.search("sleep")) == 2
@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+import config
+from modules.Hypothalamus import Hypothalamus
+
+GIB = 1 << 30
+
+
+@pytest.fixture
+def governor(monkeypatch):
+    """
+    Governor of a host with 8 GiB available and a process using 1 GiB, within a 16 GiB budget.
+    """
+
+    monkeypatch.setattr(Hypothalamus, '_meminfo', staticmethod(lambda field: 8 * GIB))
+    monkeypatch.setattr(Hypothalamus, 'rss', lambda self, pid=None: 1 * GIB)
+    monkeypatch.setattr(config, 'finetune_memory_factor', 1.5)
+    return Hypothalamus(asyncio.Event(), memory_budget_bytes=16 * GIB)
+
+
+def model_of_size(workdir, size):
+    path = workdir / "model.gguf"
+    with open(path, 'wb') as file:
+        file.truncate(size)
+    return str(path)
+
+
+def test_finetuning_starts_when_it_fits(governor, workdir):
+    assert governor.plan_finetuning(model_of_size(workdir, 4 * GIB)) == 'start'
+    assert governor.decisions[-1]['decision'] == 'start'
+
+
+def test_finetuning_unloads_resident_model_when_needed(governor, workdir):
+    model_path = model_of_size(workdir, 6 * GIB)
+
+    assert governor.plan_finetuning(model_path, resident_model=True) == 'unload_model'
+    assert governor.plan_finetuning(model_path, resident_model=False) == 'refuse'
+
+
+def test_finetuning_is_refused_while_engaged(governor, workdir):
+    governor.engaged.set()
+
+    assert governor.plan_finetuning(model_of_size(workdir, GIB)) == 'refuse'
+    assert governor.decisions[-1]['reason'] == 'interaction in progress'
+
+
+def test_budget_limits_available_memory(governor, workdir):
+    governor.memory_budget = 4 * GIB
+
+    assert governor.plan_finetuning(model_of_size(workdir, 2 * GIB + GIB // 2), resident_model=False) == 'refuse'
+
+
+def test_finetune_threads_leave_interactive_threads(governor, monkeypatch):
+    monkeypatch.setattr(config, 'available_threads', 16)
+    monkeypatch.setattr(config, 'finetune_max_threads', 0)
+    monkeypatch.setattr(config, 'profiles', {})
+
+    assert governor.finetune_threads(interactive_threads=4) == 12
+    assert governor.finetune_threads(interactive_threads=32) == 1
+
+    monkeypatch.setattr(config, 'finetune_max_threads', 8)
+    assert governor.finetune_threads() == 8
+
+    monkeypatch.setattr(config, 'profiles', {'finetune': {'n_threads': 6}})
+    assert governor.finetune_threads() == 6
+
+
+def test_usage_is_attributed_to_modes(governor):
+    with governor.enter('rem'):
+        assert governor.mode == 'rem'
+    governor.engaged.set()
+    assert governor.mode == 'engaged'
+    governor.engaged.clear()
+
+    usage = governor.metrics()['usage']
+
+    assert usage['rem']['peak_rss'] == GIB
+    assert 'idle' in usage
+
+
+def test_over_budget_usage_is_recorded(governor):
+    governor.memory_budget = GIB // 2
+
+    governor.sample()
+
+    assert governor.decisions[-1]['decision'] == 'over_budget'
+
+
+def test_evaluation_fits_after_unloading_resident_model(governor, workdir, monkeypatch):
+    monkeypatch.setattr(config, 'eval_memory_factor', 1.2)
+    model_path = model_of_size(workdir, 6 * GIB)
+
+    assert governor.plan_evaluation(model_path, resident_model=False) == 'start'
+    governor.memory_budget = 6 * GIB
+    assert governor.plan_evaluation(model_path, resident_model=True) == 'unload_model'
+    assert governor.plan_evaluation(model_path, resident_model=False) == 'refuse'
@@ -0,0 +1,100 @@
+import http.client
+import json
+import socket
+
+import pytest
+
+from modules.InferenceServer import InferenceServerClient
+
+
+class FakeResponse:
+    def __init__(self, payload, status=200):
+        self.status = status
+        self._data = json.dumps(payload).encode()
+
+    def read(self):
+        return self._data
+
+
+class FakeConnection:
+    def __init__(self, outcomes):
+        self.outcomes = outcomes
+        self.requests = []
+        self.closed = False
+
+    def request(self, method, path, body=None, headers=None):
+        self.requests.append((method, path, body))
+
+    def getresponse(self):
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(InferenceServerClient, '_ensure_server', lambda self: None)
+    client = InferenceServerClient('http://localhost:8080', pool_size=1)
+    client.opened = []
+
+    def connect():
+        connection = FakeConnection(client.outcomes.pop(0))
+        client.opened.append(connection)
+        return connection
+
+    monkeypatch.setattr(client, '_connect', connect)
+    return client
+
+
+def completion(text):
+    return FakeResponse({'choices': [{'text': text}]})
+
+
+def test_connections_are_reused(client):
+    client.outcomes = [[completion('a'), completion('b')]]
+
+    assert client.invoke('prompt') == 'a'
+    assert client.invoke('prompt') == 'b'
+    assert len(client.opened) == 1
+
+
+def test_stale_reused_connection_is_reopened(client):
+    client.outcomes = [[completion('a'), http.client.RemoteDisconnected()], [completion('b')]]
+    client.invoke('prompt')
+
+    assert client.invoke('prompt') == 'b'
+    assert len(client.opened) == 2
+    assert len(client.opened[1].requests) == 1
+
+
+def test_new_connection_failure_is_not_retried(client):
+    client.outcomes = [[http.client.RemoteDisconnected()]]
+
+    with pytest.raises(http.client.RemoteDisconnected):
+        client.invoke('prompt')
+    assert len(client.opened) == 1
+
+
+def test_timed_out_request_is_not_resent(client):
+    client.outcomes = [[completion('a'), socket.timeout()], [completion('b')]]
+    client.invoke('prompt')
+
+    with pytest.raises(TimeoutError):
+        client.invoke('prompt')
+
+    assert len(client.opened) == 1
+    assert len(client.opened[0].requests) == 2
+    assert client.opened[0].closed
+    # The timed out connection is dropped from the pool
+    assert client.invoke('prompt') == 'b'
+
+
+def test_server_errors_are_raised(client):
+    client.outcomes = [[FakeResponse({'error': 'overloaded'}, status=503)]]
+
+    with pytest.raises(RuntimeError, match='503'):
+        client.invoke('prompt')
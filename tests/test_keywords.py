@@ -0,0 +1,46 @@
+import re
+
+import config
+from modules.Stem import Stem
+
+
+def test_extract_keywords_from_json_list():
+    assert Stem.extract_keywords('["Neural Networks", " **memory** ", ""]') == ['neural networks', 'memory']
+
+
+def test_extract_keywords_from_starred_text():
+    raw_output = "Keywords: **Dreams**, **long term memory** and nothing else."
+
+    assert Stem.extract_keywords(raw_output) == ['dreams', 'long term memory']
+
+
+def test_extract_keywords_falls_back_for_non_list_json():
+    assert Stem.extract_keywords('{"keyword": "x"}') == []
+
+
+def test_keywords_grammar_bounds_list_length():
+    grammar = Stem.keywords_grammar(max_keywords=3)
+    rules = dict(line.split(' ::= ', 1) for line in grammar.splitlines())
+
+    assert rules['root'] == '"[" ( keyword more1 )? "]"'
+    assert rules['more1'] == '( ", " keyword more2 )?'
+    assert rules['more2'] == '( ", " keyword )?'
+    assert 'more3' not in rules
+
+
+def test_keywords_grammar_single_keyword():
+    rules = dict(line.split(' ::= ', 1) for line in Stem.keywords_grammar(max_keywords=1).splitlines())
+
+    assert rules['root'] == '"[" keyword? "]"'
+    assert not any(name.startswith('more') for name in rules)
+
+
+def test_keywords_prompt_matches_output_format(prompt_templates, monkeypatch):
+    for key in ('keyword_generation', 'keyword_selection'):
+        monkeypatch.setattr(config, 'structured_keywords', False)
+        assert '**keyword**' in Stem.get_keywords_prompt(key)
+
+        monkeypatch.setattr(config, 'structured_keywords', True)
+        structured_prompt = Stem.get_keywords_prompt(key)
+        assert '**' not in structured_prompt
+        assert re.search(r'\["keyword", "another keyword"\]', structured_prompt)
@@ -0,0 +1,124 @@
+import gzip
+import logging
+import os
+import time
+
+import pytest
+
+import config
+from modules import logging_utils
+from modules.logging_utils import LogIndex, SegmentedFileHandler, compress_segment, prune_logs, slice_logs
+
+DAY = 86400
+
+
+@pytest.fixture
+def session_logger(workdir, monkeypatch):
+    """
+    Dedicated logger writing through a session handler, closed after the test.
+    """
+
+    os.makedirs(config.log_dir, exist_ok=True)
+    handler = SegmentedFileHandler(config.log_dir, '20240101_120000')
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    monkeypatch.setattr(logging_utils, '_segmented_handler', handler)
+    logger = logging.getLogger('test_logging_utils')
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(handler)
+    yield logger
+    logger.removeHandler(handler)
+    handler.close()
+
+
+def test_slices_contain_lines_of_their_mode(session_logger):
+    logging_utils.mark_mode('dmn')
+    session_logger.info("pondering")
+    session_logger.info("still pondering")
+    logging_utils.mark_mode('rem')
+    session_logger.info("dreaming")
+
+    dmn_lines = list(slice_logs(mode='dmn'))
+    rem_lines = list(slice_logs(mode='rem'))
+
+    assert [line.rsplit(' - ', 1)[1] for line in dmn_lines] == ["pondering", "still pondering"]
+    assert [line.rsplit(' - ', 1)[1] for line in rem_lines] == ["dreaming"]
+
+
+def test_slices_are_found_in_compressed_segments(session_logger, workdir):
+    logging_utils.mark_mode('interaction')
+    session_logger.info("hello\nmultiline")
+    segment = session_logger.handlers[0].baseFilename
+    session_logger.handlers[0].close()
+
+    compress_segment(segment)
+
+    assert not os.path.exists(segment)
+    assert [line.rsplit(' - ', 1)[-1] for line in slice_logs(mode='interaction')] == ["hello", "multiline"]
+
+
+def test_failed_emit_writes_nothing(session_logger, monkeypatch):
+    session_handler = session_logger.handlers[0]
+    monkeypatch.setattr(logging, 'raiseExceptions', False)
+    monkeypatch.setattr(session_handler, '_should_rollover', lambda: 1 / 0)
+
+    session_logger.info("lost")
+
+    session_handler.flush()
+    with open(session_handler.baseFilename) as file:
+        assert "lost" not in file.read()
+
+
+def segment_of_age(name, days, size=10):
+    path = os.path.abspath(os.path.join(config.log_dir, name))
+    with gzip.open(path, 'wb') as file:
+        file.write(os.urandom(size))
+    then = time.time() - days * DAY
+    os.utime(path, (then, then))
+    return path
+
+
+@pytest.fixture
+def retention(workdir, monkeypatch):
+    os.makedirs(config.log_dir, exist_ok=True)
+    monkeypatch.setattr(logging_utils, '_segmented_handler', None)
+    monkeypatch.setattr(config, 'log_retention_days', 30)
+    monkeypatch.setattr(config, 'log_retention_bytes', 0)
+    monkeypatch.setattr(config, 'log_finetuning_keep', 1)
+
+
+def test_prune_removes_expired_segments_and_archives(retention):
+    expired = segment_of_age("log_20240101_120000_0000.log.gz", 40)
+    recent = segment_of_age("log_20240301_120000_0000.log.gz", 1)
+    archives = [os.path.abspath(os.path.join(config.log_dir, f"finetuning_{i}")) for i in range(2)]
+    for days, archive in zip((3, 2), archives):
+        os.makedirs(archive)
+        os.utime(archive, (time.time() - days * DAY,) * 2)
+
+    assert sorted(prune_logs()) == sorted([expired, archives[0]])
+    assert os.path.exists(recent) and os.path.exists(archives[1])
+
+
+def test_prune_removes_oldest_segments_over_size_limit(retention, monkeypatch):
+    oldest = segment_of_age("log_20240101_120000_0000.log.gz", 3, size=4096)
+    middle = segment_of_age("log_20240102_120000_0000.log.gz", 2, size=4096)
+    newest = segment_of_age("log_20240103_120000_0000.log.gz", 1, size=4096)
+    monkeypatch.setattr(config, 'log_retention_bytes', os.path.getsize(newest) + os.path.getsize(middle))
+
+    assert prune_logs() == [oldest]
+    assert os.path.exists(middle) and os.path.exists(newest)
+
+
+def test_prune_compresses_stale_segments_of_other_sessions(retention):
+    paths = [os.path.abspath(os.path.join(config.log_dir, f"log_2024010{day}_120000_0000.log")) for day in (1, 2)]
+    for path in paths:
+        with open(path, 'w') as file:
+            file.write("2024-01-01 12:00:00,000 - INFO - line\n")
+    stale = time.time() - config.log_stale_seconds - 60
+    os.utime(paths[0], (stale, stale))
+
+    prune_logs()
+
+    # The recently written segment may still belong to a running session
+    assert not os.path.exists(paths[0]) and os.path.exists(f"{paths[0]}.gz")
+    assert os.path.exists(paths[1])
@@ -0,0 +1,104 @@
+import sys
+import types
+
+import pytest
+
+import config
+from modules.Stem import Stem
+from modules.PerceptiveFrameworkCore import PerceptiveFrameworkCore
+
+
+class FakeClient:
+    def __init__(self):
+        self.model = 'model'
+        self.ctx = 'ctx'
+        self.resets = 0
+
+    def reset(self):
+        self.resets += 1
+
+
+def fake_llama_cpp(monkeypatch, legacy=False):
+    calls = []
+    module = types.ModuleType('llama_cpp')
+    if legacy:
+        module.llama_model_apply_lora_from_file = lambda model, path, scale, base, threads: calls.append(('merge', path, scale)) or 0
+    else:
+        module.llama_adapter_lora_init = lambda model, path: calls.append(('init', path)) or f"handle:{path.decode()}"
+        module.llama_set_adapter_lora = lambda ctx, handle, scale: calls.append(('set', handle, scale)) or 0
+    monkeypatch.setitem(sys.modules, 'llama_cpp', module)
+    return calls
+
+
+@pytest.fixture
+def pfc(workdir):
+    pfc = PerceptiveFrameworkCore('model.gguf')
+    pfc.llm = types.SimpleNamespace(client=FakeClient())
+    (workdir / "a.gguf").write_bytes(b'lora')
+    (workdir / "b.gguf").write_bytes(b'lora')
+    return pfc
+
+
+def test_adapter_stack_roundtrip():
+    assert Stem.read_adapter_stack() == []
+    stack = [{'adapter': 'a.gguf', 'weight': 1.0, 'created': '20240101000000'}]
+    Stem.write_adapter_stack(stack)
+    assert Stem.read_adapter_stack() == stack
+
+
+def test_attach_adapter_keeps_handle_for_reweighting(pfc, monkeypatch):
+    calls = fake_llama_cpp(monkeypatch)
+    pfc.attach_adapter('a.gguf', 0.5)
+    assert calls == [('init', b'a.gguf'), ('set', 'handle:a.gguf', 0.5)]
+    assert pfc.adapters == ['a.gguf']
+    assert pfc._adapter_weights == {'a.gguf': 0.5}
+    assert pfc.llm.client.resets == 1
+
+
+def test_attach_adapter_falls_back_to_legacy_merge(pfc, monkeypatch):
+    calls = fake_llama_cpp(monkeypatch, legacy=True)
+    pfc.attach_adapter('a.gguf', 1.0)
+    assert calls == [('merge', b'a.gguf', 1.0)]
+    assert pfc._adapter_handles == {}
+    assert pfc._adapter_weights == {'a.gguf': 1.0}
+
+
+def test_attach_missing_adapter_raises(pfc, monkeypatch):
+    fake_llama_cpp(monkeypatch)
+    with pytest.raises(FileNotFoundError):
+        pfc.attach_adapter('missing.gguf', 1.0)
+
+
+def test_reweight_adapters_applies_stack_weights_in_place(pfc, monkeypatch):
+    calls = fake_llama_cpp(monkeypatch)
+    Stem.write_adapter_stack([{'adapter': 'a.gguf', 'weight': 1.0, 'created': '1'},
+                              {'adapter': 'b.gguf', 'weight': 1.0, 'created': '2'}])
+    pfc.attach_adapter('a.gguf', 1.0)
+    pfc.attach_adapter('b.gguf', 1.0)
+    calls.clear()
+
+    pfc.reweight_adapters(0.25)
+
+    assert [entry['weight'] for entry in Stem.read_adapter_stack()] == [0.25, 0.25]
+    assert calls == [('set', 'handle:a.gguf', 0.25), ('set', 'handle:b.gguf', 0.25)]
+    assert pfc._adapter_weights == {'a.gguf': 0.25, 'b.gguf': 0.25}
+
+
+def test_reweight_merged_adapters_reloads_model(pfc, monkeypatch):
+    fake_llama_cpp(monkeypatch, legacy=True)
+    Stem.write_adapter_stack([{'adapter': 'a.gguf', 'weight': 1.0, 'created': '1'}])
+    pfc.attach_adapter('a.gguf', 1.0)
+    reloads = []
+    monkeypatch.setattr(pfc, 'unload', lambda: reloads.append('unload'))
+    monkeypatch.setattr(pfc, 'load', lambda: reloads.append('load'))
+
+    pfc.reweight_adapters(0.5)
+
+    assert reloads == ['unload', 'load']
+
+
+def test_reweight_without_model_only_updates_stack():
+    pfc = PerceptiveFrameworkCore('model.gguf')
+    Stem.write_adapter_stack([{'adapter': 'a.gguf', 'weight': 1.0, 'created': '1'}])
+    pfc.reweight_adapters(2.0)
+    assert Stem.read_adapter_stack()[0]['weight'] == 2.0
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from modules.PerceptiveFrameworkCore import Preempted
+
+from fakes import loaded_pfc
+
+
+class PreemptingStream:
+    """
+    Generation stream setting the preempt event after a given number of chunks.
+    """
+
+    def __init__(self, chunks, preempt, after):
+        self.chunks = chunks
+        self.preempt = preempt
+        self.after = after
+        self.closed = False
+
+    def __iter__(self):
+        for i, chunk in enumerate(self.chunks):
+            if i == self.after:
+                self.preempt.set()
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+def test_generation_stops_at_token_boundary(prompt_templates):
+    pfc = loaded_pfc()
+    preempt = asyncio.Event()
+    stream = PreemptingStream(['one ', 'two ', 'three '], preempt, after=1)
+    pfc.llm.stream = lambda prompt, **kwargs: stream
+
+    with pytest.raises(Preempted) as e:
+        pfc.invoke('prompt', task='dream_spinning', preempt=preempt)
+
+    assert e.value.partial == 'one two '
+    assert stream.closed
+
+
+def test_preempted_generation_resumes_from_partial_output(prompt_templates):
+    pfc = loaded_pfc('three four')
+
+    response = pfc.invoke('prompt ', task='dream_spinning', preempt=asyncio.Event(), resume_from='one two ')
+
+    assert response == 'one two three four '
+    assert pfc.llm.calls[0][0] == 'prompt one two '
+
+
+def test_set_preempt_event_stops_before_generation(prompt_templates):
+    pfc = loaded_pfc()
+    preempt = asyncio.Event()
+    preempt.set()
+
+    with pytest.raises(Preempted) as e:
+        pfc.invoke('prompt', task='dream_spinning', preempt=preempt, resume_from='partial ')
+
+    assert e.value.partial == 'partial '
+    assert pfc.llm.calls == []
+
+
+def test_generation_without_preempt_event_is_not_streamed(prompt_templates):
+    pfc = loaded_pfc('whole response')
+
+    assert pfc.invoke('prompt', task='dream_spinning') == 'whole response'
@@ -0,0 +1,87 @@
+import sys
+import types
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+from modules.PerceptiveFrameworkCore import PrefixCache
+
+
+class FakeRAMCache:
+    def __init__(self, capacity_bytes):
+        self.capacity_bytes = capacity_bytes
+        self.cache_state = OrderedDict()
+
+    @property
+    def cache_size(self):
+        return len(self.cache_state)
+
+    def _find_prefix_key(self, key):
+        matches = [stored for stored in self.cache_state if tuple(key[:len(stored)]) == stored]
+        return max(matches, key=len, default=None)
+
+    def __getitem__(self, key):
+        prefix_key = self._find_prefix_key(tuple(key))
+        if prefix_key is None:
+            raise KeyError("Key not found")
+        return self.cache_state[prefix_key]
+
+    def __contains__(self, key):
+        return self._find_prefix_key(tuple(key)) is not None
+
+    def __setitem__(self, key, value):
+        self.cache_state[tuple(key)] = value
+
+
+def longest_token_prefix(a, b):
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return length
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    module = types.ModuleType('llama_cpp')
+    module.Llama = types.SimpleNamespace(longest_token_prefix=longest_token_prefix)
+    module.LlamaRAMCache = FakeRAMCache
+    monkeypatch.setitem(sys.modules, 'llama_cpp', module)
+    return PrefixCache(1024)
+
+
+def state(tokens):
+    return types.SimpleNamespace(input_ids=np.array(tokens))
+
+
+def test_hits_count_restored_prefix_tokens_per_task(cache):
+    cache.task = 'dream_spinning'
+    cache[(1, 2, 3)] = state([1, 2, 3])
+
+    assert cache[(1, 2, 3, 4, 5)].input_ids.tolist() == [1, 2, 3]
+    cache.task = 'keyword_generation'
+    assert cache[(1, 2, 3, 9)].input_ids.tolist() == [1, 2, 3]
+
+    assert cache.stats == {'dream_spinning': {'lookups': 1, 'hits': 1, 'saved_tokens': 3},
+                           'keyword_generation': {'lookups': 1, 'hits': 1, 'saved_tokens': 3}}
+
+
+def test_misses_count_lookups_only(cache):
+    cache.task = 'human_interaction'
+
+    with pytest.raises(KeyError):
+        cache[(7, 8)]
+
+    assert cache.stats == {'human_interaction': {'lookups': 1, 'hits': 0, 'saved_tokens': 0}}
+
+
+def test_clear_drops_stored_states(cache):
+    cache[(1, 2)] = state([1, 2])
+    assert (1, 2, 3) in cache
+
+    cache.clear()
+
+    assert (1, 2, 3) not in cache
+    assert cache.cache_size == 0
@@ -0,0 +1,57 @@
+import pytest
+
+import config
+from modules.ReflectiveEvolutionMonitor import ReflectiveEvolutionMonitor
+from modules.AnteriorCingulate import AnteriorCingulate
+
+
+class ResidentPFC:
+    in_process = True
+
+    def __init__(self):
+        self.loaded = True
+        self.suspended = None
+
+    def suspend(self, reason):
+        self.loaded = False
+        self.suspended = reason
+
+
+class FakeGovernor:
+    def __init__(self, plan):
+        self.plan = plan
+
+    def plan_evaluation(self, model_path, resident_model=True):
+        return self.plan
+
+
+@pytest.fixture
+def gated(prompt_templates, monkeypatch):
+    evaluated = []
+    monkeypatch.setattr(AnteriorCingulate, 'gate', lambda self, model_path: evaluated.append(model_path) or True)
+    return evaluated
+
+
+def test_resident_model_is_released_for_evaluation(gated):
+    rem = ReflectiveEvolutionMonitor(ResidentPFC())
+
+    assert rem._evaluate_transplant()
+    assert rem.pfc.suspended == 'model evaluation'
+    assert rem.model_unloaded
+    assert gated == [config.model_path]
+
+
+def test_resident_model_is_kept_if_governor_allows(gated):
+    rem = ReflectiveEvolutionMonitor(ResidentPFC(), governor=FakeGovernor('start'))
+
+    assert rem._evaluate_transplant()
+    assert rem.pfc.loaded and not rem.model_unloaded
+    assert gated == [config.model_path]
+
+
+def test_evaluation_is_skipped_without_memory(gated):
+    rem = ReflectiveEvolutionMonitor(ResidentPFC(), governor=FakeGovernor('refuse'))
+
+    assert rem._evaluate_transplant()
+    assert rem.pfc.loaded
+    assert gated == []
@@ -0,0 +1,79 @@
+import asyncio
+
+from replay import parse_transcript, replay, LPMTarget, PFCTarget
+
+from fakes import loaded_pfc
+
+
+def test_parse_transcript_returns_user_turns():
+    transcript = ("Preamble without a speaker\n"
+                  "User: Hello there\n"
+                  "You: Hi! How can I help?\n"
+                  "User: Tell me about dreams,\nand about sleep.\n"
+                  "You: Dreams are...\n"
+                  "User:   \n")
+
+    assert parse_transcript(transcript) == ["Hello there", "Tell me about dreams,\nand about sleep."]
+
+
+def test_parse_transcript_ignores_speaker_names_inside_turns():
+    assert parse_transcript("User: Say 'You: hi'\nYou: You: hi\n") == ["Say 'You: hi'"]
+
+
+class EchoSession:
+    def __init__(self, fail_on):
+        self.fail_on = fail_on
+
+    async def respond(self, text):
+        if text == self.fail_on:
+            raise ValueError(text)
+        return text
+
+    async def close(self):
+        pass
+
+
+class EchoTarget:
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.sessions = 0
+
+    async def open_session(self):
+        self.sessions += 1
+        return EchoSession(self.fail_on)
+
+
+def test_replay_reports_turns_and_errors():
+    target = EchoTarget(fail_on='boom')
+    transcripts = [['a', 'b', 'c'], ['d', 'boom']]
+
+    report = asyncio.run(replay(target, transcripts, sessions=4, concurrency=2, rate=0, think_time=0, max_turns=2, seed=0))
+
+    assert target.sessions == 4
+    # Sessions replaying the second transcript fail on their second turn
+    assert report['turns'] == 2 + 1 + 2 + 1
+    assert report['errors'] == ['ValueError: boom', 'ValueError: boom']
+    assert report['peak_sessions_in_flight'] == 2
+
+
+def test_pfc_session_builds_conversation_prompt(prompt_templates):
+    pfc = loaded_pfc('Hi!')
+
+    async def converse():
+        session = await PFCTarget(pfc).open_session()
+        return [await session.respond('Hello'), await session.respond('How are you?')]
+
+    assert asyncio.run(converse()) == ['Hi!', 'Hi!']
+    assert pfc.llm.calls[1][0].endswith("Hello [/INST] Hi!</s><s> [INST] How are you? [/INST] ")
+
+
+def test_lpm_session_returns_response_without_newline(prompt_templates, capsys):
+    pfc = loaded_pfc('Hi there!')
+
+    async def converse():
+        session = await LPMTarget(pfc).open_session()
+        response = await session.respond('Hello')
+        await session.close()
+        return response
+
+    assert asyncio.run(converse()) == 'Hi there!'
@@ -0,0 +1,84 @@
+import sqlite3
+
+import pytest
+
+import config
+from modules.ResponseCache import ResponseCache
+
+
+@pytest.fixture
+def cache(workdir):
+    return ResponseCache(str(workdir / "cache" / "responses.sqlite"), capacity_bytes=10)
+
+
+def test_put_and_get_counts_hits_and_misses(cache):
+    assert cache.get('key') is None
+    cache.put('key', 'response')
+
+    assert cache.get('key') == 'response'
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_put_evicts_least_recently_used(cache, monkeypatch):
+    clock = iter(range(100))
+    monkeypatch.setattr('modules.ResponseCache.time.time', lambda: next(clock))
+    cache.put('a', 'aaaa')
+    cache.put('b', 'bbbb')
+    cache.get('a')
+
+    cache.put('c', 'cccc')
+
+    assert cache.get('a') == 'aaaa'
+    assert cache.get('b') is None
+    assert cache.get('c') == 'cccc'
+
+
+def test_invalidate_clears_open_caches(cache, workdir):
+    cache.put('key', 'response')
+
+    ResponseCache.invalidate(str(workdir / "cache" / "responses.sqlite"))
+
+    assert cache.get('key') is None
+
+
+def test_invalidate_missing_cache_is_noop(workdir):
+    ResponseCache.invalidate(str(workdir / "missing.sqlite"))
+
+    assert not (workdir / "missing.sqlite").exists()
+
+
+def test_make_key_depends_on_model_prompt_and_params():
+    key = ResponseCache.make_key('v1', 'prompt', {'temperature': 0.0, 'max_tokens': 10})
+
+    assert key == ResponseCache.make_key('v1', 'prompt', {'max_tokens': 10, 'temperature': 0.0})
+    assert key != ResponseCache.make_key('v2', 'prompt', {'temperature': 0.0, 'max_tokens': 10})
+    assert key != ResponseCache.make_key('v1', 'prompt ', {'temperature': 0.0, 'max_tokens': 10})
+    assert key != ResponseCache.make_key('v1', 'prompt', {'temperature': 0.0, 'max_tokens': 11})
+
+
+def test_only_deterministic_calls_are_cacheable(monkeypatch):
+    monkeypatch.setattr(config, 'response_cache_sampled', False)
+    monkeypatch.setattr(config, 'model_temp', 0.8)
+
+    assert ResponseCache.cacheable({'temperature': 0.0})
+    assert not ResponseCache.cacheable({'temperature': 0.7})
+    assert not ResponseCache.cacheable({})
+
+    monkeypatch.setattr(config, 'response_cache_sampled', True)
+    assert ResponseCache.cacheable({'temperature': 0.7})
+
+
+def test_locked_database_is_a_miss(cache, workdir):
+    cache.put('key', 'response')
+    cache._connection.execute("PRAGMA busy_timeout = 0")
+    other = sqlite3.connect(str(workdir / "cache" / "responses.sqlite"))
+    other.execute("BEGIN EXCLUSIVE")
+
+    assert cache.get('key') is None
+    cache.put('other', 'response')
+    assert cache.misses == 1
+
+    other.rollback()
+    other.close()
+    assert cache.get('key') == 'response'
+    assert cache.get('other') is None
@@ -0,0 +1,108 @@
+import pytest
+
+import config
+from modules.ShortTermMemory import ShortTermMemory
+
+
+@pytest.fixture
+def stm(workdir):
+    (workdir / "conversations").mkdir(exist_ok=True)
+    return ShortTermMemory()
+
+
+def test_cluster_keywords_joins_keywords_sharing_conversations(stm):
+    stm.memorize_keywords(['dreams', 'sleep'], 'a.txt')
+    stm.memorize_keywords(['sleep', 'memory'], 'b.txt')
+    stm.memorize_keywords(['music'], 'c.txt')
+
+    clusters = stm.cluster_keywords(max_keywords=10)
+
+    assert [sorted(cluster) for cluster in clusters] == [['dreams', 'memory', 'sleep'], ['music']]
+
+
+def test_cluster_keywords_splits_large_clusters(stm):
+    stm.memorize_keywords(['sleep', 'dreams', 'memory'], 'a.txt')
+    stm.memorize_keywords(['sleep', 'dreams'], 'b.txt')
+    stm.memorize_keywords(['sleep', 'night'], 'c.txt')
+
+    clusters = stm.cluster_keywords(max_keywords=2)
+
+    # The keyword with most conversations seeds the cluster with the one sharing most of them
+    assert clusters[0] == ['sleep', 'dreams']
+    assert sorted(keyword for cluster in clusters[1:] for keyword in cluster) == ['memory', 'night']
+    assert all(len(cluster) <= 2 for cluster in clusters)
+
+
+def test_cluster_keywords_of_empty_memory(stm):
+    assert stm.cluster_keywords() == []
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr('modules.ShortTermMemory.time.time', lambda: now[0])
+    return now
+
+
+def test_keywords_expire_after_ttl(stm, clock, monkeypatch):
+    monkeypatch.setattr(config, 'stm_ttl_days', 1)
+    stm.memorize_keywords(['old'], 'a.txt')
+    clock[0] += 2 * 86400
+    stm.memorize_keywords(['recent'], 'b.txt')
+
+    assert stm.recall_all_keywords() == ['recent']
+    assert stm.search_memories(['old']) == []
+
+
+def test_mentions_keep_keywords_alive(stm, clock, monkeypatch):
+    monkeypatch.setattr(config, 'stm_ttl_days', 1)
+    stm.memorize_keywords(['old', 'mentioned'], 'a.txt')
+    clock[0] += 0.75 * 86400
+    stm.memorize_keywords(['mentioned'], 'b.txt')
+    clock[0] += 0.75 * 86400
+    stm.memorize_keywords(['new'], 'c.txt')
+
+    assert sorted(stm.recall_all_keywords()) == ['mentioned', 'new']
+    assert sorted(stm.search_memories(['mentioned'])) == ['a.txt', 'b.txt']
+
+
+def test_lowest_scoring_keywords_are_evicted_above_capacity(stm, clock, monkeypatch):
+    monkeypatch.setattr(config, 'stm_capacity', 2)
+    monkeypatch.setattr(config, 'stm_half_life_days', 1)
+    stm.memorize_keywords(['frequent'], 'a.txt')
+    stm.memorize_keywords(['frequent'], 'b.txt')
+    stm.memorize_keywords(['frequent'], 'c.txt')
+    stm.memorize_keywords(['stale'], 'd.txt')
+    clock[0] += 86400
+    stm.memorize_keywords(['fresh'], 'e.txt')
+
+    # Three mentions a day ago outscore a fresh one, which outscores a single mention a day ago
+    assert sorted(stm.recall_all_keywords()) == ['frequent', 'fresh']
+    assert stm.recall_top_keywords(1) == ['frequent']
+
+
+def test_score_decays_with_half_life(monkeypatch):
+    monkeypatch.setattr(config, 'stm_half_life_days', 2)
+    stats = {'last_seen': 0.0, 'mentions': 4}
+
+    assert ShortTermMemory.score(stats, 0.0) == 4
+    assert ShortTermMemory.score(stats, 2 * 86400) == pytest.approx(2)
+
+
+def test_forgotten_keywords_lose_statistics(stm):
+    stm.memorize_keywords(['dreams', 'sleep'], 'a.txt')
+
+    stm.forget_keywords(['dreams'])
+
+    assert stm.recall_all_keywords() == ['sleep']
+    assert 'dreams' not in stm._read_meta({})
+
+
+def test_live_settings_are_read_at_call_time(stm, monkeypatch):
+    stm.memorize_keywords(['dreams', 'sleep', 'memory'], 'a.txt')
+
+    monkeypatch.setattr(config, 'stm_prompt_keywords', 2)
+    monkeypatch.setattr(config, 'dmn_cluster_max_keywords', 1)
+
+    assert len(stm.recall_top_keywords()) == 2
+    assert [len(cluster) for cluster in stm.cluster_keywords()] == [1, 1, 1]
@@ -0,0 +1,62 @@
+import numpy as np
+
+import config
+from modules.PerceptiveFrameworkCore import DraftModel
+
+from fakes import loaded_pfc
+
+
+class FakeDraftLlama:
+    def __init__(self, proposals):
+        self.proposals = list(proposals)
+
+    def generate(self, tokens, **kwargs):
+        yield from self.proposals.pop(0)
+
+
+def test_draft_model_counts_accepted_tokens_per_task():
+    draft = DraftModel(FakeDraftLlama([[5, 6, 7], [9]]), num_pred_tokens=3)
+    draft.task = 'keyword_generation'
+
+    assert list(draft(np.array([1, 2], dtype=np.intc))) == [5, 6, 7]
+    # The main model kept 5 and 6 of the proposal, then sampled 8
+    draft(np.array([1, 2, 5, 6, 8], dtype=np.intc))
+
+    assert draft.stats == {'keyword_generation': {'rounds': 1, 'drafted': 3, 'accepted': 2}}
+
+
+def test_draft_model_ignores_new_completions():
+    draft = DraftModel(FakeDraftLlama([[5], [6]]), num_pred_tokens=1)
+    draft(np.array([1, 2], dtype=np.intc))
+    draft(np.array([3, 4, 5], dtype=np.intc))
+    assert draft.stats == {}
+
+
+def test_report_separates_draft_and_main_model_throughput(prompt_templates, monkeypatch):
+    monkeypatch.setattr(config, 'draft_model_tasks', ['keyword_generation'])
+    monkeypatch.setattr(config, 'generation_stats_path', None)
+    pfc = loaded_pfc('main answer', draft_response='draft answer')
+
+    pfc.invoke('summarize this', task='keyword_generation')
+    pfc.invoke('hello there', task='human_interaction')
+
+    assert len(pfc.draft_llm.calls) == 1 and len(pfc.llm.calls) == 1
+    report = pfc.report()
+    assert report['keyword_generation']['draft_calls'] == 1
+    assert 'main_calls' not in report['keyword_generation']
+    assert report['human_interaction']['main_calls'] == 1
+    assert 'draft_tokens_per_second' in report['keyword_generation']
+
+
+def test_report_tokens_per_main_pass(prompt_templates, monkeypatch):
+    monkeypatch.setattr(config, 'generation_stats_path', None)
+    pfc = loaded_pfc()
+    pfc._draft_model = DraftModel(FakeDraftLlama([]), num_pred_tokens=4)
+    pfc._draft_model.stats = {'human_interaction': {'rounds': 2, 'drafted': 8, 'accepted': 4}}
+
+    pfc.invoke('hello', task='human_interaction')
+    entry = pfc.report()['human_interaction']
+
+    assert entry['acceptance_rate'] == 0.5
+    # Every main model pass yields the accepted draft tokens plus one token of its own
+    assert entry['tokens_per_main_pass'] == 3.0
@@ -0,0 +1,43 @@
+import subprocess
+import sys
+
+import pytest
+
+from modules.Stem import Stem
+
+from conftest import REPO_DIR
+
+
+def test_timed_phase_accumulates_durations(monkeypatch):
+    clock = iter([10.0, 10.5, 20.0, 20.25])
+    monkeypatch.setattr('modules.Stem.time.perf_counter', lambda: next(clock))
+    phases = {}
+
+    with Stem.timed_phase(phases, 'imports'):
+        pass
+    with Stem.timed_phase(phases, 'imports'):
+        pass
+
+    assert phases == {'imports': 0.75}
+
+
+def test_timed_phase_records_failed_phases():
+    phases = {}
+
+    with pytest.raises(RuntimeError):
+        with Stem.timed_phase(phases, 'model load'):
+            raise RuntimeError()
+
+    assert 'model load' in phases
+
+
+def test_modules_import_without_llm_dependencies():
+    code = ("import sys, config\n"
+            "from modules.CognitiveFeedbackRouter import CognitiveFeedbackRouter\n"
+            "from modules.PerceptiveFrameworkCore import PerceptiveFrameworkCore\n"
+            "heavy = [name for name in ('llama_cpp', 'langchain_community', 'modules.DefaultModeNetwork') if name in sys.modules]\n"
+            "assert not heavy, heavy\n")
+
+    result = subprocess.run([sys.executable, '-c', code], cwd=REPO_DIR, capture_output=True, text=True)
+
+    assert result.returncode == 0, result.stderr
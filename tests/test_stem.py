@@ -0,0 +1,82 @@
+import os
+import threading
+
+import pytest
+
+import config
+from modules import Stem as stem_module
+from modules.Stem import Stem
+
+
+def held_stripes():
+    return stem_module._held_locks.__dict__.get('stripes', {})
+
+
+def test_file_lock_is_reentrant_within_a_thread(workdir):
+    with Stem.file_lock("memory.json"):
+        with Stem.file_lock("memory.json"):
+            # Writing under the caller's lock takes it again
+            Stem.memory_write("memory.json", "content")
+        assert list(held_stripes().values()) == [1]
+
+    assert held_stripes() == {}
+    assert (workdir / "memory.json").read_text() == "content"
+
+
+def test_file_lock_excludes_other_threads(workdir):
+    acquired = threading.Event()
+
+    def lock_in_thread():
+        with Stem.file_lock("memory.json"):
+            acquired.set()
+
+    with Stem.file_lock("memory.json"):
+        thread = threading.Thread(target=lock_in_thread)
+        thread.start()
+        assert not acquired.wait(0.2)
+    thread.join(5)
+
+    assert acquired.is_set()
+
+
+def test_concurrent_updates_are_not_lost(workdir):
+    def increment():
+        for _ in range(20):
+            Stem.memory_update("counter.json", lambda count: count + 1, default=0)
+
+    threads = [threading.Thread(target=increment) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert Stem.memory_read("counter.json", 'json') == 80
+
+
+@pytest.mark.parametrize('durable', [False, True])
+def test_failed_replace_keeps_previous_content(workdir, durable):
+    Stem._replace("memory.txt", "previous", durable)
+
+    with pytest.raises(TypeError):
+        Stem._replace("memory.txt", None, durable)
+
+    assert (workdir / "memory.txt").read_text() == "previous"
+    assert os.listdir(workdir) == ["memory.txt"]
+
+
+def test_atomic_write_leaves_no_temporary_files(workdir):
+    Stem.atomic_write("memory.txt", "first")
+    Stem.atomic_write("memory.txt", "second")
+
+    assert (workdir / "memory.txt").read_text() == "second"
+    assert sorted(os.listdir(workdir)) == sorted(["memory.txt", config.io_lock_dir.split('/')[0]])
+
+
+def test_archive_moves_file_to_archive_directory(workdir):
+    (workdir / "dreams").mkdir()
+    (workdir / "dreams" / "dream_1.txt").write_text("a dream")
+
+    assert Stem.archive(os.path.join("dreams", "dream_1.txt"))
+
+    assert not (workdir / "dreams" / "dream_1.txt").exists()
+    assert (workdir / "dreams_archive" / "dream_1.txt").read_text() == "a dream"
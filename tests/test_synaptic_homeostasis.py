@@ -0,0 +1,125 @@
+import json
+
+import pytest
+
+import config
+from modules.SynapticHomeostasis import SynapticHomeostasis, NoveltyMonitor
+
+LONG_REACTION = ("Memories are consolidated during sleep when the hippocampus replays the experiences of the day "
+                 "and the cortex slowly integrates them into existing knowledge so that they last for years")
+
+
+def dream(stimulus, reaction):
+    return f"<s>[INST] {stimulus} [/INST] {reaction} </s>\n"
+
+
+@pytest.fixture
+def dreams_path(prompt_templates, workdir):
+    def write(*samples):
+        path = workdir / "dreams.txt"
+        path.write_text(''.join(samples))
+        return str(path)
+    return write
+
+
+def test_curate_drops_degenerate_samples(dreams_path):
+    path = dreams_path(dream("How do memories last?", LONG_REACTION),
+                       "<s>[INST] no end of the instruction </s>\n",
+                       dream("Empty answer?", ""),
+                       dream("**QUESTION** leaked", "a reaction"),
+                       dream("Short?", "Yes."))
+
+    curated_path, stats = SynapticHomeostasis(min_tokens=8).curate(path, seed=0)
+
+    assert stats['raw_samples'] == 5
+    assert stats['kept_samples'] == 1
+    assert stats['dropped_malformed'] == 1
+    assert stats['dropped_empty'] == 1
+    assert stats['dropped_marker_leak'] == 1
+    assert stats['dropped_length'] == 1
+    assert open(curated_path).read() == dream("How do memories last?", LONG_REACTION)
+
+
+def test_curate_drops_duplicates(dreams_path):
+    reordered = ' '.join(reversed(LONG_REACTION.split()))
+    path = dreams_path(dream("How do memories last?", LONG_REACTION),
+                       dream("How do memories LAST", LONG_REACTION + "."),
+                       dream("How do memories last?", LONG_REACTION.replace("years", "decades")),
+                       dream("What happens at night?", reordered),
+                       dream("What is a dream?", "A dream is a story the sleeping brain tells itself about the day"))
+
+    _, stats = SynapticHomeostasis(min_tokens=1).curate(path, seed=0)
+
+    assert stats['dropped_exact_duplicate'] == 1
+    assert stats['dropped_shingle_duplicate'] == 1
+    assert stats['dropped_embedding_duplicate'] == 1
+    assert stats['kept_samples'] == 2
+
+
+def test_curate_writes_statistics_and_shuffles_with_seed(dreams_path, workdir):
+    samples = [dream(f"Question number {i}?", f"Answer {i} " + ' '.join(f"word{i}x{j}" for j in range(10)))
+               for i in range(10)]
+    path = dreams_path(*samples)
+    homeostasis = SynapticHomeostasis(min_tokens=1)
+
+    curated_path, stats = homeostasis.curate(path, seed=1)
+    first = open(curated_path).read()
+    homeostasis.curate(path, seed=1)
+
+    assert open(curated_path).read() == first
+    assert sorted(first.splitlines()) == sorted(sample.strip() for sample in samples)
+    assert json.loads((workdir / "dreams_curation.json").read_text()) == stats
+    assert stats['kept_tokens'] == stats['raw_tokens']
+
+
+def test_curate_counts_tokens_with_given_tokenizer(dreams_path):
+    path = dreams_path(dream("How do memories last?", LONG_REACTION))
+
+    _, stats = SynapticHomeostasis(count_tokens=lambda text: 2 * len(text.split()), max_tokens=20).curate(path)
+
+    assert stats['raw_tokens'] == 2 * len(dream("How do memories last?", LONG_REACTION).split())
+    assert stats['dropped_length'] == 1
+
+
+def test_repeated_dreams_converge_after_minimum():
+    novelty = NoveltyMonitor(min_dreams=3, ngram=2, window=2, threshold=0.5)
+
+    scores = [novelty.observe("the hippocampus replays the day") for _ in range(3)]
+
+    assert scores == [1.0, 0.0, 0.0]
+    assert not novelty.converged(2)
+    assert novelty.converged(3)
+
+
+def test_novel_dreams_keep_dreaming():
+    novelty = NoveltyMonitor(min_dreams=1, ngram=2, window=2, threshold=0.5)
+
+    novelty.observe("the hippocampus replays the day")
+    novelty.observe("the cortex integrates memories slowly")
+    novelty.observe("dreams mix recent and remote experiences")
+
+    assert novelty.recent_novelty > 0.5
+    assert not novelty.converged(3)
+
+
+def test_primed_dreams_count_as_seen_but_not_for_the_window():
+    novelty = NoveltyMonitor(min_dreams=1, ngram=2, window=2, threshold=0.5)
+
+    novelty.prime("the hippocampus replays the day\nthe cortex integrates memories")
+
+    # Dreams of an interrupted session count towards the minimum, the window is filled by new ones
+    assert not novelty.converged(10)
+    assert novelty.observe("the hippocampus replays the day") == 0.0
+    assert novelty.diversity() == pytest.approx(8 / 12)
+
+
+def test_novelty_settings_are_read_at_creation(monkeypatch):
+    monkeypatch.setattr(config, 'dreams_min_num', 1)
+    monkeypatch.setattr(config, 'dream_novelty_window', 1)
+    monkeypatch.setattr(config, 'dream_novelty_threshold', 0.5)
+    novelty = NoveltyMonitor()
+
+    novelty.observe("a dream")
+    novelty.observe("a dream")
+
+    assert novelty.converged(2)
@@ -0,0 +1,97 @@
+import asyncio
+import queue
+import threading
+import time
+import types
+
+import pytest
+
+from modules import WorkerPool as worker_pool
+from modules.WorkerPool import WorkerPool, BACKGROUND
+
+
+class FakeProcess:
+    """
+    Worker process running in a thread, echoing the jobs it gets; the prompt 'crash' makes it exit.
+    """
+
+    def __init__(self, target, args, daemon):
+        self.jobs, self.results, self.worker_id, self.generation, _ = args
+        self.exitcode = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        self.results.put((self.generation, self.worker_id, None, None, None))
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            job_id, prompt, task, kwargs = job
+            if prompt == 'crash':
+                self.exitcode = -9
+                return
+            self.results.put((self.generation, self.worker_id, job_id, f"{task}:{prompt}:{sorted(kwargs)}", None))
+        self.exitcode = 0
+
+    def start(self):
+        self._thread.start()
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def terminate(self):
+        pass
+
+
+@pytest.fixture
+def engaged():
+    return asyncio.Event()
+
+
+@pytest.fixture
+def pool(monkeypatch, engaged):
+    context = types.SimpleNamespace(Queue=queue.Queue, Process=FakeProcess)
+    monkeypatch.setattr(worker_pool.multiprocessing, 'get_context', lambda method: context)
+    pool = WorkerPool(types.SimpleNamespace(), engaged, size=1)
+    yield pool
+    pool.close()
+
+
+def test_jobs_are_processed_by_workers(pool):
+    assert pool.invoke('prompt', task='dream_spinning', preempt=object(), max_tokens=10) == "dream_spinning:prompt:['max_tokens']"
+
+
+def test_background_jobs_wait_while_engaged(pool, engaged):
+    engaged.set()
+    background = pool.submit('ponder', task='perspective_explanation')
+    interactive = pool.submit('summarize', task='keyword_generation')
+
+    assert interactive.result(timeout=5) == 'keyword_generation:summarize:[]'
+    time.sleep(0.2)
+    assert not background.done()
+
+    engaged.clear()
+    assert background.result(timeout=5) == 'perspective_explanation:ponder:[]'
+
+
+def test_jobs_of_exited_workers_fail(pool):
+    crashed = pool.submit('crash', priority=BACKGROUND)
+    with pytest.raises(RuntimeError, match='worker 0 exited'):
+        crashed.result(timeout=5)
+
+    # No worker is left, so queued jobs fail too
+    with pytest.raises(RuntimeError, match='no background worker running'):
+        pool.submit('prompt').result(timeout=5)
+
+
+def test_restart_keeps_queued_jobs(pool, engaged):
+    engaged.set()
+    queued = pool.submit('ponder', task='perspective_explanation')
+
+    pool.restart()
+    engaged.clear()
+
+    assert queued.result(timeout=5) == 'perspective_explanation:ponder:[]'